@@ -0,0 +1,125 @@
+"""Verify the full contents of a zone on a nameserver, by zone transfer.
+
+Rather than query a nameserver once for each name, we transfer the whole zone
+by AXFR and compare it to the recordsets listed by the designate api. This
+also catches records that should have been removed.
+
+RRsets are compared as a dict mapping (name, type) to (ttl, records), where
+the name is absolute and the records are a frozenset of rdata text in dns
+presentation format.
+"""
+import dns.exception
+import dns.query
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+
+from ruiner.common import utils
+
+
+def rrsets_from_zone(zone):
+    """Return the rrsets of a dns.zone.Zone"""
+    rrsets = {}
+    for name, rdataset in zone.iterate_rdatasets():
+        if not name.is_absolute():
+            name = name.derelativize(zone.origin)
+        key = (name.to_text().lower(), dns.rdatatype.to_text(rdataset.rdtype))
+        rrsets[key] = (rdataset.ttl,
+                       frozenset(rd.to_text() for rd in rdataset))
+    return rrsets
+
+
+def rrsets_from_api(recordsets, default_ttl):
+    """Return the rrsets of a list of designate recordsets
+
+    :param default_ttl: the zone's ttl, for recordsets without a ttl
+    """
+    rrsets = {}
+    for rs in recordsets:
+        rdtype = dns.rdatatype.from_text(rs['type'])
+        # normalize the rdata text, e.g. "10  mail.poo.com." for an MX
+        records = frozenset(
+            dns.rdata.from_text(dns.rdataclass.IN, rdtype, r).to_text()
+            for r in rs['records']
+        )
+        ttl = rs['ttl'] if rs.get('ttl') is not None else default_ttl
+        rrsets[(rs['name'].lower(), rs['type'])] = (ttl, records)
+    return rrsets
+
+
+def transfer(zone_name, location, timeout=10):
+    """AXFR the zone from the nameserver at `host:port`. Return its rrsets"""
+    host, port = utils.split_host_port(location, 53)
+    xfr = dns.query.xfr(host, zone_name, port=port, timeout=timeout,
+                        lifetime=timeout, relativize=False)
+    return rrsets_from_zone(dns.zone.from_xfr(xfr, relativize=False))
+
+
+class ZoneDiff(object):
+    """The differences between the expected and actual rrsets of a zone.
+
+    :ivar missing: keys of rrsets expected, but not found
+    :ivar extra: keys of rrsets found, but not expected
+    :ivar mismatched: a dict mapping keys to (expected, actual) for rrsets
+        with a different ttl or records
+    :ivar error: the exception if the zone transfer failed, or None
+    """
+
+    def __init__(self, expected=None, actual=None, error=None):
+        self.error = error
+        expected = expected or {}
+        actual = actual or {}
+        self.missing = sorted(set(expected) - set(actual))
+        self.extra = sorted(set(actual) - set(expected))
+        self.mismatched = dict(
+            (key, (expected[key], actual[key]))
+            for key in set(expected) & set(actual)
+            if expected[key] != actual[key]
+        )
+
+    @property
+    def ok(self):
+        return (self.error is None and not self.missing and not self.extra
+                and not self.mismatched)
+
+    def __str__(self):
+        if self.error is not None:
+            return "transfer failed: %r" % self.error
+        if self.ok:
+            return "ok"
+        lines = []
+        for key in self.missing:
+            lines.append("missing %s %s" % key)
+        for key in self.extra:
+            lines.append("extra %s %s" % key)
+        for key, (expected, actual) in sorted(self.mismatched.items()):
+            lines.append("mismatched %s %s: expected %s %s, found %s %s" % (
+                key + (expected[0], sorted(expected[1]),
+                       actual[0], sorted(actual[1]))))
+        return "; ".join(lines)
+
+
+def verify_zone(zone_name, expected, nameservers, ignore_types=(),
+                timeout=10):
+    """Transfer the zone from each nameserver, and compare it to the expected
+    rrsets.
+
+    :param expected: the rrsets from the api. see rrsets_from_api()
+    :param nameservers: a dict mapping names to locations (`host:port`)
+    :param ignore_types: rrset types to leave out of the comparison
+    :return: a dict mapping nameserver names to a ZoneDiff
+    """
+    def keep(rrsets):
+        return dict((k, v) for k, v in rrsets.items()
+                    if k[1] not in ignore_types)
+
+    diffs = {}
+    for name, location in nameservers.items():
+        try:
+            actual = transfer(zone_name, location, timeout=timeout)
+        except (dns.exception.DNSException, EnvironmentError) as e:
+            diffs[name] = ZoneDiff(error=e)
+        else:
+            diffs[name] = ZoneDiff(keep(expected), keep(actual))
+    return diffs
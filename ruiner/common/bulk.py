@@ -0,0 +1,177 @@
+"""Run many api requests concurrently, at a limited rate.
+
+    run = api.create_zones(100, workers=10, rate=20)
+    for result in run:              # results stream back as they complete
+        print result.key, result.status, result.latency
+    print run.summary.as_dict()     # {'total': 100, 'statuses': {202: 97,
+                                    #  413: 3}, 'errors': 0, ...}
+"""
+import collections
+import math
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+class TokenBucket(object):
+    """A thread-safe rate limiter. Tokens are added at `rate` per second, up
+    to `burst` tokens. Each request takes a token, waiting if there are none.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available"""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Result(object):
+    """The outcome of one request in a bulk operation
+
+    :ivar key: identifies the request, e.g. the zone id for a delete
+    :ivar resp: the response, or None if the request raised an exception
+    :ivar error: the exception, or None
+    :ivar start: when the request was sent (time.time())
+    :ivar latency: the seconds until the response
+    """
+
+    def __init__(self, key, resp, error, start, latency):
+        self.key = key
+        self.resp = resp
+        self.error = error
+        self.start = start
+        self.latency = latency
+
+    def __repr__(self):
+        return "Result(%r, status=%s, latency=%.3f)" % (
+            self.key, self.status, self.latency)
+
+    @property
+    def status(self):
+        """The status code, or None if the request failed"""
+        return self.resp.status_code if self.resp is not None else None
+
+    @property
+    def ok(self):
+        return self.resp is not None and self.resp.ok
+
+
+def percentile(values, p):
+    """Return the pth percentile (0 <= p <= 100) of the values, by the
+    nearest-rank method, or None if there are no values"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(0, rank - 1)]
+
+
+class Summary(object):
+    """Counts the results of a bulk operation by status code"""
+
+    def __init__(self):
+        self.statuses = collections.Counter()
+        self.errors = 0
+        self.latencies = []
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            if result.error is not None:
+                self.errors += 1
+            else:
+                self.statuses[result.status] += 1
+            self.latencies.append(result.latency)
+            end = result.start + result.latency
+            if self.first_start is None or result.start < self.first_start:
+                self.first_start = result.start
+            if self.last_end is None or end > self.last_end:
+                self.last_end = end
+
+    @property
+    def total(self):
+        return sum(self.statuses.values()) + self.errors
+
+    def count(self, low, high=None):
+        """Return the number of responses with a status in [low, high]"""
+        high = low if high is None else high
+        return sum(n for status, n in self.statuses.items()
+                   if low <= status <= high)
+
+    def as_dict(self):
+        with self._lock:
+            elapsed = (self.last_end - self.first_start
+                       if self.first_start is not None else 0)
+            return {
+                'total': self.total,
+                'statuses': dict(self.statuses),
+                '2xx': self.count(200, 299),
+                '413': self.count(413),
+                '5xx': self.count(500, 599),
+                'errors': self.errors,
+                'elapsed': elapsed,
+                'throughput': self.total / elapsed if elapsed else None,
+                'latency': dict(
+                    ('p%s' % p, percentile(self.latencies, p))
+                    for p in (50, 90, 99, 100)
+                ),
+            }
+
+
+class BulkRun(object):
+    """Calls each function on a pool of worker threads. Iterate over the
+    BulkRun to get each Result as it completes.
+
+    :param tasks: an iterable of (key, func), where func sends a request and
+        returns the response
+    :param workers: the max number of requests in flight
+    :param rate: the max requests per second, or None for no limit
+    """
+
+    def __init__(self, tasks, workers=10, rate=None):
+        self.tasks = tasks
+        self.workers = workers
+        self.limiter = TokenBucket(rate) if rate else None
+        self.summary = Summary()
+
+    def __iter__(self):
+        pool = ThreadPool(self.workers)
+        try:
+            for result in pool.imap_unordered(self._call, self.tasks):
+                self.summary.add(result)
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def wait(self):
+        """Run every request. Return the results, in order of completion"""
+        return list(self)
+
+    def _call(self, task):
+        key, func = task
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.time()
+        try:
+            resp, error = func(), None
+        except Exception as e:
+            resp, error = None, e
+        return Result(key, resp, error, start, time.time() - start)
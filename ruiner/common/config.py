@@ -1,6 +1,7 @@
 import os.path
 
 from oslo_config import cfg
+from oslo_config import types
 
 
 def get_location(name='ruiner.conf'):
@@ -11,17 +12,89 @@ def get_location(name='ruiner.conf'):
 
 cfg.CONF.register_group(cfg.OptGroup('ruiner'))
 cfg.CONF.register_group(cfg.OptGroup('ruiner:colorlog'))
+cfg.CONF.register_group(cfg.OptGroup('ruiner:benchmark'))
 
 cfg.CONF.register_opts([
-    cfg.IntOpt("interval", default=3),
+    cfg.IntOpt("interval", default=3,
+               help="The max seconds between polls in a waiter."),
+    cfg.StrOpt("poll_strategy", default="exponential",
+               choices=["fixed", "exponential", "hint"],
+               help="How waiters schedule their polls. 'fixed' polls every "
+                    "`interval` seconds. 'exponential' starts at "
+                    "poll_initial_interval and backs off up to `interval`. "
+                    "'hint' is 'exponential', plus extra polls when "
+                    "designate.conf's worker settings predict a change."),
+    cfg.FloatOpt("poll_initial_interval", default=0.25),
+    cfg.FloatOpt("serial_watch_interval", default=0.2,
+                 help="How often to sample the SOA serials of watched zones "
+                      "on the nameservers, in seconds."),
     cfg.IntOpt("timeout", default=120),
     cfg.IntOpt("service_startup_wait_time", default=15,
                help="How to wait after `docker-compose up` for services to "
-                    "be ready."),
+                    "be ready, when readiness_probes is disabled."),
+    cfg.BoolOpt("readiness_probes", default=True,
+                help="Poll each service until it responds, instead of "
+                     "sleeping for service_startup_wait_time."),
+    cfg.IntOpt("service_startup_timeout", default=120,
+               help="How long to wait for the readiness probes to pass."),
     cfg.StrOpt("designate_git_url",
                default="https://github.com/openstack/designate.git"),
     cfg.StrOpt("designate_version", default="master"),
+    cfg.BoolOpt("image_cache", default=True,
+                help="Tag the designate-base image by a hash of its inputs, "
+                     "and skip the build if that image already exists."),
+    cfg.BoolOpt("inject_designate_conf", default=False,
+                help="Build the designate-base image with the default "
+                     "designate.conf and pools.yml, and bind mount each "
+                     "test's files into the containers at startup. This "
+                     "lets one image serve every test configuration."),
+    cfg.BoolOpt("reuse_environments", default=False,
+                help="Keep deployed stacks between tests. A test reuses a "
+                     "stack with an identical designate configuration, "
+                     "which is reset (not torn down) after each test."),
+    cfg.BoolOpt("warm_pool", default=False,
+                help="Lease environments deployed in advance by `ruiner "
+                     "pool`, when one matches the test's configuration."),
+    cfg.IntOpt("warm_pool_size", default=4,
+               help="How many ready environments `ruiner pool` keeps."),
+    cfg.StrOpt("warm_pool_dir", default="",
+               help="Where `ruiner pool` tracks environments. Defaults to "
+                    "designate-carina/tmp/pool."),
+    cfg.StrOpt("dataset_dir", default="",
+               help="Where database dumps of datasets are kept. Defaults to "
+                    "designate-carina/tmp/datasets."),
+    cfg.IntOpt("dataset_timeout", default=7200,
+               help="How long to wait for a generated dataset's zones to go "
+                    "ACTIVE."),
+    cfg.StrOpt("designate_conf_path", default="/etc/designate/designate.conf",
+               help="Where designate.conf lives inside the containers."),
+    cfg.StrOpt("pools_yaml_path", default="/etc/designate/pools.yml",
+               help="Where pools.yml lives inside the containers."),
+    cfg.StrOpt("docker_backend", default="compose",
+               choices=["compose", "engine"],
+               help="How to manage running containers. 'compose' runs a "
+                    "docker-compose command for each operation. 'engine' "
+                    "calls the Docker Engine API over docker_socket."),
+    cfg.StrOpt("docker_socket", default="/var/run/docker.sock"),
+    cfg.IntOpt("stop_timeout", default=2,
+               help="Seconds for containers to stop when an environment is "
+                    "torn down, before they are killed."),
+    cfg.BoolOpt("background_teardown", default=False,
+                help="Tear down each test's environment in the background, "
+                     "so the next test can start. Failures are reported "
+                     "in the summary at the end of the test session."),
+    cfg.IntOpt("container_event_timeout", default=30,
+               help="How long to wait for a killed or started container's "
+                    "die or start event."),
     cfg.StrOpt("log_dir", default="./ruiner-logs"),
+    cfg.IntOpt("api_pool_size", default=10,
+               help="How many keep-alive connections to the designate api "
+                    "to hold open."),
+    cfg.IntOpt("api_retry_deadline", default=120,
+               help="The max seconds to spend retrying an api request."),
+    cfg.FloatOpt("api_hedge_after", default=None,
+                 help="Send a second GET if the first has no response after "
+                      "this many seconds. Unset to disable hedging."),
 ], group='ruiner')
 
 cfg.CONF.register_opts([
@@ -32,5 +105,32 @@ cfg.CONF.register_opts([
     cfg.StrOpt('critical_color', default='red'),
 ], group='ruiner:colorlog')
 
+cfg.CONF.register_opts([
+    cfg.BoolOpt('enabled', default=False,
+                help="Run the benchmarks. They deploy their own environments "
+                     "and take minutes, so they are skipped by default."),
+    cfg.FloatOpt('rate', default=2,
+                 help="Api requests per second to send during a benchmark."),
+    cfg.IntOpt('duration', default=30,
+               help="Seconds to keep creating zones. The benchmark creates "
+                    "rate * duration zones."),
+    cfg.IntOpt('workers', default=10,
+               help="The max api requests in flight."),
+    cfg.IntOpt('recordsets_per_zone', default=2),
+    cfg.FloatOpt('status_interval', default=0.5,
+                 help="How often to list zones to time status changes."),
+    cfg.ListOpt('large_zone_sizes', item_type=types.Integer(),
+                default=[100, 1000, 10000],
+                help="The numbers of recordsets to seed zones with, for the "
+                     "large zone benchmark."),
+    cfg.IntOpt('large_zone_samples', default=5,
+               help="How many single recordset changes to time in each "
+                    "large zone."),
+    cfg.FloatOpt('seed_rate', default=50,
+                 help="Api requests per second to seed large zones with."),
+    cfg.IntOpt('seed_timeout', default=1800,
+               help="How long to wait for a seeded zone to go ACTIVE."),
+], group='ruiner:benchmark')
+
 
 cfg.CONF(args=[], default_config_files=[get_location()])
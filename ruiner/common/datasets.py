@@ -0,0 +1,185 @@
+"""Pre-seeded designate databases, for tests at a realistic scale.
+
+A test declares `dataset = "100k-zones"`. The first time a dataset is used
+with a given designate version, it is generated through the api in the
+test's stack and a gzipped mysqldump of designate's database is saved. Later
+tests restore the dump into their fresh stack, which takes seconds instead
+of hours.
+
+Only the database is restored. The nameservers don't have the dataset's
+zones, so these datasets suit tests of the api, central, and the
+worker/producer tasks that scale with the size of the database.
+"""
+import fcntl
+import os
+import time
+import urlparse
+
+from ruiner.common import images
+from ruiner.common import utils
+from ruiner.common.config import cfg
+from ruiner.common.ini import IniFile
+
+LOG = utils.create_logger(__name__, 'datasets.log')
+
+# where the dump is written inside the mysql container
+CONTAINER_SQL_PATH = '/tmp/ruiner-dataset.sql'
+CONTAINER_DUMP_PATH = CONTAINER_SQL_PATH + '.gz'
+
+# the last line of a dump that mysqldump finished writing
+DUMP_TRAILER = '-- Dump completed'
+
+
+class DatasetError(Exception):
+    pass
+
+
+def zones_dataset(n):
+    """Return a generator of a dataset of n ACTIVE zones"""
+    def generate(api, logger, timeout):
+        logger.info("creating %s zones", n)
+        run = api.create_zones(n)
+        run.wait()
+        summary = run.summary.as_dict()
+        logger.info("created zones: %s", summary)
+        if summary['2xx'] != n:
+            raise DatasetError("failed to create %s zones: %s" % (n, summary))
+
+        end = time.time() + timeout
+        while True:
+            pending = sum(1 for _ in api.iter_zones(
+                page_size=1000, params={'status': 'PENDING'}))
+            if not pending:
+                break
+            if time.time() > end:
+                raise DatasetError("%s zones still PENDING after %ss"
+                                   % (pending, timeout))
+            logger.info("waiting on %s PENDING zones", pending)
+            time.sleep(5)
+
+        errored = sum(1 for _ in api.iter_zones(
+            page_size=1000, params={'status': 'ERROR'}))
+        if errored:
+            raise DatasetError("%s of %s zones went to ERROR" % (errored, n))
+    return generate
+
+
+# dataset name -> generate(api, logger, timeout)
+DATASETS = {
+    '1k-zones': zones_dataset(1000),
+    '10k-zones': zones_dataset(10000),
+    '100k-zones': zones_dataset(100000),
+}
+
+
+def snapshot_dir(carina_dir):
+    return cfg.CONF.ruiner.dataset_dir or os.path.join(
+        carina_dir, 'tmp', 'datasets')
+
+
+def snapshot_name(name):
+    """Return the filename of the dataset's dump. Dumps are keyed by the
+    designate version, since the schema changes between versions."""
+    key = images.cache_key(cfg.CONF.ruiner.designate_git_url,
+                           cfg.CONF.ruiner.designate_version, [])
+    return "%s-%s.sql.gz" % (name, key)
+
+
+def mysql_args(designate_conf, program='mysql'):
+    """Return the args to run the mysql client (or mysqldump) against
+    designate's database, and the database name, from designate.conf"""
+    conf = IniFile(designate_conf)
+    url = urlparse.urlsplit(conf.get("storage:sqlalchemy", "connection"))
+    args = [program, "-u", url.username or "root"]
+    if url.password:
+        args.append("-p%s" % url.password)
+    return args, url.path.lstrip('/')
+
+
+class DatasetCache(object):
+    """Restores dataset dumps into stacks, generating and saving the dump
+    on first use. A lock per dataset ensures only one test process generates
+    it, while the others wait and then restore it.
+    """
+
+    def __init__(self, logger, directory):
+        self.log = logger
+        self.dir = directory
+        utils.mkdirs(directory)
+
+    def ensure(self, name, docker_composer, designate_conf, api, timeout):
+        """Load the dataset into the stack's database.
+
+        :return: True if the dataset was restored from a dump, False if it
+            was generated
+        """
+        if name not in DATASETS:
+            raise DatasetError("unknown dataset %r. Choose from: %s"
+                               % (name, ", ".join(sorted(DATASETS))))
+        path = os.path.join(self.dir, snapshot_name(name))
+        with open(path + '.lock', 'w') as f:
+            self.log.debug("acquiring dataset lock %s.lock", path)
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(path):
+                    self.restore(path, docker_composer, designate_conf)
+                    return True
+                self.generate(name, path, docker_composer, designate_conf,
+                              api, timeout)
+                return False
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def generate(self, name, path, docker_composer, designate_conf, api,
+                 timeout):
+        self.log.info("generating dataset %s", name)
+        start = time.time()
+        DATASETS[name](api, self.log, timeout)
+        self.snapshot(path, docker_composer, designate_conf)
+        LOG.info("GENERATED %s in %.1fs -> %s", name, time.time() - start,
+                 path)
+
+    def _exec(self, docker_composer, cmd, description):
+        """Run the command in the mysql container. Return its output."""
+        out, err, ret = docker_composer.exec_('mysql', cmd)
+        if ret != 0:
+            raise DatasetError("failed to %s (exit %s): %s"
+                               % (description, ret, err.strip()))
+        return out
+
+    def snapshot(self, path, docker_composer, designate_conf):
+        """Dump the database to path"""
+        args, database = mysql_args(designate_conf, 'mysqldump')
+        args.extend(["--single-transaction", "--databases", database])
+        # dump, check, and compress in separate steps. in a pipeline, the
+        # exit status of a failed mysqldump would be lost
+        script = '%s > %s' % (" ".join(args), CONTAINER_SQL_PATH)
+        self._exec(docker_composer, ["sh", "-c", script], "dump the database")
+        trailer = self._exec(docker_composer,
+                             ["tail", "-n", "1", CONTAINER_SQL_PATH],
+                             "read the dump")
+        if not trailer.startswith(DUMP_TRAILER):
+            raise DatasetError("the dump is incomplete. it ends with: %r"
+                               % trailer)
+        self._exec(docker_composer, ["gzip", "-f", CONTAINER_SQL_PATH],
+                   "compress the dump")
+
+        # copy to a temp file first, so that a partial dump is never restored
+        tmp_path = path + '.tmp'
+        utils.require_success(
+            docker_composer.copy_from('mysql', CONTAINER_DUMP_PATH, tmp_path))
+        os.rename(tmp_path, path)
+
+    def restore(self, path, docker_composer, designate_conf):
+        """Load the dump at path into the database"""
+        start = time.time()
+        utils.require_success(
+            docker_composer.copy_to('mysql', path, CONTAINER_DUMP_PATH))
+        self._exec(docker_composer, ["gunzip", "-f", CONTAINER_DUMP_PATH],
+                   "decompress the dump")
+        args, _ = mysql_args(designate_conf)
+        script = '%s < %s' % (" ".join(args), CONTAINER_SQL_PATH)
+        self._exec(docker_composer, ["sh", "-c", script], "load the dump")
+        self.log.info("restored %s in %.1fs", os.path.basename(path),
+                      time.time() - start)
+        LOG.info("RESTORED %s in %.1fs", path, time.time() - start)
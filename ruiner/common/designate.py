@@ -1,18 +1,146 @@
 import json
+import random
+import threading
+import time
+import Queue
+
 import requests
+import requests.adapters
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
 
+import bulk
 import utils
 
 LOG = utils.create_logger(__name__)
 
 
+class RequestFailed(Exception):
+    """A request failed on every attempt allowed by the retry policy"""
+
+
+class ListFailed(Exception):
+    """A page of a listing returned an unsuccessful response"""
+
+    def __init__(self, resp):
+        super(ListFailed, self).__init__(
+            "GET %s returned %s" % (resp.url, resp.status_code))
+        self.resp = resp
+
+
+class RetryPolicy(object):
+    """Decides which requests to retry, and how long to wait in between.
+
+    Subclass this to customize retries for a client. The delay between
+    attempts backs off exponentially, with "full jitter": a random delay up to
+    `backoff * 2**n`, capped at `max_backoff`.
+
+    Only idempotent methods are retried after a timeout or a retry status. A
+    POST that timed out may have created the zone anyway, so a POST is only
+    retried if it was never sent (e.g. the connection was refused).
+    """
+
+    retry_exceptions = (requests.Timeout, requests.ConnectionError)
+
+    # methods that are safe to send more than once
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, attempts=5, backoff=0.5, max_backoff=10,
+                 deadline=None, retry_statuses=(503,), hedge_after=None):
+        """
+        :param attempts: the max number of tries for a request
+        :param deadline: the max number of seconds to spend on a request,
+            across all attempts. None means no limit.
+        :param retry_statuses: retry responses with these status codes
+        :param hedge_after: if a GET has not completed after this many
+            seconds, send a second identical request and use whichever
+            response comes first. None disables hedging.
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.retry_statuses = retry_statuses
+        self.hedge_after = hedge_after
+
+    def should_retry(self, resp, method='GET'):
+        return (method.upper() in self.idempotent_methods and
+                resp.status_code in self.retry_statuses)
+
+    def should_retry_error(self, error, method='GET'):
+        """Return True to retry after one of the retry_exceptions"""
+        return (method.upper() in self.idempotent_methods or
+                not was_sent(error))
+
+    def delay(self, attempt):
+        """Return the seconds to sleep after the given (zero-based) attempt"""
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def should_hedge(self, method):
+        return self.hedge_after is not None and method == 'GET'
+
+
+def was_sent(error):
+    """Return False if the request failed before any of it was sent, when
+    the connection could not be opened. Otherwise, the server may have acted
+    on it."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return False
+    if isinstance(error, requests.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return not isinstance(reason, (urllib3_exceptions.NewConnectionError,
+                                       urllib3_exceptions.ConnectTimeoutError))
+    return True
+
+
 class Client(object):
+    """An http client that keeps connections alive, in a pool of up to
+    `pool_size` connections. It's safe to share a client between threads.
+    """
 
-    def __init__(self, endpoint, headers=None, timeout=3, retries=5):
+    def __init__(self, endpoint, headers=None, timeout=3, retries=5,
+                 pool_size=10, retry_policy=None):
+        """
+        :param retries: the number of attempts per request, if no
+            retry_policy is given
+        :param retry_policy: a RetryPolicy
+        """
         self.retries = retries
         self.endpoint = endpoint
         self.timeout = timeout
         self.headers = headers or {}
+        self.retry_policy = retry_policy or RetryPolicy(attempts=retries)
+        self.pool_size = pool_size
+
+        # block when all connections are in use, rather than opening extra
+        # connections that are thrown away after one request
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+        )
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def close(self):
+        self.session.close()
+
+    def connection_stats(self):
+        """Return a dict of counters for the connection pool:
+
+            {'requests': 20, 'connections': 2, 'reused': 18}
+        """
+        stats = {'requests': 0, 'connections': 0}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+        stats['reused'] = stats['requests'] - stats['connections']
+        return stats
 
     def _inject_default_request_args(self, *args, **kwargs):
         if 'timeout' not in kwargs:
@@ -22,33 +150,112 @@ class Client(object):
         kwargs['headers'] = headers
         return args, kwargs
 
-    def _do_request(self, f):
-        for _ in range(self.retries):
+    def _do_request(self, method, *args, **kwargs):
+        """Send the request, retrying according to the retry policy.
+
+        :return: the response. This may be a response that the policy would
+            retry (e.g. a 503), if we run out of attempts.
+        :raise RequestFailed: if no attempt got a response
+        """
+        policy = self.retry_policy
+        start = time.time()
+        end = None if policy.deadline is None else start + policy.deadline
+        timeout = kwargs.get('timeout')
+        resp = error = None
+        attempts = 0
+
+        for attempt in range(policy.attempts):
+            if end is not None and timeout is not None:
+                # don't let a single attempt overrun the deadline
+                kwargs['timeout'] = max(0.001, min(timeout, end - time.time()))
+
+            attempts += 1
+            error = None
             try:
-                return f()
-            except requests.Timeout as e:
-                LOG.warning(str(e))
-        raise Exception("Request timed out after %s retries", self.retries)
+                resp = self._send(method, *args, **kwargs)
+            except policy.retry_exceptions as e:
+                resp, error = None, e
+                LOG.warning("%s %s failed (attempt %s/%s): %s", method,
+                            kwargs.get('url'), attempt + 1, policy.attempts, e)
+                if not policy.should_retry_error(e, method):
+                    break
+            else:
+                if not policy.should_retry(resp, method):
+                    return resp
+                LOG.warning("%s %s returned %s (attempt %s/%s)", method,
+                            kwargs.get('url'), resp.status_code, attempt + 1,
+                            policy.attempts)
+
+            delay = policy.delay(attempt)
+            is_last = attempt + 1 >= policy.attempts
+            if is_last or (end is not None and time.time() + delay >= end):
+                break
+            time.sleep(delay)
+
+        if resp is not None:
+            return resp
+        raise RequestFailed("%s %s failed after %s attempts in %.1fs: %s" % (
+            method, kwargs.get('url'), attempts, time.time() - start,
+            error))
+
+    def _send(self, method, *args, **kwargs):
+        def send():
+            return self.session.request(method, *args, **kwargs)
+
+        if self.retry_policy.should_hedge(method):
+            return self._send_hedged(send, self.retry_policy.hedge_after)
+        return send()
+
+    def _send_hedged(self, send, hedge_after):
+        """Call send(). If it takes longer than hedge_after seconds, call
+        send() again concurrently. Return the first response."""
+        results = Queue.Queue()
+
+        def run():
+            try:
+                results.put((send(), None))
+            except Exception as e:
+                results.put((None, e))
+
+        def spawn():
+            t = threading.Thread(target=run)
+            t.daemon = True
+            t.start()
+
+        spawn()
+        try:
+            resp, error = results.get(timeout=hedge_after)
+        except Queue.Empty:
+            LOG.debug("no response after %ss. hedging request", hedge_after)
+            spawn()
+            resp, error = results.get()
+            if error is not None:
+                # the other request may yet succeed
+                resp, error = results.get()
+
+        if error is not None:
+            raise error
+        return resp
 
     def get(self, *args, **kwargs):
         args, kwargs = self._inject_default_request_args(*args, **kwargs)
-        return self._do_request(lambda: requests.get(*args, **kwargs))
+        return self._do_request('GET', *args, **kwargs)
 
     def post(self, *args, **kwargs):
         args, kwargs = self._inject_default_request_args(*args, **kwargs)
-        return self._do_request(lambda: requests.post(*args, **kwargs))
+        return self._do_request('POST', *args, **kwargs)
 
     def put(self, *args, **kwargs):
         args, kwargs = self._inject_default_request_args(*args, **kwargs)
-        return self._do_request(lambda: requests.put(*args, **kwargs))
+        return self._do_request('PUT', *args, **kwargs)
 
     def patch(self, *args, **kwargs):
         args, kwargs = self._inject_default_request_args(*args, **kwargs)
-        return self._do_request(lambda: requests.patch(*args, **kwargs))
+        return self._do_request('PATCH', *args, **kwargs)
 
     def delete(self, *args, **kwargs):
         args, kwargs = self._inject_default_request_args(*args, **kwargs)
-        return self._do_request(lambda: requests.delete(*args, **kwargs))
+        return self._do_request('DELETE', *args, **kwargs)
 
 
 class API(Client):
@@ -58,15 +265,59 @@ class API(Client):
         "Accept": "application/json",
     }
 
-    def __init__(self, endpoint, timeout=60):
+    def __init__(self, endpoint, timeout=60, pool_size=10,
+                 retry_policy=None):
         super(API, self).__init__(
             endpoint=endpoint,
             timeout=timeout,
             headers=self.JSON_HEADERS,
+            pool_size=pool_size,
+            retry_policy=retry_policy,
         )
 
-    def list_zones(self):
-        return self.get(url="%s/v2/zones" % self.endpoint)
+    def list_zones(self, params=None):
+        """List the first page of zones.
+
+        :param params: query params, for pagination and filtering. e.g.
+            {'limit': 100, 'status': 'ACTIVE'}
+        """
+        return self.get(url="%s/v2/zones" % self.endpoint, params=params)
+
+    def iter_items(self, url, key, page_size=100, params=None):
+        """Yield each item of a listing, fetching one page at a time as the
+        caller consumes the items. Only one page is held in memory.
+
+        :param key: the key of the list of items in each page, e.g. 'zones'
+        :param page_size: the number of items per page (the `limit` param)
+        :raise ListFailed: when a page returns an unsuccessful response
+        """
+        params = dict(params or {})
+        params['limit'] = page_size
+        while url:
+            resp = self.get(url=url, params=params)
+            if not resp.ok:
+                raise ListFailed(resp)
+            page = resp.json()
+            url = page.get('links', {}).get('next')
+            # the next link includes the query params
+            params = None
+            for item in page[key]:
+                yield item
+
+    def iter_zones(self, page_size=100, params=None):
+        """Yield every zone, following the pagination links
+
+        :param params: query params for filtering, e.g. {'status': 'ERROR'}
+        """
+        return self.iter_items("%s/v2/zones" % self.endpoint, 'zones',
+                               page_size=page_size, params=params)
+
+    def iter_recordsets(self, zid, page_size=100, params=None):
+        """Yield every recordset in the zone, following the pagination
+        links"""
+        url = "%s/v2/zones/%s/recordsets" % (self.endpoint, zid)
+        return self.iter_items(url, 'recordsets', page_size=page_size,
+                               params=params)
 
     def get_zone(self, zid):
         return self.get(url="%s/v2/zones/%s" % (self.endpoint, zid))
@@ -92,6 +343,46 @@ class API(Client):
         url = "%s/v2/zones/%s/recordsets" % (self.endpoint, zid)
         return self.post(url=url, data=body)
 
+    def bulk(self, tasks, workers=None, rate=None):
+        """Return a bulk.BulkRun of the tasks. Iterate over it to send the
+        requests and get each bulk.Result as it completes.
+
+        :param tasks: an iterable of (key, func) where func sends a request
+        :param workers: the max requests in flight. Defaults to the
+            connection pool size.
+        :param rate: the max requests per second, or None for no limit
+        """
+        return bulk.BulkRun(tasks, workers=workers or self.pool_size,
+                            rate=rate)
+
+    def create_zones(self, n, workers=None, rate=None):
+        """Create n zones. The key of each result is its index."""
+        tasks = ((i, self.create_zone) for i in range(n))
+        return self.bulk(tasks, workers=workers, rate=rate)
+
+    def create_recordsets(self, zones, per_zone, workers=None, rate=None):
+        """Create per_zone recordsets in each zone. The key of each result is
+        the (zone_name, zone_id) of its zone.
+
+        :param zones: a list of (zone_name, zone_id)
+        """
+        def tasks():
+            for zname, zid in zones:
+                for _ in range(per_zone):
+                    yield ((zname, zid),
+                           lambda z=zname, i=zid: self.create_recordset(z, i))
+        return self.bulk(tasks(), workers=workers, rate=rate)
+
+    def delete_zones(self, zids, workers=None, rate=None):
+        """Delete each zone. The key of each result is the zone id."""
+        tasks = ((zid, lambda z=zid: self.delete_zone(z)) for zid in zids)
+        return self.bulk(tasks, workers=workers, rate=rate)
+
+    def list_recordsets(self, zid, params=None):
+        """List the first page of recordsets in the zone"""
+        url = "%s/v2/zones/%s/recordsets" % (self.endpoint, zid)
+        return self.get(url=url, params=params)
+
     def get_recordset(self, zid, rrid):
         url = "%s/v2/zones/%s/recordsets/%s" % (self.endpoint, zid, rrid)
         return self.get(url=url)
@@ -0,0 +1,274 @@
+"""Send many DNS queries at once.
+
+utils.dig sends one query and blocks until it is answered. A Prober sends
+all of its queries up front, over one UDP socket per nameserver, and then
+waits on all of the sockets at once with select(). Responses are matched to
+their queries by query id. A query is retransmitted when an attempt times
+out, and is retried over TCP when the UDP response is truncated.
+
+    prober = Prober(timeout=1, retries=2)
+    for name in names:
+        for ns in ('127.0.0.1:32768', '127.0.0.1:32769'):
+            prober.add(name, ns, 'SOA')
+    for query in prober.run():
+        print query.name, query.nameserver, query.response or query.error
+"""
+import collections
+import errno
+import random
+import select
+import socket
+import struct
+import time
+from multiprocessing.pool import ThreadPool
+
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.query
+import dns.rdatatype
+
+from ruiner.common import utils
+
+
+class Query(object):
+    """A query to one nameserver, and its outcome.
+
+    :ivar response: the dns.message.Message received, or None
+    :ivar error: the exception if the query failed (e.g. dns.exception.Timeout
+        after all retransmits), or None
+    :ivar attempts: how many times the query was sent
+    :ivar elapsed: seconds from the first attempt until the query finished
+    """
+
+    def __init__(self, name, nameserver, rdatatype, timeout, retries):
+        if isinstance(rdatatype, basestring):
+            rdatatype = dns.rdatatype.from_text(rdatatype)
+        self.name = name
+        self.nameserver = nameserver
+        self.rdatatype = rdatatype
+        self.timeout = timeout
+        self.retries = retries
+        self.message = utils.prepare_query(name, rdatatype)
+
+        self.response = None
+        self.error = None
+        self.attempts = 0
+        self.elapsed = None
+        self.truncated = False
+
+        self._started = None
+        self._sent_at = None
+
+    def __repr__(self):
+        if self.error is not None:
+            outcome = "error=%r" % self.error
+        else:
+            outcome = "response=%r" % self.response
+        return "Query(%s @ %s, %s, attempts=%s)" % (
+            self.name, self.nameserver, outcome, self.attempts)
+
+    @property
+    def done(self):
+        return self.response is not None or self.error is not None
+
+    @property
+    def answered(self):
+        """True if the nameserver responded with a non-empty answer"""
+        return bool(self.response is not None and self.response.answer)
+
+    def finish(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.elapsed = time.time() - self._started
+
+
+class _Target(object):
+    """A UDP socket to one nameserver, and the queries outstanding on it"""
+
+    def __init__(self, nameserver):
+        self.nameserver = nameserver
+        host, port = utils.split_host_port(nameserver, 53)
+        self.sock = socket.socket(dns.inet.af_for_address(host),
+                                  socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        # a connected udp socket only receives packets from the nameserver
+        self.sock.connect((host, port))
+
+        # queries not sent yet
+        self.unsent = collections.deque()
+        # query id -> Query, for queries waiting on a response
+        self.in_flight = {}
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    @property
+    def busy(self):
+        return bool(self.unsent or self.in_flight)
+
+    def close(self):
+        self.sock.close()
+
+
+class Prober(object):
+    """Sends many queries concurrently, to any number of nameservers.
+
+    :param timeout: seconds to wait on each attempt of a query
+    :param retries: how many times to retransmit a query that times out
+    :param window: the max number of queries in flight to each nameserver,
+        so that a large batch doesn't overflow the socket buffers
+    """
+
+    def __init__(self, timeout=1, retries=2, window=100):
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self.queries = []
+
+    def add(self, name, nameserver, rdatatype='ANY', timeout=None,
+            retries=None):
+        """Add a query to send on the next run(). Return the Query"""
+        query = Query(
+            name, nameserver, rdatatype,
+            timeout=self.timeout if timeout is None else timeout,
+            retries=self.retries if retries is None else retries,
+        )
+        self.queries.append(query)
+        return query
+
+    def run(self):
+        """Send each query, and wait until every query is answered or has
+        timed out. Return the queries, in the order they were added."""
+        targets = {}
+        for query in self.queries:
+            if query.nameserver not in targets:
+                targets[query.nameserver] = _Target(query.nameserver)
+            targets[query.nameserver].unsent.append(query)
+
+        truncated = []
+        try:
+            busy = [t for t in targets.values() if t.busy]
+            while busy:
+                now = time.time()
+                for target in busy:
+                    self._send(target, now)
+
+                wait = self._next_deadline(busy) - now
+                readable, _, _ = select.select(busy, [], [], max(0, wait))
+                for target in readable:
+                    self._receive(target, truncated)
+
+                now = time.time()
+                for target in busy:
+                    self._expire(target, now)
+                busy = [t for t in busy if t.busy]
+        finally:
+            for target in targets.values():
+                target.close()
+
+        if truncated:
+            self._retry_over_tcp(truncated)
+        return list(self.queries)
+
+    def _send(self, target, now):
+        while target.unsent and len(target.in_flight) < self.window:
+            query = target.unsent.popleft()
+            # query ids must be unique per socket to match the responses
+            while query.message.id in target.in_flight:
+                query.message.id = random.randint(0, 65535)
+            target.in_flight[query.message.id] = query
+            query._started = now
+            self._transmit(target, query, now)
+
+    def _transmit(self, target, query, now):
+        query.attempts += 1
+        query._sent_at = now
+        try:
+            target.sock.send(query.message.to_wire())
+        except socket.error:
+            # e.g. the nameserver is down. retransmit on the timeout
+            pass
+
+    def _receive(self, target, truncated):
+        """Read every response waiting on the socket"""
+        while True:
+            try:
+                wire = target.sock.recv(65535)
+            except socket.error as e:
+                # EAGAIN when the socket is drained. ECONNREFUSED when the
+                # nameserver isn't listening: its queries will time out.
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                   errno.ECONNREFUSED):
+                    raise
+                return
+            if len(wire) < 4:
+                continue
+
+            # read the header first, since a truncated message may not parse
+            qid, flags = struct.unpack('!HH', wire[:4])
+            query = target.in_flight.get(qid)
+            if query is None:
+                # a late response to a retransmitted query
+                continue
+
+            if flags & dns.flags.TC:
+                del target.in_flight[qid]
+                query.truncated = True
+                truncated.append(query)
+                continue
+
+            try:
+                response = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                continue
+            if not query.message.is_response(response):
+                continue
+            del target.in_flight[qid]
+            query.finish(response=response)
+
+    def _expire(self, target, now):
+        """Retransmit queries whose attempt timed out, or fail them if they
+        are out of retries"""
+        for qid, query in target.in_flight.items():
+            if now < query._sent_at + query.timeout:
+                continue
+            if query.attempts > query.retries:
+                del target.in_flight[qid]
+                query.finish(error=dns.exception.Timeout())
+            else:
+                self._transmit(target, query, now)
+
+    def _next_deadline(self, targets):
+        deadlines = [q._sent_at + q.timeout
+                     for t in targets for q in t.in_flight.values()]
+        return min(deadlines) if deadlines else time.time()
+
+    def _retry_over_tcp(self, queries):
+        def query_tcp(query):
+            host, port = utils.split_host_port(query.nameserver, 53)
+            try:
+                response = dns.query.tcp(query.message, host, port=port,
+                                         timeout=query.timeout)
+            except Exception as e:
+                query.finish(error=e)
+            else:
+                query.finish(response=response)
+
+        pool = ThreadPool(min(len(queries), 10))
+        try:
+            pool.map(query_tcp, queries)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def dig_many(names, nameservers, rdatatype='ANY', timeout=1, retries=2):
+    """Query every nameserver for every name, concurrently. Return the list
+    of Query objects, one for each (name, nameserver)."""
+    prober = Prober(timeout=timeout, retries=retries)
+    for name in names:
+        for nameserver in nameservers:
+            prober.add(name, nameserver, rdatatype)
+    return prober.run()
@@ -1,7 +1,12 @@
+import json
 import os
+import re
+import subprocess
 import urlparse
 
+import dockerapi
 import utils
+from ruiner.common.config import cfg
 
 
 def discover_designate_carina_dir():
@@ -17,6 +22,152 @@ def discover_designate_carina_dir():
     return d
 
 
+def image_exists(tag):
+    """Return True if the docker image `tag` exists locally"""
+    out, _, ret = utils.run_cmd(["docker", "images", "-q", tag])
+    return ret == 0 and bool(out.strip())
+
+
+def docker_host():
+    """Return the host where published ports are reachable: the host in
+    os.environ('DOCKER_HOST') if set, or else 127.0.0.1 (rather than 0.0.0.0,
+    because dnspython complains sending to 0.0.0.0 but receiving from
+    127.0.0.1)."""
+    host = os.environ.get('DOCKER_HOST', 'tcp://127.0.0.1:80')
+    return urlparse.urlsplit(host).hostname
+
+
+def normalize_project_name(name):
+    """Return the project name as docker-compose labels containers with it.
+    docker-compose strips everything but lowercase letters and digits."""
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+class Container(object):
+    """A container in the topology of a compose project
+
+    :ivar ports: a dict mapping (port, protocol) to the published host port
+    :ivar networks: a dict mapping the names of the container's networks to
+        its ip on each
+    """
+
+    def __init__(self, service, id, name, state, ip, ports, networks=None):
+        self.service = service
+        self.id = id
+        self.name = name
+        self.state = state
+        self.ip = ip
+        self.ports = ports
+        self.networks = networks or {}
+
+    def __repr__(self):
+        return "Container(%s, %s, ip=%s)" % (self.service, self.state,
+                                             self.ip)
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+
+class Topology(object):
+    """A snapshot of the containers in a compose project, their state, ip,
+    and published ports. See DockerComposer.topology()"""
+
+    def __init__(self, containers):
+        # a service may also have old, exited containers. prefer the running
+        # one
+        self.containers = {}
+        for c in containers:
+            current = self.containers.get(c.service)
+            if current is None or (c.state == 'running' and
+                                   current.state != 'running'):
+                self.containers[c.service] = c
+
+    @classmethod
+    def from_inspect(cls, infos):
+        """Build the topology from the output of `docker inspect`"""
+        containers = []
+        for info in infos:
+            labels = info['Config']['Labels']
+            if labels.get(dockerapi.ONEOFF_LABEL) == 'True':
+                continue
+            ports = {}
+            for key, bindings in (
+                    info['NetworkSettings'].get('Ports') or {}).items():
+                if bindings:
+                    port, protocol = key.split('/')
+                    ports[(int(port), protocol)] = int(
+                        bindings[0]['HostPort'])
+            networks = info['NetworkSettings'].get('Networks') or {}
+            containers.append(Container(
+                service=labels.get(dockerapi.SERVICE_LABEL),
+                id=info['Id'],
+                name=info['Name'].lstrip('/'),
+                state=info['State']['Status'],
+                ip=next((n['IPAddress'] for n in networks.values()), None),
+                ports=ports,
+                networks=dict(
+                    (name, n['IPAddress']) for name, n in networks.items()),
+            ))
+        return cls(containers)
+
+    @classmethod
+    def from_summaries(cls, summaries):
+        """Build the topology from a container listing of the engine api"""
+        containers = []
+        for summary in summaries:
+            if summary['Labels'].get(dockerapi.ONEOFF_LABEL) == 'True':
+                continue
+            ports = dict(
+                ((p['PrivatePort'], p['Type']), p['PublicPort'])
+                for p in summary.get('Ports') or [] if p.get('PublicPort')
+            )
+            networks = (summary.get('NetworkSettings') or {}).get(
+                'Networks') or {}
+            containers.append(Container(
+                service=summary['Labels'].get(dockerapi.SERVICE_LABEL),
+                id=summary['Id'],
+                name=summary['Names'][0].lstrip('/'),
+                state=summary['State'],
+                ip=next((n['IPAddress'] for n in networks.values()), None),
+                ports=ports,
+                networks=dict(
+                    (name, n['IPAddress']) for name, n in networks.items()),
+            ))
+        return cls(containers)
+
+    def container(self, service):
+        return self.containers.get(service)
+
+    def host(self, service, port, protocol=None):
+        """Return a usable `host:port` for the published port. Raise an
+        Exception if the port is not published"""
+        container = self.containers.get(service)
+        key = (int(port), protocol or 'tcp')
+        if container is None or key not in container.ports:
+            raise Exception("%s:%s/%s is not published" % (
+                service, port, protocol or 'tcp'))
+        return "%s:%s" % (docker_host(), container.ports[key])
+
+
+class CommandEventStream(object):
+    """Iterate over the events printed by `docker events`, as dicts"""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    def __iter__(self):
+        for line in iter(self.process.stdout.readline, ''):
+            if line.strip():
+                yield json.loads(line)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+
 class DockerComposer(object):
     """An interface for invoking docker-compose commands"""
 
@@ -36,6 +187,7 @@ class DockerComposer(object):
         self.compose_files = compose_files
         self.dir = carina_dir
         self.log = logger
+        self._topology = None
 
     def _run_cmd(self, *cmd):
         cmd = map(str, cmd)
@@ -52,26 +204,152 @@ class DockerComposer(object):
 
     def up(self, detached=True):
         self.log.info("starting docker containers")
+        self.invalidate()
         if not detached:
             return self._run_cmd("docker-compose", "up")
         return self._run_cmd("docker-compose", "up", "-d")
 
-    def down(self):
+    def down(self, timeout=None):
+        """Stop and remove the containers and networks
+
+        :param timeout: seconds for containers to stop before they are killed,
+            or None for docker's default (10s)
+        """
         self.log.info("stopping docker containers")
+        self.invalidate()
+        if timeout is not None:
+            return self._run_cmd("docker-compose", "down", "-t", timeout)
         return self._run_cmd("docker-compose", "down")
 
+    def topology(self):
+        """Return the Topology of the project. This is cached until a
+        container is started or stopped."""
+        if self._topology is None:
+            self._topology = self._inspect_topology()
+        return self._topology
+
+    def invalidate(self):
+        """Forget the cached topology"""
+        self._topology = None
+
+    def _inspect_topology(self):
+        label = "%s=%s" % (dockerapi.PROJECT_LABEL,
+                           normalize_project_name(self.project_name))
+        out, _, ret = utils.run_cmd(
+            ["docker", "ps", "-aq", "--no-trunc", "--filter",
+             "label=%s" % label])
+        assert ret == 0
+        ids = out.split()
+        if not ids:
+            return Topology([])
+        out, _, ret = utils.run_cmd(["docker", "inspect"] + ids)
+        assert ret == 0
+        return Topology.from_inspect(json.loads(out))
+
+    def events(self, since=None):
+        """Return a stream of the events of the project's containers. Events
+        since the unix time `since` are replayed first. See
+        events.ContainerEvents"""
+        label = "%s=%s" % (dockerapi.PROJECT_LABEL,
+                           normalize_project_name(self.project_name))
+        cmd = ["docker", "events", "--format", "{{json .}}",
+               "--filter", "type=container", "--filter", "label=%s" % label]
+        if since is not None:
+            cmd.extend(["--since", "%.6f" % since])
+        return CommandEventStream(cmd)
+
     def kill(self, container):
         self.log.info("killing container %s", container)
+        self.invalidate()
         return self._run_cmd("docker-compose", "kill", container)
 
-    def start(self, container):
+    def start(self, container=None):
+        """Start the container. If None, start all stopped containers"""
+        self.invalidate()
+        if container is None:
+            self.log.info("starting all containers")
+            return self._run_cmd("docker-compose", "start")
         self.log.info("starting container %s", container)
         return self._run_cmd("docker-compose", "start", container)
 
+    def pause(self, container):
+        """Freeze the processes of the container. It keeps its ports, so
+        unpause() recovers it immediately."""
+        self.log.info("pausing container %s", container)
+        self.invalidate()
+        return self._run_cmd("docker-compose", "pause", container)
+
+    def unpause(self, container):
+        self.log.info("unpausing container %s", container)
+        self.invalidate()
+        return self._run_cmd("docker-compose", "unpause", container)
+
+    def networks(self, container):
+        """Return the names of the networks the container is connected to"""
+        found = self.topology().container(container)
+        return sorted(found.networks) if found is not None else []
+
+    def network_gateway(self, network):
+        """Return the gateway ip of the network, where containers on it can
+        reach the docker host"""
+        out, _, ret = utils.run_cmd(["docker", "network", "inspect",
+                                     "--format", "{{json .IPAM.Config}}",
+                                     network])
+        assert ret == 0
+        return json.loads(out)[0]['Gateway']
+
+    def disconnect(self, container, network):
+        """Disconnect the container from the network, e.g. to partition it
+        from the other services. Its processes keep running."""
+        self.log.info("disconnecting container %s from network %s",
+                      container, network)
+        self.invalidate()
+        return utils.run_cmd(["docker", "network", "disconnect", network,
+                              self.container_id(container)])
+
+    def connect(self, container, network):
+        """Reconnect the container to the network, under its service name"""
+        self.log.info("connecting container %s to network %s", container,
+                      network)
+        self.invalidate()
+        return utils.run_cmd(["docker", "network", "connect", "--alias",
+                              container, network,
+                              self.container_id(container)])
+
     def exec_(self, container, cmd):
+        """Run the command in the container. The cmd may be a string, which is
+        split on spaces, or a list of args."""
         self.log.info("running '%s' in container %s", cmd, container)
-        cmd = cmd.split(' ')
-        return self._run_cmd("docker-compose", "exec", container, *cmd)
+        if isinstance(cmd, basestring):
+            cmd = cmd.split(' ')
+        # -T, since we never have a tty to allocate
+        return self._run_cmd("docker-compose", "exec", "-T", container, *cmd)
+
+    def container_id(self, container):
+        """Return the id of the container for the service, or None"""
+        out, _, ret = self._run_cmd("docker-compose", "ps", "-q", container)
+        if ret != 0 or not out.strip():
+            return None
+        return out.strip().splitlines()[0]
+
+    def _require_id(self, container):
+        cid = self.container_id(container)
+        if cid is None:
+            raise Exception("no container for %s in project %s" % (
+                container, self.project_name))
+        return cid
+
+    def copy_to(self, container, src, dest):
+        """Copy a local file into the container"""
+        self.log.info("copying %s to %s:%s", src, container, dest)
+        cid = self._require_id(container)
+        return utils.run_cmd(["docker", "cp", src, "%s:%s" % (cid, dest)])
+
+    def copy_from(self, container, src, dest):
+        """Copy a file out of the container"""
+        self.log.info("copying %s:%s to %s", container, src, dest)
+        cid = self._require_id(container)
+        return utils.run_cmd(["docker", "cp", "%s:%s" % (cid, src), dest])
 
     def port(self, container, port, protocol=None):
         self.log.info("getting port for %s:%s", container, port)
@@ -90,18 +368,183 @@ class DockerComposer(object):
         return self._run_cmd(*cmd)
 
     def get_host(self, container, port, protocol=None):
-        """Return a usable `host:port` for the container.
+        """Return a usable `host:port` for the container. See docker_host()
 
-        The host in os.environ('DOCKER_HOST') will be used, if set.
-        Otherwise, it will assume we're running locally and force a host of
-        127.0.0.1 instead of 0.0.0.0 (because dnspython complains sending to
-        0.0.0.0 but receiving from 127.0.0.1).
+        This runs a command for each port. To look up many ports, use the
+        topology() instead.
         """
         out, err, ret = self.port(container, port, protocol)
         assert ret == 0
 
         parts = urlparse.urlsplit("tcp://%s" % out.strip())
-        host = os.environ.get('DOCKER_HOST', 'tcp://127.0.0.1:80')
-        host_parts = urlparse.urlsplit(host)
+        return "%s:%s" % (docker_host(), parts.port)
+
+
+class EngineComposer(DockerComposer):
+    """A DockerComposer that manages running containers through the Docker
+    Engine API, instead of a docker-compose subprocess per call. Containers
+    are found by the labels docker-compose gives them. build, up and down
+    still use docker-compose, since those need the compose yaml.
+
+    Methods return (out, err, ret) tuples like the docker-compose commands.
+    """
+
+    def __init__(self, logger, project_name=None, compose_files=None,
+                 carina_dir=None, client=None):
+        super(EngineComposer, self).__init__(
+            logger, project_name=project_name, compose_files=compose_files,
+            carina_dir=carina_dir,
+        )
+        self.client = client or dockerapi.EngineClient(
+            cfg.CONF.ruiner.docker_socket)
+
+    def containers(self, container=None):
+        """Return the containers of the project (of the service, if given)"""
+        labels = {
+            dockerapi.PROJECT_LABEL: normalize_project_name(self.project_name),
+        }
+        if container is not None:
+            labels[dockerapi.SERVICE_LABEL] = container
+        return self.client.containers(labels=labels)
+
+    def container_id(self, container):
+        containers = self.containers(container)
+        running = [c for c in containers if c['State'] == 'running']
+        containers = running or containers
+        return containers[0]['Id'] if containers else None
+
+    def _call(self, func, *args):
+        """Call the client. Return (out, err, ret) like a command"""
+        try:
+            out = func(*args)
+        except (dockerapi.EngineError, EnvironmentError) as e:
+            self.log.warning("docker engine request failed: %s", e)
+            return '', str(e), 1
+        return out or '', '', 0
+
+    def _require_id(self, container):
+        cid = self.container_id(container)
+        if cid is None:
+            raise dockerapi.EngineError('GET', '/containers/json', 404,
+                                        "no container for %s" % container)
+        return cid
+
+    def _inspect_topology(self):
+        return Topology.from_summaries(self.containers())
+
+    def events(self, since=None):
+        return self.client.events(labels={
+            dockerapi.PROJECT_LABEL: normalize_project_name(self.project_name),
+        }, since=since)
+
+    def kill(self, container):
+        self.log.info("killing container %s", container)
+        self.invalidate()
+        return self._call(
+            lambda: self.client.kill(self._require_id(container)))
+
+    def start(self, container=None):
+        self.invalidate()
+        if container is None:
+            self.log.info("starting all containers")
+
+            def start_all():
+                for c in self.containers():
+                    if c['State'] != 'running':
+                        self.client.start(c['Id'])
+            return self._call(start_all)
+
+        self.log.info("starting container %s", container)
+        return self._call(
+            lambda: self.client.start(self._require_id(container)))
+
+    def pause(self, container):
+        self.log.info("pausing container %s", container)
+        self.invalidate()
+        return self._call(
+            lambda: self.client.pause(self._require_id(container)))
+
+    def unpause(self, container):
+        self.log.info("unpausing container %s", container)
+        self.invalidate()
+        return self._call(
+            lambda: self.client.unpause(self._require_id(container)))
+
+    def network_gateway(self, network):
+        return self.client.network(network)['IPAM']['Config'][0]['Gateway']
+
+    def disconnect(self, container, network):
+        self.log.info("disconnecting container %s from network %s",
+                      container, network)
+        self.invalidate()
+        return self._call(lambda: self.client.disconnect(
+            network, self._require_id(container)))
+
+    def connect(self, container, network):
+        self.log.info("connecting container %s to network %s", container,
+                      network)
+        self.invalidate()
+        return self._call(lambda: self.client.connect(
+            network, self._require_id(container), aliases=[container]))
+
+    def exec_(self, container, cmd):
+        self.log.info("running '%s' in container %s", cmd, container)
+        if isinstance(cmd, basestring):
+            cmd = cmd.split(' ')
+        try:
+            out, err, ret = self.client.exec_(self._require_id(container),
+                                              list(cmd))
+        except (dockerapi.EngineError, EnvironmentError) as e:
+            return '', str(e), 1
+        return out.decode('utf-8'), err.decode('utf-8'), ret
+
+    def port(self, container, port, protocol=None):
+        self.log.info("getting port for %s:%s", container, port)
+        if protocol and protocol not in ["udp", "tcp"]:
+            raise Exception("invalid protocol %s" % protocol)
+
+        def get_port():
+            info = self.client.inspect(self._require_id(container))
+            key = "%s/%s" % (port, protocol or 'tcp')
+            bindings = (info['NetworkSettings']['Ports'] or {}).get(key)
+            if not bindings:
+                raise dockerapi.EngineError('GET', '/containers/json', 404,
+                                            "%s is not published" % key)
+            binding = bindings[0]
+            return "%s:%s\n" % (binding['HostIp'], binding['HostPort'])
+        return self._call(get_port)
+
+    def logs(self):
+        self.log.info("getting docker logs")
+
+        def get_logs():
+            lines = []
+            for c in sorted(self.containers(),
+                            key=lambda c: c['Names'][0]):
+                name = c['Names'][0].lstrip('/')
+                out, err = self.client.logs(c['Id'])
+                for line in (out + err).decode('utf-8').splitlines():
+                    lines.append(u"%s | %s" % (name, line))
+            return u"\n".join(lines)
+        return self._call(get_logs)
+
+    def copy_to(self, container, src, dest):
+        self.log.info("copying %s to %s:%s", src, container, dest)
+        return self._call(lambda: self.client.put_file(
+            self._require_id(container), src, dest))
+
+    def copy_from(self, container, src, dest):
+        self.log.info("copying %s:%s to %s", container, src, dest)
+        return self._call(lambda: self.client.get_file(
+            self._require_id(container), src, dest))
+
 
-        return "%s:%s" % (host_parts.hostname, parts.port)
+def make_composer(logger, project_name=None, compose_files=None,
+                  carina_dir=None):
+    """Return a DockerComposer, or an EngineComposer if the docker_backend
+    is 'engine'"""
+    cls = DockerComposer
+    if cfg.CONF.ruiner.docker_backend == 'engine':
+        cls = EngineComposer
+    return cls(logger, project_name=project_name,
+               compose_files=compose_files, carina_dir=carina_dir)
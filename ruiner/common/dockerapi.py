@@ -0,0 +1,241 @@
+"""A minimal client for the Docker Engine HTTP API, over the unix socket.
+
+This covers what ruiner needs to manage running containers: listing,
+inspecting, starting, killing, pausing, exec'ing, logs, file copies,
+network (dis)connects, and the events stream. It avoids the cost of a
+`docker-compose` subprocess per operation. See docker.EngineComposer.
+"""
+import httplib
+import io
+import json
+import os
+import socket
+import struct
+import tarfile
+import urllib
+
+# the labels docker-compose puts on the containers of a project
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+# set on the containers of `docker-compose run`
+ONEOFF_LABEL = 'com.docker.compose.oneoff'
+
+API_VERSION = 'v1.24'
+
+
+class EngineError(Exception):
+
+    def __init__(self, method, path, status, message):
+        super(EngineError, self).__init__(
+            "%s %s returned %s: %s" % (method, path, status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """An http connection over a unix socket"""
+
+    def __init__(self, socket_path, timeout=60):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def demux(data):
+    """Split a multiplexed exec/logs stream into (stdout, stderr). Each frame
+    has an 8 byte header: the stream (1=stdout, 2=stderr), 3 zero bytes, and
+    the big-endian length of the payload."""
+    out, err = [], []
+    i = 0
+    while i + 8 <= len(data):
+        stream, size = struct.unpack('>BxxxL', data[i:i + 8])
+        payload = data[i + 8:i + 8 + size]
+        (err if stream == 2 else out).append(payload)
+        i += 8 + size
+    return ''.join(out), ''.join(err)
+
+
+class EventStream(object):
+    """Iterate over the events of a streaming /events response, as dicts.
+    Iteration ends when the stream is closed (from any thread)."""
+
+    def __init__(self, sock, resp):
+        self.sock = sock
+        self.resp = resp
+
+    def __iter__(self):
+        line = []
+        while True:
+            try:
+                c = self.resp.read(1)
+            except (EnvironmentError, httplib.HTTPException):
+                return
+            if not c:
+                return
+            if c != '\n':
+                line.append(c)
+                continue
+            data = ''.join(line).strip()
+            line = []
+            if data:
+                yield json.loads(data)
+
+    def close(self):
+        # shutdown wakes a thread blocked reading the stream
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except EnvironmentError:
+            pass
+        self.resp.close()
+        self.sock.close()
+
+
+class EngineClient(object):
+
+    def __init__(self, socket_path='/var/run/docker.sock', timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, method, path, params=None, body=None, raw=False,
+                headers=None):
+        """Send a request. Return the parsed json response (or the raw body
+        if raw is True). Raise EngineError on an unsuccessful status."""
+        url = "/%s%s" % (API_VERSION, path)
+        if params:
+            url += "?" + urllib.urlencode(params)
+        headers = dict(headers or {})
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        finally:
+            conn.close()
+
+        if resp.status >= 400:
+            try:
+                message = json.loads(data).get('message', data)
+            except ValueError:
+                message = data
+            raise EngineError(method, path, resp.status, message)
+        if raw:
+            return data
+        return json.loads(data) if data else None
+
+    def containers(self, labels=None, all=True):
+        """List containers, filtered by labels (a dict)"""
+        params = {'all': int(all)}
+        if labels:
+            params['filters'] = json.dumps({'label': [
+                "%s=%s" % (k, v) for k, v in sorted(labels.items())]})
+        return self.request('GET', '/containers/json', params=params)
+
+    def events(self, labels=None, since=None):
+        """Return an EventStream of container events, filtered by labels.
+        Events since the unix time `since` are replayed first."""
+        filters = {'type': ['container']}
+        if labels:
+            filters['label'] = [
+                "%s=%s" % (k, v) for k, v in sorted(labels.items())]
+        params = {'filters': json.dumps(filters)}
+        if since is not None:
+            params['since'] = "%.6f" % since
+        url = "/%s/events?%s" % (API_VERSION, urllib.urlencode(params))
+
+        # no timeout, since the stream is idle between events
+        conn = UnixHTTPConnection(self.socket_path, timeout=None)
+        conn.request('GET', url)
+        # a dup of the socket, for close() to shut it down. The connection
+        # closes its own reference if the server doesn't keep it alive.
+        sock = conn.sock.dup()
+        resp = conn.getresponse()
+        if resp.status >= 400:
+            data = resp.read()
+            conn.close()
+            sock.close()
+            raise EngineError('GET', '/events', resp.status, data)
+        return EventStream(sock, resp)
+
+    def inspect(self, cid):
+        return self.request('GET', '/containers/%s/json' % cid)
+
+    def start(self, cid):
+        try:
+            self.request('POST', '/containers/%s/start' % cid)
+        except EngineError as e:
+            # 304: already started
+            if e.status != 304:
+                raise
+
+    def kill(self, cid, signal='SIGKILL'):
+        self.request('POST', '/containers/%s/kill' % cid,
+                     params={'signal': signal})
+
+    def pause(self, cid):
+        self.request('POST', '/containers/%s/pause' % cid)
+
+    def unpause(self, cid):
+        self.request('POST', '/containers/%s/unpause' % cid)
+
+    def network(self, name):
+        return self.request('GET', '/networks/%s' % name)
+
+    def disconnect(self, network, cid):
+        """Disconnect the container from the network"""
+        self.request('POST', '/networks/%s/disconnect' % network,
+                     body={'Container': cid, 'Force': True})
+
+    def connect(self, network, cid, aliases=None):
+        """Connect the container to the network, with the dns aliases"""
+        self.request('POST', '/networks/%s/connect' % network, body={
+            'Container': cid,
+            'EndpointConfig': {'Aliases': list(aliases or [])},
+        })
+
+    def logs(self, cid):
+        """Return (stdout, stderr) of the container"""
+        data = self.request('GET', '/containers/%s/logs' % cid,
+                            params={'stdout': 1, 'stderr': 1}, raw=True)
+        return demux(data)
+
+    def exec_(self, cid, cmd):
+        """Run the command in the container. Return (out, err, exit code)"""
+        exec_id = self.request('POST', '/containers/%s/exec' % cid, body={
+            'Cmd': cmd,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': False,
+        })['Id']
+        data = self.request('POST', '/exec/%s/start' % exec_id,
+                            body={'Detach': False, 'Tty': False}, raw=True)
+        out, err = demux(data)
+        code = self.request('GET', '/exec/%s/json' % exec_id)['ExitCode']
+        return out, err, code
+
+    def put_file(self, cid, src, dest):
+        """Copy the local file src to the path dest in the container"""
+        buf = io.BytesIO()
+        tar = tarfile.open(fileobj=buf, mode='w')
+        tar.add(src, arcname=os.path.basename(dest))
+        tar.close()
+        self.request('PUT', '/containers/%s/archive' % cid,
+                     params={'path': os.path.dirname(dest) or '/'},
+                     body=buf.getvalue(),
+                     headers={'Content-Type': 'application/x-tar'})
+
+    def get_file(self, cid, src, dest):
+        """Copy the file src in the container to the local path dest"""
+        data = self.request('GET', '/containers/%s/archive' % cid,
+                            params={'path': src}, raw=True)
+        tar = tarfile.open(fileobj=io.BytesIO(data))
+        member = tar.getmembers()[0]
+        with open(dest, 'wb') as f:
+            f.write(tar.extractfile(member).read())
@@ -0,0 +1,394 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import jinja2
+
+from ruiner.common import docker
+from ruiner.common import images
+from ruiner.common import utils
+from ruiner.common.config import cfg
+from ruiner.common.ini import IniFile
+
+LOG = utils.create_logger(__name__)
+
+# paths relative to the designate-carina dir
+DEFAULT_DESIGNATE_CONF = 'envs/slappy-bind/designate.conf'
+POOLS_YAML = 'envs/slappy-bind/pools.yml'
+DOCKERFILE = 'Dockerfile'
+
+# the services which read designate.conf
+DESIGNATE_SERVICES = ['api', 'central', 'mdns', 'producer', 'worker']
+
+# the bind containers
+NAMESERVERS = ['bind-1', 'bind-2']
+
+# (name, service, port, protocol) for each published port we care about. The
+# name is the key in the dict returned by discover_services()
+SERVICE_PORTS = [
+    ('api', 'api', 9001, None),
+    ('bind-1', 'bind-1', 53, 'udp'),
+    ('bind-2', 'bind-2', 53, 'udp'),
+    ('bind-1/tcp', 'bind-1', 53, 'tcp'),
+    ('bind-2/tcp', 'bind-2', 53, 'tcp'),
+    ('mdns', 'mdns', 5354, 'tcp'),
+    ('rabbit', 'rabbit', 5672, None),
+    ('mysql', 'mysql', 3306, None),
+]
+
+
+class DockerComposeYamlTemplate(object):
+    """A tool to generate a designate.yml for docker-compose"""
+
+    def __init__(self, logger, tag=None, name='designate'):
+        """
+        :param name: the template to render, from ruiner/templates/<name>.yml
+        """
+        self.log = logger
+        self.name = name
+        self.source_template = './ruiner/templates/%s.yml.jinja2' % name
+        self.output_file = utils.new_temp_file(self._filetag(tag), ".yml")
+        self.log.debug("using %s.yml generated at %s", name, self.output_file)
+
+    def render(self, **kwargs):
+        templ = jinja2.Template(open(self.source_template).read())
+        content = templ.render(**kwargs)
+        with open(self.output_file, 'w') as f:
+            f.write(content)
+        self.log.debug("%s has content:\n%s", self.output_file, content)
+
+    def _filetag(self, tag):
+        if tag:
+            return "%s-%s-" % (self.name, tag)
+        return "%s-" % self.name
+
+
+def init_tmp_dir(carina_dir):
+    """There are some docker env config files we'll create dynamically.
+    Create and return a temporary directory to hold all generated files.
+    """
+    # since COPY in a dockerfile doesn't work with absolute paths, we need
+    # to create temp files in a place docker will find them.
+    tempfile.tempdir = os.path.join(carina_dir, 'tmp')
+    try:
+        os.mkdir(tempfile.tempdir)
+    except OSError:
+        pass
+    return tempfile.tempdir
+
+
+def init_designate_conf(carina_dir, tag):
+    """Return the filename of a new designate.conf, a copy of the default"""
+    filename = utils.new_temp_file("designate-%s-" % tag, ".conf")
+    shutil.copyfile(os.path.join(carina_dir, DEFAULT_DESIGNATE_CONF),
+                    filename)
+    return filename
+
+
+def configure_designate_conf_defaults(filename):
+    """Apply the settings every test starts with to the designate.conf"""
+    conf = IniFile(filename)
+    conf.set("DEFAULT", "debug", True)
+    conf.set("service:worker", "poll_timeout", 2)
+    conf.set("service:worker", "poll_retry_interval", 2)
+    conf.set("service:worker", "poll_max_retries", 2)
+    conf.set("service:worker", "poll_delay", 2)
+
+    conf.set("producer_task:worker_periodic_recovery", "interval", 30)
+
+
+def fingerprint(designate_conf, carina_dir):
+    """Return a fingerprint of a designate configuration. Tests with the same
+    fingerprint may share a deployed environment."""
+    return images.cache_key(
+        cfg.CONF.ruiner.designate_git_url,
+        cfg.CONF.ruiner.designate_version,
+        [designate_conf,
+         os.path.join(carina_dir, POOLS_YAML),
+         os.path.join(carina_dir, DOCKERFILE)],
+    )
+
+
+def choose_designate_image(carina_dir, designate_conf, project_name):
+    """Return the tag for the designate-base image. With the image cache
+    enabled, this is a hash of the image inputs so that identical images are
+    shared between tests. Otherwise, each project gets its own image.
+
+    :param designate_conf: the designate.conf (relative to the carina dir)
+        to build into the image
+    """
+    if not cfg.CONF.ruiner.image_cache:
+        return "%s:%s" % (images.IMAGE_REPOSITORY, project_name)
+
+    key = images.cache_key(
+        cfg.CONF.ruiner.designate_git_url,
+        cfg.CONF.ruiner.designate_version,
+        [os.path.join(carina_dir, f)
+         for f in (designate_conf, POOLS_YAML, DOCKERFILE)],
+    )
+    return images.image_tag(key)
+
+
+def generate_environment(logger, carina_dir, project_name, designate_conf,
+                         tag):
+    """Generate the docker-compose files to deploy designate with the given
+    designate.conf. Return an (undeployed) Environment.
+    """
+    # the docker compose yaml does not work with absolute paths
+    image_conf = os.path.relpath(designate_conf, carina_dir)
+    if cfg.CONF.ruiner.inject_designate_conf:
+        # bake the defaults into the image. the test's designate.conf is
+        # mounted into the containers by the override yaml.
+        image_conf = DEFAULT_DESIGNATE_CONF
+
+    designate_image = choose_designate_image(
+        carina_dir, image_conf, project_name,
+    )
+
+    templ = DockerComposeYamlTemplate(logger, tag=tag)
+    templ.render(
+        DESIGNATE_GIT_URL=cfg.CONF.ruiner.designate_git_url,
+        DESIGNATE_VERSION=cfg.CONF.ruiner.designate_version,
+        DESIGNATE_CONF=image_conf,
+        POOLS_YAML=POOLS_YAML,
+        DESIGNATE_IMAGE=designate_image,
+        RUINER_PROJECT=project_name,
+    )
+    designate_yaml = templ.output_file
+    temp_files = [designate_yaml]
+
+    # publish 53/tcp on the nameservers, for zone transfers
+    templ = DockerComposeYamlTemplate(logger, tag=tag, name='nameservers')
+    templ.render(NAMESERVERS=NAMESERVERS)
+    temp_files.append(templ.output_file)
+
+    compose_files = ["base.yml", designate_yaml, "envs/slappy-bind/bind.yml",
+                     templ.output_file]
+    designate_conf_yaml = None
+
+    if cfg.CONF.ruiner.inject_designate_conf:
+        # bind mount the designate.conf and pools.yml into each service
+        templ = DockerComposeYamlTemplate(logger, tag=tag,
+                                          name='designate-conf')
+        templ.render(
+            SERVICES=DESIGNATE_SERVICES,
+            DESIGNATE_CONF=os.path.realpath(designate_conf),
+            DESIGNATE_CONF_PATH=cfg.CONF.ruiner.designate_conf_path,
+            POOLS_YAML=os.path.realpath(os.path.join(carina_dir, POOLS_YAML)),
+            POOLS_YAML_PATH=cfg.CONF.ruiner.pools_yaml_path,
+        )
+        designate_conf_yaml = templ.output_file
+        temp_files.append(designate_conf_yaml)
+        compose_files.append(designate_conf_yaml)
+
+    return Environment(
+        fingerprint=fingerprint(designate_conf, carina_dir),
+        project_name=project_name,
+        compose_files=compose_files,
+        carina_dir=carina_dir,
+        designate_yaml=designate_yaml,
+        designate_image=designate_image,
+        designate_conf_yaml=designate_conf_yaml,
+        temp_files=temp_files,
+    )
+
+
+def build_images(docker_composer, designate_image, lock_dir, logger):
+    """Build images for the environment, using the image cache if enabled.
+
+    :return: the (out, err, ret) of the build, or None on a cache hit
+    """
+    if not cfg.CONF.ruiner.image_cache:
+        return docker_composer.build()
+    cache = images.ImageCache(logger, lock_dir)
+    return cache.ensure(designate_image, docker_composer.build)
+
+
+def discover_services(docker_composer, logger):
+    """Discover docker service locations (url, host:port) and return a dict
+    mapping the docker service name to the location"""
+    topology = docker_composer.topology()
+    services = {}
+    for name, service_name, port, protocol in SERVICE_PORTS:
+        location = topology.host(service_name, port, protocol)
+        logger.info("%s:%s/%s -> %s", service_name, port, protocol or 'tcp',
+                    location)
+        services[name] = location
+    services['api'] = "http://%s" % services['api']
+    return services
+
+
+# where the pools file is generated in the central container
+POOLS_FILE_PATH = '/tmp/ruiner-pools.yml'
+
+# applies changes (a json list) to the nameservers in a pools file. Each change
+# moves the nameservers at any of its `old` [host, port] to its host and port,
+# optionally only the one at `pool` and `index`. Prints the [pool, index, host,
+# port] of the replaced nameservers. This runs in the designate image, which
+# has yaml.
+REPOINT_POOLS_SCRIPT = """
+import json, sys, yaml
+path, changes = sys.argv[1:]
+pools = yaml.safe_load(open(path))
+replaced = []
+for change in json.loads(changes):
+    old = [tuple(ns) for ns in change["old"]]
+    for pool in pools:
+        if change.get("pool") not in (None, pool["name"]):
+            continue
+        for i, ns in enumerate(pool.get("nameservers") or []):
+            if change.get("index") not in (None, i):
+                continue
+            if (ns["host"], ns["port"]) in old:
+                replaced.append([pool["name"], i, ns["host"], ns["port"]])
+                ns["host"], ns["port"] = change["host"], change["port"]
+yaml.safe_dump(pools, open(path, "w"), default_flow_style=False)
+print(json.dumps(replaced))
+"""
+
+
+def _update_pools(docker_composer, changes):
+    """Apply the changes (see REPOINT_POOLS_SCRIPT) to designate's pools.
+    Return the (pool, index, host, port) of the replaced nameservers."""
+    def run(*cmd):
+        out, _, ret = docker_composer.exec_('central', list(cmd))
+        assert ret == 0
+        return out
+
+    run("designate-manage", "pool", "generate_file", "--file",
+        POOLS_FILE_PATH)
+    out = run("python", "-c", REPOINT_POOLS_SCRIPT, POOLS_FILE_PATH,
+              json.dumps(changes))
+    run("designate-manage", "pool", "update", "--file", POOLS_FILE_PATH)
+    return [tuple(ns) for ns in json.loads(out.strip().splitlines()[-1])]
+
+
+def repoint_pool_nameservers(docker_composer, old, host, port):
+    """Update designate's pools, so the nameservers at any of `old` (a list
+    of (host, port)) are polled at host:port instead. Return the (pool,
+    index, host, port) of each replaced nameserver, to pass to
+    restore_pool_nameservers.
+
+    The worker caches the pools, so restart it afterwards.
+    """
+    return _update_pools(docker_composer, [{
+        'old': [list(ns) for ns in old], 'host': host, 'port': int(port),
+    }])
+
+
+def restore_pool_nameservers(docker_composer, replaced, current):
+    """Undo repoint_pool_nameservers: point each replaced nameserver, now at
+    `current` (host, port), back at its original host and port."""
+    return _update_pools(docker_composer, [{
+        'old': [list(current)], 'pool': pool, 'index': index, 'host': host,
+        'port': port,
+    } for pool, index, host, port in replaced])
+
+
+class Environment(object):
+    """A designate stack (a docker-compose project), which may be reused by
+    any test whose designate configuration has the same fingerprint.
+    """
+
+    def __init__(self, fingerprint, project_name, compose_files, carina_dir,
+                 designate_yaml, designate_image, designate_conf_yaml=None,
+                 temp_files=None):
+        """
+        :param fingerprint: identifies the designate configuration of the
+            stack. see fingerprint()
+        :param temp_files: generated files (designate.conf, yaml, ...) that
+            the stack depends on. These are removed when the stack is torn
+            down.
+        """
+        self.fingerprint = fingerprint
+        self.project_name = project_name
+        self.compose_files = compose_files
+        self.carina_dir = carina_dir
+        self.designate_yaml = designate_yaml
+        self.designate_image = designate_image
+        self.designate_conf_yaml = designate_conf_yaml
+        self.temp_files = list(temp_files or [])
+
+        # set when the environment is leased from a `ruiner pool`
+        self.lease_file = None
+
+    def __repr__(self):
+        return "Environment(%s, fingerprint=%s)" % (self.project_name,
+                                                    self.fingerprint)
+
+    def to_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'project_name': self.project_name,
+            'compose_files': self.compose_files,
+            'carina_dir': self.carina_dir,
+            'designate_yaml': self.designate_yaml,
+            'designate_image': self.designate_image,
+            'designate_conf_yaml': self.designate_conf_yaml,
+            'temp_files': self.temp_files,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def docker_composer(self, logger):
+        return docker.make_composer(
+            logger=logger,
+            project_name=self.project_name,
+            compose_files=self.compose_files,
+            carina_dir=self.carina_dir,
+        )
+
+    def destroy(self, logger):
+        """Tear down the stack and remove its files. Return True on success"""
+        _, _, ret = self.docker_composer(logger).down(
+            timeout=cfg.CONF.ruiner.stop_timeout)
+        for filename in self.temp_files:
+            utils.cleanup_file(filename)
+        if ret != 0:
+            logger.error("FAILED TO CLEANUP ENV (project=%s)",
+                         self.project_name)
+        return ret == 0
+
+
+class EnvironmentPool(object):
+    """Holds idle, deployed environments between tests"""
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def lease(self, fingerprint):
+        """Remove and return an idle environment with the fingerprint, or
+        None if there is no such environment"""
+        with self._lock:
+            envs = self._idle.get(fingerprint)
+            if envs:
+                return envs.pop()
+        return None
+
+    def release(self, env):
+        """Return an environment to the pool, for use by another test"""
+        with self._lock:
+            self._idle.setdefault(env.fingerprint, []).append(env)
+
+    def drain(self):
+        """Remove and return all idle environments"""
+        with self._lock:
+            envs = [e for envs in self._idle.values() for e in envs]
+            self._idle.clear()
+        return envs
+
+    def destroy_all(self):
+        for env in self.drain():
+            LOG.info("tearing down pooled env %s", env.project_name)
+            env.destroy(LOG)
+
+
+# the pool is per-process, so that each test runner worker has its own stacks
+POOL = EnvironmentPool()
+atexit.register(POOL.destroy_all)
@@ -0,0 +1,233 @@
+"""Track the state of a compose project's containers from the docker events.
+
+A ContainerEvents listener reads the docker events stream of the project in
+a background thread, and keeps a table of the state of each service's
+container: running or exited, its health, and whether it was oom-killed.
+Fault injection helpers block on the real state change (e.g. the `die` of a
+killed container) instead of probing the service. Event timestamps are
+from the docker daemon's clock, which may differ from this host's, so waits
+match events by their position in the history (see ContainerEvents.cursor).
+"""
+import collections
+import threading
+import time
+
+from ruiner.common import dockerapi
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__)
+
+ContainerEvent = collections.namedtuple(
+    'ContainerEvent', ['service', 'container', 'action', 'timestamp',
+                       'attributes'])
+
+# the status a container has after each action
+STATUSES = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'destroy': 'removed',
+}
+
+
+class ContainerState(object):
+    """The last known state of a service's container
+
+    :ivar status: e.g. 'running', 'exited', 'paused', or None if unknown
+    :ivar health: the health check status (e.g. 'healthy'), or None
+    :ivar oom_killed: True if the container ran out of memory
+    :ivar exit_code: the exit code of the last `die`, or None
+    :ivar since: when the status last changed
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.container = None
+        self.status = None
+        self.health = None
+        self.oom_killed = False
+        self.exit_code = None
+        self.since = None
+
+    def __repr__(self):
+        return "ContainerState(%s, %s, health=%s)" % (
+            self.service, self.status, self.health)
+
+    def update(self, event):
+        """Apply the event. Return True if the state changed."""
+        self.container = event.container
+        action = event.action
+        if action.startswith('health_status:'):
+            health = action.split(':', 1)[1].strip()
+            changed, self.health = health != self.health, health
+            return changed
+        if action == 'oom':
+            self.oom_killed = True
+            return True
+        if action == 'start':
+            self.health = None
+            self.oom_killed = False
+        if action == 'die':
+            self.exit_code = event.attributes.get('exitCode')
+        status = STATUSES.get(action)
+        if status is None or status == self.status:
+            return False
+        self.status = status
+        self.since = event.timestamp
+        return True
+
+
+def parse_event(data):
+    """Return a ContainerEvent from a docker event dict, or None if the event
+    is not for a compose service's container"""
+    actor = data.get('Actor') or {}
+    attributes = actor.get('Attributes') or {}
+    service = attributes.get(dockerapi.SERVICE_LABEL)
+    if service is None:
+        return None
+    if data.get('timeNano'):
+        timestamp = data['timeNano'] / 1e9
+    else:
+        timestamp = float(data.get('time', time.time()))
+    return ContainerEvent(
+        service=service,
+        container=actor.get('ID') or data.get('id'),
+        action=data.get('Action') or data.get('status'),
+        timestamp=timestamp,
+        attributes=attributes,
+    )
+
+
+class ContainerEvents(object):
+    """Listens to the events of a project's containers, and records every
+    event and the state of each service's container.
+
+    :param open_stream: a function taking `since` (a unix time) and returning
+        an iterable of docker event dicts with a close() method. See
+        DockerComposer.events()
+    """
+
+    def __init__(self, open_stream, logger=LOG, reconnect_interval=1):
+        self.open_stream = open_stream
+        self.log = logger
+        self.reconnect_interval = reconnect_interval
+
+        self.events = []
+        self.states = {}
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        # guards swapping the stream on reconnect against stop()
+        self._lock = threading.Lock()
+        self._stream = None
+        self._thread = None
+
+    def start(self):
+        """Subscribe to the events, and start listening in the background.
+        Every event after this returns is recorded."""
+        self._stream = self.open_stream(time.time())
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopping.set()
+            stream = self._stream
+        if stream is not None:
+            stream.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                for data in self._stream:
+                    self.record(data)
+            except Exception:
+                self.log.exception("failed to read docker events")
+            if self._stopping.is_set():
+                return
+
+            # the stream ended unexpectedly. resubscribe, replaying any
+            # events we missed
+            self.log.warning("docker events stream ended. reconnecting")
+            self._stream.close()
+            self._stopping.wait(self.reconnect_interval)
+            since = self.events[-1].timestamp if self.events else time.time()
+            try:
+                stream = self.open_stream(since)
+            except Exception:
+                self.log.exception("failed to reconnect to docker events")
+                continue
+            with self._lock:
+                if self._stopping.is_set():
+                    # stop() already closed the old stream
+                    stream.close()
+                    return
+                self._stream = stream
+
+    def record(self, data):
+        """Record a docker event dict. Return the ContainerEvent, or None if
+        it was not for a service's container."""
+        event = parse_event(data)
+        if event is None:
+            return None
+        with self._cond:
+            # skip events replayed after a reconnect
+            if event in self.events[-20:]:
+                return None
+            self.events.append(event)
+            state = self.states.setdefault(
+                event.service, ContainerState(event.service))
+            if state.update(event):
+                self.log.info("container %s: %s at %.6f -> %s",
+                              event.service, event.action, event.timestamp,
+                              state)
+            self._cond.notify_all()
+        return event
+
+    def state(self, service):
+        """Return the ContainerState of the service, or None if no events
+        have been seen for it"""
+        with self._cond:
+            return self.states.get(service)
+
+    def history(self, service=None):
+        """Return the events (for the service)"""
+        with self._cond:
+            return [e for e in self.events if service in (None, e.service)]
+
+    def cursor(self):
+        """Return the position after the events recorded so far. Take a
+        cursor before an action, and wait_for its events after the cursor.
+        Unlike a timestamp, this doesn't compare this host's clock with the
+        docker daemon's."""
+        with self._cond:
+            return len(self.events)
+
+    def wait_for(self, service, actions, timeout, cursor=0):
+        """Block until the service's container has one of the actions (e.g.
+        'die', or 'health_status: healthy') recorded after the cursor. Return
+        the first such ContainerEvent, or None on timeout.
+
+        :param actions: an action, or a list of actions
+        :param cursor: the position to look from. See cursor()
+        """
+        if isinstance(actions, basestring):
+            actions = [actions]
+        end = time.time() + timeout
+        checked = cursor
+        with self._cond:
+            while True:
+                for event in self.events[checked:]:
+                    if event.service == service and event.action in actions:
+                        return event
+                checked = len(self.events)
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
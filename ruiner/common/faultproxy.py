@@ -0,0 +1,277 @@
+"""A dns proxy that injects faults between designate and a nameserver.
+
+A FaultProxy listens on one port for udp and tcp, and forwards each query to
+an upstream nameserver and each response back. Its faults can be changed at
+any time while it runs:
+
+    proxy = FaultProxy('127.0.0.1:32768', '127.0.0.1:32769')
+    proxy.start()
+    proxy.set_faults(loss=0.3)                      # drop 30% of udp packets
+    proxy.set_faults(delay=lambda: random.uniform(0.1, 0.5))
+    proxy.set_faults(rate=4096)                     # slow tcp streams
+    proxy.set_faults(blackhole=True)                # forward nothing
+    proxy.clear_faults()
+    print proxy.stats()     # {'udp_forwarded': 120, 'udp_dropped': 31, ...}
+
+Loss applies to udp packets in both directions. A delay holds each udp
+packet, or each chunk of a tcp stream, before it is forwarded. It is a
+number of seconds, or a function returning one (for a distribution).
+"""
+import collections
+import heapq
+import itertools
+import random
+import select
+import socket
+import threading
+import time
+
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__)
+
+
+class FaultProxy(object):
+    """Forwards udp and tcp dns traffic to an upstream nameserver, with
+    configurable packet loss, delay, tcp throughput, and blackholing.
+
+    :param upstream: the upstream `host:port` for udp
+    :param upstream_tcp: the upstream `host:port` for tcp, if different
+    :param host: the address to listen on. Use 0.0.0.0 for containers to
+        reach the proxy through their network's gateway
+    :param port: the port to listen on, or 0 to choose a free port
+    :param seed: seeds the random loss, for repeatable runs
+    """
+
+    # close the upstream socket of a udp client idle this many seconds
+    UDP_IDLE_TIMEOUT = 30
+
+    def __init__(self, upstream, upstream_tcp=None, host='127.0.0.1', port=0,
+                 seed=None, logger=LOG):
+        self.log = logger
+        self.host = host
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+        self.set_upstream(upstream, upstream_tcp)
+        self.clear_faults()
+
+        self.udp, self.tcp = utils.bind_udp_and_tcp(host, port)
+        self.port = self.udp.getsockname()[1]
+
+        # client address -> a udp socket to send upstream for it, and back
+        self._upstreams = {}
+        self._clients = {}
+        self._last_used = {}
+        self._next_expiry = 0
+        # scheduled udp sends: (due, seq, sock, data, addr)
+        self._pending = []
+        self._seq = itertools.count()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    @property
+    def location(self):
+        """The `host:port` to reach the proxy from this host"""
+        host = '127.0.0.1' if self.host == '0.0.0.0' else self.host
+        return "%s:%s" % (host, self.port)
+
+    def set_upstream(self, upstream, upstream_tcp=None):
+        """Change the upstream nameserver (e.g. after it was restarted)"""
+        with self._lock:
+            self.upstream = utils.split_host_port(upstream, 53)
+            self.upstream_tcp = utils.split_host_port(
+                upstream_tcp or upstream, 53)
+
+    def set_faults(self, loss=None, delay=None, rate=None, blackhole=None):
+        """Change the faults. Faults passed as None are left unchanged.
+
+        :param loss: the probability (0 to 1) of dropping a udp packet
+        :param delay: seconds to hold each packet, or a function returning
+            the seconds
+        :param rate: the max tcp throughput, in bytes per second
+        :param blackhole: if True, forward nothing
+        """
+        with self._lock:
+            if loss is not None:
+                self.loss = loss
+            if delay is not None:
+                self.delay = delay
+            if rate is not None:
+                self.rate = rate
+            if blackhole is not None:
+                self.blackhole = blackhole
+        self.log.info("proxy %s -> %s:%s faults: loss=%s delay=%s rate=%s "
+                      "blackhole=%s", self.location, self.upstream[0],
+                      self.upstream[1], self.loss, self.delay, self.rate,
+                      self.blackhole)
+
+    def clear_faults(self):
+        with self._lock:
+            self.loss = 0
+            self.delay = 0
+            self.rate = None
+            self.blackhole = False
+
+    def stats(self):
+        """Return the counts of forwarded and dropped udp packets, and of tcp
+        connections and bytes forwarded"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _next_delay(self):
+        with self._lock:
+            delay = self.delay
+        return delay() if callable(delay) else delay
+
+    def start(self):
+        for target in (self._serve_udp, self._serve_tcp):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        for sock in (self.udp, self.tcp):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.udp.close()
+        self.tcp.close()
+        for sock in self._upstreams.values():
+            sock.close()
+
+    def _serve_udp(self):
+        while not self._stopping.is_set():
+            timeout = 0.5
+            if self._pending:
+                timeout = min(timeout, max(0, self._pending[0][0] -
+                                           time.time()))
+            socks = [self.udp] + self._upstreams.values()
+            readable, _, _ = select.select(socks, [], [], timeout)
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(65535)
+                except socket.error:
+                    continue
+                if sock is self.udp:
+                    self._forward_query(data, addr)
+                else:
+                    self._forward_response(sock, data)
+            self._send_due()
+            self._expire_idle()
+
+    def _forward_query(self, data, client):
+        upstream = self._upstreams.get(client)
+        if upstream is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._upstreams[client] = upstream
+            self._clients[upstream] = client
+        self._last_used[client] = time.time()
+        with self._lock:
+            address = self.upstream
+        self._schedule(upstream, data, address)
+
+    def _forward_response(self, upstream, data):
+        self._schedule(self.udp, data, self._clients[upstream])
+
+    def _schedule(self, sock, data, addr):
+        with self._lock:
+            dropped = self.blackhole or self._random.random() < self.loss
+        if dropped:
+            self._count('udp_dropped')
+            return
+        due = time.time() + self._next_delay()
+        heapq.heappush(self._pending, (due, next(self._seq), sock, data,
+                                       addr))
+
+    def _expire_idle(self):
+        # clients (e.g. dnspython) use a new port for each query
+        now = time.time()
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + 1
+        end = now - self.UDP_IDLE_TIMEOUT
+        for client, last_used in self._last_used.items():
+            if last_used < end and not any(
+                    p[2] is self._upstreams[client] for p in self._pending):
+                sock = self._upstreams.pop(client)
+                del self._clients[sock]
+                del self._last_used[client]
+                sock.close()
+
+    def _send_due(self):
+        now = time.time()
+        while self._pending and self._pending[0][0] <= now:
+            _, _, sock, data, addr = heapq.heappop(self._pending)
+            try:
+                sock.sendto(data, addr)
+                self._count('udp_forwarded')
+            except socket.error as e:
+                self.log.debug("proxy failed to send to %s: %s", addr, e)
+                self._count('udp_errors')
+
+    def _serve_tcp(self):
+        while not self._stopping.is_set():
+            try:
+                client, _ = self.tcp.accept()
+            except socket.error:
+                return
+            if self._stopping.is_set():
+                client.close()
+                return
+            self._count('tcp_connections')
+            with self._lock:
+                address = self.upstream_tcp
+            try:
+                upstream = socket.create_connection(address, timeout=5)
+            except socket.error as e:
+                self.log.debug("proxy failed to connect to %s: %s", address,
+                               e)
+                self._count('tcp_errors')
+                client.close()
+                continue
+            upstream.settimeout(None)
+            for src, dest in ((client, upstream), (upstream, client)):
+                thread = threading.Thread(target=self._pump,
+                                          args=(src, dest))
+                thread.daemon = True
+                thread.start()
+
+    def _pump(self, src, dest):
+        """Copy a tcp stream from src to dest, applying the faults to each
+        chunk"""
+        try:
+            while not self._stopping.is_set():
+                data = src.recv(4096)
+                if not data:
+                    break
+                with self._lock:
+                    blackhole, rate = self.blackhole, self.rate
+                if blackhole:
+                    continue
+                wait = self._next_delay()
+                if rate:
+                    wait += len(data) / float(rate)
+                if wait:
+                    time.sleep(wait)
+                dest.sendall(data)
+                self._count('tcp_bytes', len(data))
+        except socket.error:
+            pass
+        finally:
+            for sock in (src, dest):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            src.close()
@@ -0,0 +1,99 @@
+import fcntl
+import hashlib
+import os
+import time
+
+from ruiner.common import docker
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__, 'image-cache.log')
+
+IMAGE_REPOSITORY = 'designate-base'
+
+# per-process counters, for the build-time report
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'build_time': 0.0,
+}
+
+
+def cache_key(designate_git_url, designate_version, files):
+    """Return a content hash of everything that goes into a designate-base
+    image: the designate source location, and the contents of each file (e.g.
+    designate.conf, pools.yml, and the Dockerfile).
+
+        >>> cache_key('https://...', 'master', ['designate.conf', 'pools.yml'])
+        '5f0ac4a3d8b7e5b2'
+    """
+    h = hashlib.sha256()
+    h.update(designate_git_url)
+    h.update('\0')
+    h.update(designate_version)
+    for filename in files:
+        h.update('\0')
+        if os.path.exists(filename):
+            h.update(open(filename, 'rb').read())
+        else:
+            h.update('<missing %s>' % os.path.basename(filename))
+    return h.hexdigest()[:16]
+
+
+def image_tag(key):
+    return "%s:%s" % (IMAGE_REPOSITORY, key)
+
+
+def report():
+    """Return a one line summary of image cache usage in this process"""
+    return "%s hits, %s misses (%.1fs spent building)" % (
+        _stats['hits'], _stats['misses'], _stats['build_time'],
+    )
+
+
+class ImageCache(object):
+    """Tracks designate-base images tagged by a content hash of their inputs,
+    so that an identical image is only built once.
+
+    The lock files are kept in lock_dir, which should be shared by all test
+    processes. This ensures concurrent test processes don't build the same
+    image at the same time.
+    """
+
+    def __init__(self, logger, lock_dir):
+        self.log = logger
+        self.lock_dir = lock_dir
+
+    def ensure(self, tag, build):
+        """Make sure the image `tag` exists, calling `build()` to create it if
+        it does not.
+
+        :return: the (out, err, ret) of build(), or None on a cache hit
+        """
+        lock_file = os.path.join(
+            self.lock_dir, "%s.lock" % tag.replace(':', '-'),
+        )
+        with open(lock_file, 'w') as f:
+            self.log.debug("acquiring image lock %s", lock_file)
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                return self._ensure(tag, build)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _ensure(self, tag, build):
+        if docker.image_exists(tag):
+            _stats['hits'] += 1
+            self.log.info("image cache hit: %s", tag)
+            LOG.info("HIT %s", tag)
+            return None
+
+        _stats['misses'] += 1
+        self.log.info("image cache miss: %s", tag)
+        start = time.time()
+        result = build()
+        elapsed = time.time() - start
+        _stats['build_time'] += elapsed
+
+        _, _, ret = result
+        LOG.info("MISS %s (built in %.1fs, ret=%s)", tag, elapsed, ret)
+        return result
@@ -0,0 +1,174 @@
+"""Find and remove what crashed ruiner runs leave behind. See `ruiner
+cleanup`.
+
+Leaked compose projects are found by the label docker-compose puts on their
+containers and networks, so this needs no compose yaml. Each project's
+containers, networks, and designate-base:<project> image (built when the
+image cache is off) are removed, many projects at a time.
+
+A project is only removed once its newest container or image is older than
+a cutoff, and never while it is in the warm pool, so the environments of
+test runs in progress are left alone.
+"""
+import calendar
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from ruiner.common import docker
+from ruiner.common import dockerapi
+from ruiner.common import images
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__)
+
+# projects as labeled by docker-compose, e.g. ruindesignateabcdefgh
+LABEL_PREFIX = docker.normalize_project_name(utils.PROJECT_NAME_PREFIX)
+
+LABEL_FORMAT = '{{.ID}}\t{{.Label "%s"}}' % dockerapi.PROJECT_LABEL
+
+
+class Project(object):
+    """The docker resources of a leaked compose project"""
+
+    def __init__(self, name):
+        self.name = name
+        self.containers = []
+        self.paused = []
+        self.networks = []
+        self.images = []
+        # when the newest container or image was created, or None if unknown
+        self.created = None
+
+    def __repr__(self):
+        return "Project(%s, containers=%s, networks=%s, images=%s)" % (
+            self.name, len(self.containers), len(self.networks),
+            len(self.images))
+
+
+def _run(cmd):
+    out, _, ret = utils.run_cmd(cmd)
+    assert ret == 0, "`%s` failed" % " ".join(cmd)
+    return [line.split('\t') for line in out.splitlines() if line.strip()]
+
+
+def find_projects(prefix=LABEL_PREFIX):
+    """Return a dict mapping the (labeled) names of ruiner's compose projects
+    to their Project"""
+    projects = {}
+
+    def project(name):
+        return projects.setdefault(name, Project(name))
+
+    label = "label=%s" % dockerapi.PROJECT_LABEL
+    for cid, name, status in _run(
+            ["docker", "ps", "-a", "--filter", label, "--format",
+             LABEL_FORMAT + "\t{{.Status}}"]):
+        if name.startswith(prefix):
+            project(name).containers.append(cid)
+            # docker refuses to remove paused containers
+            if "(Paused)" in status:
+                project(name).paused.append(cid)
+
+    for nid, name in _run(["docker", "network", "ls", "--filter", label,
+                           "--format", LABEL_FORMAT]):
+        if name.startswith(prefix):
+            project(name).networks.append(nid)
+
+    # images tagged by project name. see environments.choose_designate_image
+    for (tag,) in _run(["docker", "images", "--format", "{{.Tag}}",
+                        images.IMAGE_REPOSITORY]):
+        name = docker.normalize_project_name(tag)
+        if tag.startswith(utils.PROJECT_NAME_PREFIX) and \
+                name.startswith(prefix):
+            project(name).images.append(
+                "%s:%s" % (images.IMAGE_REPOSITORY, tag))
+
+    _set_created(projects.values())
+    return projects
+
+
+def parse_created(value):
+    """Return the unix time of a `docker inspect` Created timestamp, e.g.
+    2016-08-10T18:18:03.688111Z"""
+    return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def _set_created(projects):
+    refs = [(p, ref) for p in projects for ref in p.containers + p.images]
+    if not refs:
+        return
+    # inspect prints one line per ref, in order
+    created = _run(["docker", "inspect", "--format", "{{.Created}}"] +
+                   [ref for _, ref in refs])
+    for (project, _), (value,) in zip(refs, created):
+        timestamp = parse_created(value)
+        if project.created is None or timestamp > project.created:
+            project.created = timestamp
+
+
+def stale_projects(projects, older_than, in_use=()):
+    """Return the projects created more than `older_than` seconds ago, and
+    not in use (e.g. by the warm pool). A project with only networks has no
+    creation time, and is stale.
+
+    :param in_use: project names as given to docker-compose
+    """
+    in_use = set(docker.normalize_project_name(n) for n in in_use)
+    cutoff = time.time() - older_than
+    return [p for p in projects if p.name not in in_use and
+            (p.created is None or p.created < cutoff)]
+
+
+def remove_project(project, logger=LOG):
+    """Remove the project's containers, then its networks and images. Return
+    True on success"""
+    steps = []
+    if project.paused:
+        steps.append(["docker", "unpause"] + project.paused)
+    if project.containers:
+        steps.append(["docker", "rm", "-f", "-v"] + project.containers)
+    if project.networks:
+        steps.append(["docker", "network", "rm"] + project.networks)
+    if project.images:
+        steps.append(["docker", "rmi"] + project.images)
+
+    start = time.time()
+    ok = True
+    for cmd in steps:
+        _, err, ret = utils.run_cmd(cmd)
+        if ret != 0:
+            logger.error("failed to clean up %s: `%s`: %s", project.name,
+                         " ".join(cmd[:3]), err.strip())
+            ok = False
+    logger.info("cleaned up %s in %.1fs", project, time.time() - start)
+    return ok
+
+
+def remove_projects(projects, workers=8, logger=LOG):
+    """Remove the projects concurrently. Return the names of the projects
+    that failed to be removed."""
+    if not projects:
+        return []
+    pool = ThreadPool(min(workers, len(projects)))
+    try:
+        results = pool.map(lambda p: remove_project(p, logger), projects)
+    finally:
+        pool.close()
+        pool.join()
+    return [p.name for p, ok in zip(projects, results) if not ok]
+
+
+def stale_temp_files(tmp_dir, older_than):
+    """Return the generated files (designate.conf, compose yaml, ...) in the
+    tmp dir last modified more than `older_than` seconds ago. Subdirectories,
+    like the dataset cache and the warm pool, are skipped."""
+    if not os.path.isdir(tmp_dir):
+        return []
+    cutoff = time.time() - older_than
+    result = []
+    for name in sorted(os.listdir(tmp_dir)):
+        path = os.path.join(tmp_dir, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            result.append(path)
+    return result
@@ -0,0 +1,116 @@
+"""Collect latencies for benchmarks, and summarize them as percentiles."""
+import json
+import threading
+import time
+
+from ruiner.common import bulk
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarize(values):
+    """Return the count, percentiles and max of the values"""
+    summary = {'count': len(values)}
+    for p in PERCENTILES:
+        summary['p%s' % p] = bulk.percentile(values, p)
+    summary['max'] = max(values) if values else None
+    return summary
+
+
+class Recorder(object):
+    """Records named samples (e.g. 'zone_create.api_latency') and the
+    summaries of bulk operations, and writes a json report."""
+
+    def __init__(self):
+        self.samples = {}
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def add_operation(self, name, summary):
+        """Record the bulk.Summary of a bulk operation"""
+        self.operations[name] = summary.as_dict()
+
+    def report(self, **extra):
+        report = dict(extra)
+        report['operations'] = self.operations
+        with self._lock:
+            report['latencies'] = dict(
+                (name, summarize(values))
+                for name, values in self.samples.items()
+            )
+        return report
+
+    def write(self, filename, **extra):
+        """Write the report as json. Return the report"""
+        report = self.report(**extra)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return report
+
+
+class StatusTracker(object):
+    """Polls a listing of zones in a background thread, and records when
+    each tracked zone changes status. A tracked zone that drops out of the
+    listing (e.g. once deleted) has the status 'missing'.
+
+    :param list_zones: a function returning a list of zone dicts, or None if
+        the listing failed
+    """
+
+    MISSING = 'missing'
+
+    def __init__(self, list_zones, interval=0.5):
+        self.list_zones = list_zones
+        self.interval = interval
+        self.history = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def track(self, zid):
+        with self._lock:
+            self.history.setdefault(zid, [])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.sample()
+            self._stopping.wait(self.interval)
+
+    def sample(self):
+        zones = self.list_zones()
+        if zones is None:
+            return
+        now = time.time()
+        statuses = dict((z['id'], z['status']) for z in zones)
+        with self._lock:
+            for zid, history in self.history.items():
+                status = statuses.get(zid, self.MISSING)
+                if status == self.MISSING and not history:
+                    # not created yet, or not in the listing yet
+                    continue
+                if not history or history[-1][1] != status:
+                    history.append((now, status))
+
+    def first_seen(self, zid, status, since=0):
+        """Return when the zone was first seen with the status at or after
+        `since`, or None"""
+        with self._lock:
+            for t, s in self.history.get(zid, []):
+                if s == status and t >= since:
+                    return t
+        return None
@@ -0,0 +1,130 @@
+import socket
+import time
+
+import requests
+
+from ruiner.common import utils
+
+# the AMQP 0-9-1 protocol header. rabbit answers it with a Connection.Start
+AMQP_PROTOCOL_HEADER = 'AMQP\x00\x00\x09\x01'
+
+
+def http_probe(url, timeout=2):
+    """Return a probe that is ready when a GET on the url succeeds"""
+    def probe():
+        resp = requests.get(url, timeout=timeout,
+                            headers={'Accept': 'application/json'})
+        return resp.ok
+    return probe
+
+
+def dns_probe(nameserver, zone_name='poo.com.', protocol='udp', timeout=1):
+    """Return a probe that is ready when the nameserver answers an SOA query.
+    Any answer counts (even a REFUSED), since that means it's listening."""
+    def probe():
+        utils.dig(zone_name, nameserver, 'SOA', protocol=protocol,
+                  timeout=timeout)
+        return True
+    return probe
+
+
+def tcp_probe(location, greeting=None, timeout=1):
+    """Return a probe that is ready when the service at `host:port` accepts a
+    connection and sends some data.
+
+    A plain connect is not enough, because docker's userland proxy accepts
+    connections on the published port before the service is listening. So
+    we wait for the service to talk: mysql sends a handshake on connect, and
+    rabbit responds to the `greeting` AMQP_PROTOCOL_HEADER.
+    """
+    host, port = utils.split_host_port(location, None)
+
+    def probe():
+        sock = socket.create_connection((host, port), timeout=timeout)
+        try:
+            if greeting:
+                sock.sendall(greeting)
+            return bool(sock.recv(1))
+        finally:
+            sock.close()
+    return probe
+
+
+def service_probes(services):
+    """Return a dict mapping service names to readiness probes
+
+    :param services: a dict mapping service names to locations. see
+        environments.discover_services()
+    """
+    return {
+        'api': http_probe("%s/v2/zones" % services['api']),
+        'bind-1': dns_probe(services['bind-1']),
+        'bind-2': dns_probe(services['bind-2']),
+        'mdns': dns_probe(services['mdns'], protocol='tcp'),
+        'rabbit': tcp_probe(services['rabbit'],
+                            greeting=AMQP_PROTOCOL_HEADER),
+        'mysql': tcp_probe(services['mysql']),
+    }
+
+
+def wait_until_ready(probes, timeout, logger, initial_interval=0.1,
+                     max_interval=2):
+    """Poll each probe until it is ready, backing off exponentially between
+    the attempts for each service. Return as soon as every probe is ready, or
+    when the timeout expires.
+
+    A probe is a function taking no args. It is ready when it returns True. A
+    probe that returns False or raises an exception is not ready.
+
+    :param probes: a dict mapping service names to probes
+    :return: a tuple (ready, waiting). `ready` maps service names to the
+        number of seconds until that service was ready. `waiting` maps the
+        services that never became ready to their last error.
+    """
+    start = time.time()
+    end = start + timeout
+
+    ready = {}
+    waiting = dict((name, None) for name in probes)
+    next_attempt = dict((name, start) for name in probes)
+    interval = dict((name, initial_interval) for name in probes)
+    attempts = dict((name, 0) for name in probes)
+
+    while waiting:
+        now = time.time()
+        for name in sorted(waiting):
+            if next_attempt[name] > now:
+                continue
+
+            attempts[name] += 1
+            try:
+                is_ready = probes[name]()
+                error = None if is_ready else "probe returned %r" % is_ready
+            except Exception as e:
+                is_ready = False
+                error = "%s: %s" % (type(e).__name__, e)
+
+            if is_ready:
+                ready[name] = time.time() - start
+                del waiting[name]
+                logger.info("%s is ready after %.2fs (%s attempts)", name,
+                            ready[name], attempts[name])
+            else:
+                waiting[name] = error
+                next_attempt[name] = time.time() + interval[name]
+                interval[name] = min(interval[name] * 2, max_interval)
+
+        if not waiting:
+            break
+
+        now = time.time()
+        if now >= end:
+            for name, error in sorted(waiting.items()):
+                logger.error("%s is not ready after %.2fs (%s attempts): %s",
+                             name, now - start, attempts[name], error)
+            break
+
+        soonest = min(next_attempt[name] for name in waiting)
+        time.sleep(max(0, min(soonest, end) - now))
+
+    return ready, waiting
@@ -0,0 +1,83 @@
+"""Tear down environments in the background, so tests don't wait on it.
+
+A test hands its stack to the REAPER instead of running `docker-compose
+down` itself, and the test runner worker moves on to the next test. The
+reaper tears stacks down on a few threads. At exit, it waits for the
+teardowns still running and reports any that failed. Under py.test, the
+failures are reported in the session summary (see ruiner/test/conftest.py).
+"""
+import atexit
+import Queue
+import threading
+import time
+
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__)
+
+
+class Reaper(object):
+    """Runs teardown jobs on a bounded pool of background threads
+
+    :param workers: the max number of concurrent teardowns
+    """
+
+    def __init__(self, workers=2, logger=LOG):
+        self.workers = workers
+        self.log = logger
+        self.failures = []
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args):
+        """Run func(*args) in the background. It fails if it returns a falsey
+        value or raises an exception.
+
+        :param name: identifies the job in the report, e.g. a project name
+        """
+        with self._lock:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((name, func, args))
+
+    def _run(self):
+        while True:
+            name, func, args = self._queue.get()
+            start = time.time()
+            try:
+                ok, error = func(*args), None
+            except Exception as e:
+                self.log.exception("failed to tear down %s", name)
+                ok, error = False, e
+            elapsed = time.time() - start
+            if ok:
+                self.log.info("tore down %s in %.1fs", name, elapsed)
+            else:
+                with self._lock:
+                    self.failures.append((name, error))
+            self._queue.task_done()
+
+    def wait(self):
+        """Block until every submitted job is done"""
+        self._queue.join()
+
+    def report(self):
+        """Wait for the jobs, and log the ones that failed. Return the
+        (name, exception or None) of each failure not reported before."""
+        self.wait()
+        with self._lock:
+            failures, self.failures = self.failures, []
+        for name, error in failures:
+            self.log.error("FAILED TO CLEANUP ENV (project=%s)%s", name,
+                           ": %s" % error if error is not None else "")
+            self.log.error("try `docker-compose -p %s down`", name)
+        return failures
+
+
+# the reaper is per-process, like environments.POOL
+REAPER = Reaper()
+atexit.register(REAPER.report)
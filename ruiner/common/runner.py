@@ -4,8 +4,13 @@ import os
 import subprocess
 import signal
 import sys
+import time
 
 
+from ruiner.common import docker
+from ruiner.common import leaked
+from ruiner.common import utils
+from ruiner.common import warmpool
 from ruiner.common.config import cfg
 
 
@@ -63,6 +68,49 @@ def logs(args):
     return 0
 
 
+def pool(args):
+    """Keep environments deployed for tests run with `warm_pool = True`"""
+    carina_dir = docker.discover_designate_carina_dir()
+    size = args.size or cfg.CONF.ruiner.warm_pool_size
+    warmpool.WarmPool(
+        carina_dir=carina_dir,
+        pool_dir=warmpool.get_pool_dir(carina_dir),
+        size=size,
+    ).run()
+    return 0
+
+
+def cleanup(args):
+    """Remove the compose projects, images and files leaked by ruiner runs"""
+    carina_dir = docker.discover_designate_carina_dir()
+    in_use = warmpool.in_use_projects(warmpool.get_pool_dir(carina_dir))
+    projects = leaked.stale_projects(leaked.find_projects().values(),
+                                     args.older_than * 60, in_use)
+    projects.sort(key=lambda p: p.name)
+    for project in projects:
+        print project
+    temp_files = []
+    if args.temp_files:
+        tmp_dir = os.path.join(carina_dir, 'tmp')
+        temp_files = leaked.stale_temp_files(tmp_dir, args.older_than * 60)
+        for filename in temp_files:
+            print filename
+
+    if args.dry_run:
+        return 0
+
+    start = time.time()
+    failed = leaked.remove_projects(projects, workers=args.workers)
+    for filename in temp_files:
+        utils.cleanup_file(filename)
+    print 'Removed {} projects and {} files in {:.1f}s'.format(
+        len(projects) - len(failed), len(temp_files), time.time() - start)
+    if failed:
+        print 'Failed to remove: {}'.format(', '.join(failed))
+        return 1
+    return 0
+
+
 def recursive_list(dirs):
     """Return a sorted, recursive list of plain files in the directories"""
     result = []
@@ -104,6 +152,10 @@ of test logs easier.""")
         'py.test', help='Run tests with py.test')
     log_sub_parser = subparsers.add_parser(
         'logs', help='List logs from previous test runs')
+    pool_sub_parser = subparsers.add_parser(
+        'pool', help='Keep designate environments deployed for tests')
+    cleanup_sub_parser = subparsers.add_parser(
+        'cleanup', help='Remove environments leaked by previous test runs')
 
     # the actual subparser for the logs command
     log_parser = argparse.ArgumentParser(
@@ -115,6 +167,32 @@ of test logs easier.""")
         '-r', dest='want_recursive', action='store_true',
         help="recursively list all files")
 
+    # the actual subparser for the pool command
+    pool_parser = argparse.ArgumentParser(
+        description="Keep designate environments deployed for tests")
+    pool_parser.add_argument(
+        '--size', dest='size', type=int, default=None,
+        help="how many ready environments to keep (default: warm_pool_size)")
+
+    # the actual subparser for the cleanup command
+    cleanup_parser = argparse.ArgumentParser(
+        description="Remove the containers, networks and per-project images "
+                    "of ruiner environments older than --older-than. "
+                    "Environments in the warm pool are kept.")
+    cleanup_parser.add_argument(
+        '--temp-files', dest='temp_files', action='store_true',
+        help="also remove stale generated files in designate-carina/tmp")
+    cleanup_parser.add_argument(
+        '--older-than', dest='older_than', type=int, default=60,
+        help="only remove environments and generated files older than "
+             "this many minutes (default: 60)")
+    cleanup_parser.add_argument(
+        '--workers', dest='workers', type=int, default=8,
+        help="how many environments to remove at once (default: 8)")
+    cleanup_parser.add_argument(
+        '--dry-run', dest='dry_run', action='store_true',
+        help="only list what would be removed")
+
     # set the handler for the pytest command. this has no subparser
     pytest_sub_parser.set_defaults(
         handler=lambda: invoke_command_handler('py.test', pytest)
@@ -124,6 +202,17 @@ of test logs easier.""")
     log_sub_parser.set_defaults(
         handler=lambda: invoke_command_handler('logs', logs, log_parser),
     )
+
+    # set the handler and the subparser for the pool command
+    pool_sub_parser.set_defaults(
+        handler=lambda: invoke_command_handler('pool', pool, pool_parser),
+    )
+
+    # set the handler and the subparser for the cleanup command
+    cleanup_sub_parser.set_defaults(
+        handler=lambda: invoke_command_handler('cleanup', cleanup,
+                                               cleanup_parser),
+    )
     return parser.parse_args(sys.argv[1:2])
 
 
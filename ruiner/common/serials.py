@@ -0,0 +1,181 @@
+"""Watch the SOA serials of zones on nameservers, to time zone propagation.
+
+A SerialWatcher samples the SOA serial of each watched zone on each
+nameserver, several times a second, in a background thread. Each time the
+serial changes it records a SerialEvent, with the time it was observed.
+Waiters block on the event log instead of polling the nameservers
+themselves, and the event timestamps give the propagation latency of each
+change to each nameserver.
+"""
+import collections
+import threading
+import time
+
+import dns.rdatatype
+
+from ruiner.common import dnsprobe
+from ruiner.common import utils
+
+LOG = utils.create_logger(__name__)
+
+# the serial recorded when a nameserver doesn't have the zone
+GONE = None
+
+SerialEvent = collections.namedtuple(
+    'SerialEvent', ['zone', 'nameserver', 'serial', 'timestamp'])
+
+
+def soa_serial(response):
+    """Return the SOA serial in a dns response, or GONE if there is no SOA
+    in the answer (e.g. REFUSED because the nameserver has no such zone)"""
+    for rrset in response.answer:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return rrset[0].serial
+    return GONE
+
+
+class SerialWatcher(object):
+    """Records every change in the SOA serials of the watched zones.
+
+    A nameserver that doesn't respond is skipped until it responds again, so
+    an outage doesn't show up as the zone being removed.
+
+    :param nameservers: a dict mapping nameserver names (e.g. 'bind-1') to
+        their locations (host:port)
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, nameservers, interval=0.2, probe_timeout=0.5,
+                 logger=LOG):
+        self.nameservers = dict(nameservers)
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.log = logger
+
+        self.events = []
+        self._zones = set()
+        self._current = {}
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def watch(self, zone):
+        """Start watching the zone. Return the current time, for measuring
+        latencies from (e.g. call this just before creating the zone)"""
+        with self._cond:
+            self._zones.add(zone)
+        return time.time()
+
+    def unwatch(self, zone):
+        with self._cond:
+            self._zones.discard(zone)
+
+    def set_nameserver(self, name, location):
+        """Update a nameserver location (e.g. after a container restart)"""
+        with self._cond:
+            self.nameservers[name] = location
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            start = time.time()
+            try:
+                self.sample()
+            except Exception:
+                self.log.exception("failed to sample soa serials")
+            self._stopping.wait(max(0, self.interval - (time.time() - start)))
+
+    def sample(self):
+        """Query the serial of each watched zone on each nameserver once, and
+        record any changes"""
+        with self._cond:
+            zones = sorted(self._zones)
+            nameservers = dict(self.nameservers)
+        if not zones:
+            return
+
+        prober = dnsprobe.Prober(timeout=self.probe_timeout, retries=0)
+        names = {}
+        for zone in zones:
+            for name, location in nameservers.items():
+                query = prober.add(zone, location, 'SOA')
+                names[query] = name
+        prober.run()
+
+        now = time.time()
+        with self._cond:
+            for query, name in names.items():
+                if query.response is None:
+                    continue
+                self._record(query.name, name, soa_serial(query.response),
+                             now)
+            self._cond.notify_all()
+
+    def _record(self, zone, nameserver, serial, timestamp):
+        key = (zone, nameserver)
+        if key in self._current and self._current[key] == serial:
+            return
+        self._current[key] = serial
+        event = SerialEvent(zone, nameserver, serial, timestamp)
+        self.events.append(event)
+        self.log.debug("%s on %s: serial %s", zone, nameserver, serial)
+
+    def serial(self, zone, nameserver):
+        """Return the last serial seen, GONE, or None if never sampled"""
+        with self._cond:
+            return self._current.get((zone, nameserver))
+
+    def history(self, zone, nameserver=None):
+        """Return the events for the zone (on the nameserver)"""
+        with self._cond:
+            return [e for e in self.events if e.zone == zone and
+                    nameserver in (None, e.nameserver)]
+
+    def wait_for(self, zone, nameserver, predicate, timeout, since=0):
+        """Block until an event for the zone on the nameserver, observed at or
+        after `since`, satisfies the predicate. Return the first such event,
+        or None on timeout.
+
+        :param predicate: a function taking a serial (or GONE)
+        """
+        end = time.time() + timeout
+        checked = 0
+        with self._cond:
+            while True:
+                for event in self.events[checked:]:
+                    if (event.zone == zone and
+                            event.nameserver == nameserver and
+                            event.timestamp >= since and
+                            predicate(event.serial)):
+                        return event
+                checked = len(self.events)
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def wait_for_present(self, zone, nameserver, timeout, since=0,
+                         min_serial=None):
+        """Wait for the zone to show up on the nameserver, with a serial of at
+        least min_serial (if given). Return the SerialEvent, or None."""
+        def present(serial):
+            if serial is GONE:
+                return False
+            return min_serial is None or serial >= min_serial
+        return self.wait_for(zone, nameserver, present, timeout, since=since)
+
+    def wait_for_gone(self, zone, nameserver, timeout, since=0):
+        """Wait for the zone to be removed from the nameserver. Return the
+        SerialEvent, or None."""
+        return self.wait_for(zone, nameserver, lambda s: s is GONE, timeout,
+                             since=since)
@@ -4,6 +4,7 @@ import logging
 import subprocess
 import random
 import re
+import socket
 import string
 import os
 import tempfile
@@ -146,26 +147,61 @@ def resp_to_string(resp):
     return msg
 
 
-def dig(zone_name, nameserver, rdatatype):
+def dig(zone_name, nameserver, rdatatype, protocol='udp', timeout=1):
     """dig a nameserver for a record of the given type
 
         >>> dig('poo.com.', '127.0.0.1:53', 'SOA')
         <DNS message, ID 1044>
         >>> dig('poo.com.', '127.0.0.1', dns.rdatatype.SOA)
         <DNS message, ID 1044>
+        >>> dig('poo.com.', '127.0.0.1:5354', 'SOA', protocol='tcp')
+        <DNS message, ID 1044>
     """
-    host = nameserver
-    port = 53
-
-    if ':' in nameserver:
-        host, port = nameserver.split(':')
-        port = int(port)
+    host, port = split_host_port(nameserver, 53)
 
     if isinstance(rdatatype, basestring):
         rdatatype = dns.rdatatype.from_text(rdatatype)
 
     query = prepare_query(zone_name, rdatatype)
-    return dns.query.udp(query, host, timeout=1, port=port)
+    if protocol == 'tcp':
+        return dns.query.tcp(query, host, timeout=timeout, port=port)
+    return dns.query.udp(query, host, timeout=timeout, port=port)
+
+
+def split_host_port(location, default_port):
+    """
+        >>> split_host_port('127.0.0.1:5354', 53)
+        ('127.0.0.1', 5354)
+        >>> split_host_port('127.0.0.1', 53)
+        ('127.0.0.1', 53)
+    """
+    if ':' in location:
+        host, port = location.rsplit(':', 1)
+        return host, int(port)
+    return location, default_port
+
+
+def bind_udp_and_tcp(host, port=0, attempts=10):
+    """Return a udp socket and a listening tcp socket bound to the same port
+    on host. With port 0, a free port is chosen for udp, and a new one is
+    tried if the tcp port of the same number is taken.
+    """
+    for attempt in range(attempts):
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((host, port))
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            tcp.bind((host, udp.getsockname()[1]))
+        except socket.error as e:
+            udp.close()
+            tcp.close()
+            if (e.errno != errno.EADDRINUSE or port != 0 or
+                    attempt + 1 >= attempts):
+                raise
+            continue
+        tcp.listen(16)
+        return udp, tcp
 
 
 def prepare_query(zone_name, rdatatype):
@@ -193,7 +229,11 @@ def random_tag(n=8):
     return result.lower()
 
 
-def random_project_name(name="ruin_designate", tag=None):
+# the prefix of every compose project name ruiner deploys
+PROJECT_NAME_PREFIX = "ruin_designate"
+
+
+def random_project_name(name=PROJECT_NAME_PREFIX, tag=None):
     tag = tag or random_tag()
     return "{}_{}".format(name, tag).lower()
 
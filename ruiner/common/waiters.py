@@ -1,71 +1,354 @@
+from ConfigParser import Error as ConfigParserError
 import time
 
+from ruiner.common import dnsprobe
 from ruiner.common import utils
+from ruiner.common.ini import IniFile
 
 
-def wait_for_status(api_call, statuses, interval, timeout):
-    """Wait for the zone to show the status
+class PollSchedule(object):
+    """Decides how long a waiter sleeps between polls"""
 
-    :param statuses: if the status is in this list, stop polling
-    :return resp: the last response received
+    def sleep_time(self, polls, elapsed):
+        """Return the seconds to sleep before the next poll
+
+        :param polls: how many polls have been done so far
+        :param elapsed: seconds since the first poll
+        """
+        raise NotImplementedError
+
+
+class FixedSchedule(PollSchedule):
+    """Sleep the same interval between each poll"""
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def sleep_time(self, polls, elapsed):
+        return self.interval
+
+
+class ExponentialSchedule(PollSchedule):
+    """Poll quickly at first, then back off exponentially up to a cap:
+
+        0.25, 0.5, 1, 2, 3, 3, 3, ...
+    """
+
+    def __init__(self, initial, cap, factor=2):
+        self.initial = initial
+        self.cap = cap
+        self.factor = factor
+
+    def sleep_time(self, polls, elapsed):
+        return min(self.cap, self.initial * self.factor ** max(0, polls - 1))
+
+
+class HintedSchedule(PollSchedule):
+    """Poll just after the moments when a change is likely, and otherwise
+    follow a fallback schedule.
+
+    :param hints: seconds since the first poll when a change is expected
+    :param slack: how long after a hinted moment to poll
+    """
+
+    def __init__(self, hints, fallback, slack=0.25):
+        self.hints = sorted(hints)
+        self.fallback = fallback
+        self.slack = slack
+
+    def sleep_time(self, polls, elapsed):
+        sleep = self.fallback.sleep_time(polls, elapsed)
+        for hint in self.hints:
+            if hint + self.slack > elapsed:
+                return min(sleep, hint + self.slack - elapsed)
+        return sleep
+
+    @classmethod
+    def from_designate_conf(cls, filename, fallback, slack=0.25):
+        """Predict when designate's worker will update a zone status, from
+        its poll settings in designate.conf.
+
+        After a change, the worker waits poll_delay seconds and then queries
+        each nameserver, retrying every poll_retry_interval seconds (each
+        query can take up to poll_timeout) for up to poll_max_retries
+        retries. A zone left in ERROR is retried by the periodic recovery
+        task, which runs every `interval` seconds.
+        """
+        conf = IniFile(filename)
+
+        def getint(section, key, default):
+            try:
+                return conf.getint(section, key)
+            except (ConfigParserError, ValueError):
+                return default
+
+        poll_delay = getint("service:worker", "poll_delay", 5)
+        poll_timeout = getint("service:worker", "poll_timeout", 30)
+        retry_interval = getint("service:worker", "poll_retry_interval", 15)
+        max_retries = getint("service:worker", "poll_max_retries", 10)
+        recovery_interval = getint(
+            "producer_task:worker_periodic_recovery", "interval", 120)
+
+        hints = []
+        for retry in range(max_retries + 1):
+            t = poll_delay + retry * (retry_interval + poll_timeout)
+            # a successful poll, or a poll that times out
+            hints.extend([t, t + poll_timeout])
+
+        # periodic recovery, in the worst case (the task runs just after the
+        # final poll times out)
+        last = hints[-1]
+        hints.extend(last + k * recovery_interval for k in range(1, 4))
+        return cls(hints, fallback, slack=slack)
+
+
+def as_schedule(interval):
+    """Return a PollSchedule for the interval, which is either a schedule or
+    a number of seconds"""
+    if isinstance(interval, PollSchedule):
+        return interval
+    return FixedSchedule(interval)
+
+
+class WaitResult(object):
+    """The outcome of a waiter.
+
+    :ivar outcome: SUCCESS, FAILURE, or TIMEOUT
+    :ivar resp: the last response received
+    :ivar state: the last state observed
+    :ivar polls: how many times we polled
+    :ivar elapsed: seconds from the first poll until the waiter stopped
+    :ivar transitions: a list of (seconds, state) for each change in state,
+        where seconds is the time since the first poll
     """
-    end = time.time() + timeout
+
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+    TIMEOUT = 'timeout'
+
+    def __init__(self):
+        self.outcome = None
+        self.resp = None
+        self.state = None
+        self.polls = 0
+        self.elapsed = 0.0
+        self.transitions = []
+
+    def __repr__(self):
+        return "WaitResult(%s, state=%r, polls=%s, elapsed=%.2f)" % (
+            self.outcome, self.state, self.polls, self.elapsed)
+
+    @property
+    def succeeded(self):
+        return self.outcome == self.SUCCESS
+
+    def record(self, resp, state, elapsed):
+        if not self.transitions or self.transitions[-1][1] != state:
+            self.transitions.append((elapsed, state))
+        self.resp = resp
+        self.state = state
+        self.polls += 1
+        self.elapsed = elapsed
+
+    def trace(self):
+        """Return a string of the state transitions, like
+        `PENDING (0.00s) -> ERROR (6.03s) -> ACTIVE (34.11s)`"""
+        return " -> ".join("%s (%.2fs)" % (state, t)
+                           for t, state in self.transitions)
+
+
+def wait_for(poll, get_state, success_states, failure_states, interval,
+             timeout, fail_on_error=False):
+    """Poll until we see a success state or a failure state, or until we
+    timeout.
+
+    :param poll: a function returning a response
+    :param get_state: a function mapping a response to its state
+    :param interval: a PollSchedule, or the seconds to sleep between polls.
+        We never sleep past the timeout, so the final poll happens at the
+        timeout.
+    :param fail_on_error: if True, stop and fail on an unsuccessful http
+        response (unless its state is a success state)
+    :return: a WaitResult
+    """
+    schedule = as_schedule(interval)
+    result = WaitResult()
+    start = time.time()
+    end = start + timeout
     while True:
-        resp = api_call()
+        resp = poll()
+        state = get_state(resp)
+        result.record(resp, state, time.time() - start)
 
-        if not resp.ok:
+        if state in success_states:
+            result.outcome = WaitResult.SUCCESS
             break
-        if end < time.time():
+        if state in failure_states or (fail_on_error and not resp.ok):
+            result.outcome = WaitResult.FAILURE
             break
-        if resp.json()["status"] in statuses:
+        now = time.time()
+        if now >= end:
+            result.outcome = WaitResult.TIMEOUT
             break
-        time.sleep(interval)
-    return resp
+        sleep = schedule.sleep_time(result.polls, now - start)
+        time.sleep(max(0, min(sleep, end - now)))
+    return result
 
 
-def wait_for_404(api_call, interval, timeout):
-    """Wait for a zone to return a 404"""
+def zone_state(resp):
+    """Return the status of the resource, or the status code if the request
+    failed"""
+    if resp.ok:
+        return resp.json()["status"]
+    return resp.status_code
 
-    end = time.time() + timeout
-    while True:
-        resp = api_call()
-        if resp.status_code == 404:
-            break
-        if end < time.time():
-            break
-        time.sleep(interval)
-    return resp
 
+def name_state(resp):
+    """Return whether the dns response has an answer"""
+    return 'found' if resp.answer else 'not found'
 
-def wait_for_name_on_nameserver(name, ns, interval, timeout):
-    """Wait for the name to show up on the nameserver. This does not catch
-    timeout exceptions"""
 
-    end = time.time() + timeout
+def wait_for_status(api_call, statuses, interval, timeout,
+                    failure_statuses=()):
+    """Wait for the zone to show the status
+
+    :param statuses: if the status is in this list, stop polling
+    :param failure_statuses: if the status is in this list, stop polling and
+        fail. A failed request (e.g. a 404) is always a failure.
+    :return: a WaitResult
+    """
+    return wait_for(api_call, zone_state, statuses, failure_statuses,
+                    interval, timeout, fail_on_error=True)
+
+
+def wait_for_404(api_call, interval, timeout, failure_statuses=()):
+    """Wait for a zone to return a 404
+
+    :param failure_statuses: if the zone status is in this list, stop polling
+        and fail
+    :return: a WaitResult
+    """
+    return wait_for(api_call, zone_state, [404], failure_statuses, interval,
+                    timeout)
+
+
+def wait_for_zones_status(list_zones, zone_ids, statuses, interval, timeout,
+                          failure_statuses=()):
+    """Wait for each of the zones to show one of the statuses. Each poll is a
+    single listing of zones, rather than a request per zone.
+
+    :param list_zones: a function returning a list of zone dicts, or None if
+        the listing failed. The listing may be filtered, since a zone missing
+        from the listing is in the state 'missing'.
+    :param zone_ids: the ids of the zones to wait for
+    :param statuses: when a zone shows one of these statuses, it succeeds
+    :param failure_statuses: when a zone shows one of these statuses, it fails
+    :return: a dict mapping each zone id to a WaitResult. The resp of each
+        WaitResult is the zone dict from the last listing.
+    """
+    schedule = as_schedule(interval)
+    results = dict((zid, WaitResult()) for zid in zone_ids)
+    pending = set(zone_ids)
+    polls = 0
+    start = time.time()
+    end = start + timeout
     while True:
-        resp = utils.dig(name, ns, "ANY")
+        zones = list_zones()
+        polls += 1
+        now = time.time()
+
+        if zones is not None:
+            found = dict((z['id'], z) for z in zones if z['id'] in pending)
+            for zid in list(pending):
+                zone = found.get(zid)
+                state = zone['status'] if zone else 'missing'
+                result = results[zid]
+                result.record(zone, state, now - start)
+
+                if state in statuses:
+                    result.outcome = WaitResult.SUCCESS
+                elif state in failure_statuses:
+                    result.outcome = WaitResult.FAILURE
+                else:
+                    continue
+                pending.remove(zid)
 
-        if bool(resp.answer):
+        if not pending:
             break
-        if end < time.time():
+        if now >= end:
+            for zid in pending:
+                results[zid].outcome = WaitResult.TIMEOUT
             break
-        time.sleep(interval)
+        sleep = schedule.sleep_time(polls, now - start)
+        time.sleep(max(0, min(sleep, end - now)))
+    return results
 
-    return resp
+
+def wait_for_name_on_nameserver(name, ns, interval, timeout):
+    """Wait for the name to show up on the nameserver. This does not catch
+    timeout exceptions
+
+    :return: a WaitResult
+    """
+    return wait_for(
+        lambda: utils.dig(name, ns, "ANY"), name_state, ['found'], [],
+        interval, timeout,
+    )
 
 
 def wait_for_name_removed_from_nameserver(name, ns, interval, timeout):
     """Wait for the name to be removed from the nameserver. This does not catch
-    timeout exceptions"""
+    timeout exceptions
+
+    :return: a WaitResult
+    """
+    return wait_for(
+        lambda: utils.dig(name, ns, "ANY"), name_state, ['not found'], [],
+        interval, timeout,
+    )
+
 
-    end = time.time() + timeout
+def wait_for_names_on_nameservers(names, nameservers, interval, timeout,
+                                  present=True, probe_timeout=1):
+    """Wait for each name to show up on (or, if not present, be removed from)
+    each nameserver. Each poll queries every remaining (name, nameserver)
+    concurrently. A query that gets no response has the state 'no response'.
+
+    :return: a dict mapping each (name, nameserver) to a WaitResult. The resp
+        of each WaitResult is the dns response from the last poll.
+    """
+    wanted = 'found' if present else 'not found'
+    schedule = as_schedule(interval)
+    pending = set((name, ns) for name in names for ns in nameservers)
+    results = dict((key, WaitResult()) for key in pending)
+    polls = 0
+    start = time.time()
+    end = start + timeout
     while True:
-        resp = utils.dig(name, ns, "ANY")
+        prober = dnsprobe.Prober(timeout=probe_timeout)
+        for name, ns in pending:
+            prober.add(name, ns, "ANY")
+        queries = prober.run()
+        polls += 1
+        now = time.time()
 
-        if not bool(resp.answer):
+        for query in queries:
+            key = (query.name, query.nameserver)
+            if query.response is None:
+                state = 'no response'
+            else:
+                state = name_state(query.response)
+            results[key].record(query.response, state, now - start)
+            if state == wanted:
+                results[key].outcome = WaitResult.SUCCESS
+                pending.discard(key)
+
+        if not pending:
             break
-        if end < time.time():
+        if now >= end:
+            for key in pending:
+                results[key].outcome = WaitResult.TIMEOUT
             break
-        time.sleep(interval)
-
-    return resp
+        sleep = schedule.sleep_time(polls, now - start)
+        time.sleep(max(0, min(sleep, end - now)))
+    return results
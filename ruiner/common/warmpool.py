@@ -0,0 +1,316 @@
+"""A pool of pre-deployed designate environments, for `ruiner pool`.
+
+The pool is a directory shared by the pool daemon and the test processes.
+Each deployed environment is described by a json file, which moves between
+subdirectories as the environment is used:
+
+    ready/<fingerprint>_<project>.json     deployed, waiting for a test
+    leased/<fingerprint>_<project>.json    in use by a test
+    released/<fingerprint>_<project>.json  done. the daemon will tear it down
+
+Tests lease an environment by renaming its file from ready/ to leased/. The
+rename is atomic, so each environment goes to exactly one test process. The
+test then records its pid in the file. If a test process dies without
+releasing its environment, the daemon reclaims it.
+"""
+import errno
+import json
+import os
+import threading
+import time
+
+from ruiner.common import environments
+from ruiner.common import readiness
+from ruiner.common import utils
+from ruiner.common.config import cfg
+
+LOG = utils.create_logger(__name__, 'pool.log')
+
+READY = 'ready'
+LEASED = 'leased'
+RELEASED = 'released'
+
+# a leased file with no owner is stale after this many seconds
+OWNERLESS_LEASE_TIMEOUT = 60
+
+
+def get_pool_dir(carina_dir):
+    return cfg.CONF.ruiner.warm_pool_dir or os.path.join(
+        carina_dir, 'tmp', 'pool')
+
+
+def init_pool_dir(pool_dir):
+    for state in (READY, LEASED, RELEASED):
+        utils.mkdirs(os.path.join(pool_dir, state))
+
+
+def list_entries(pool_dir, state):
+    """Return the names of the environment files in the given state"""
+    d = os.path.join(pool_dir, state)
+    if not os.path.isdir(d):
+        return []
+    # hidden files are partially written
+    return sorted(f for f in os.listdir(d)
+                  if f.endswith('.json') and not f.startswith('.'))
+
+
+def write_entry(path, data):
+    """Write the json file atomically, through a hidden temp file, so it's
+    never read partially written"""
+    tmp_path = os.path.join(os.path.dirname(path),
+                            '.' + os.path.basename(path))
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_path, path)
+
+
+def read_entry(path):
+    """Return the Environment, and its owner dict or None"""
+    with open(path) as f:
+        data = json.load(f)
+    owner = data.pop('owner', None)
+    return environments.Environment.from_dict(data), owner
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def is_stale_lease(path, owner):
+    """Return True if the test process holding the lease is gone"""
+    if owner is None:
+        # the owner is written right after the lease
+        return time.time() - os.stat(path).st_ctime > OWNERLESS_LEASE_TIMEOUT
+    return not pid_exists(owner['pid'])
+
+
+def in_use_projects(pool_dir):
+    """Return the project names of the environments that are ready, or
+    leased by a live test process"""
+    names = set()
+    for state in (READY, LEASED):
+        for name in list_entries(pool_dir, state):
+            path = os.path.join(pool_dir, state, name)
+            try:
+                env, owner = read_entry(path)
+                if state == LEASED and is_stale_lease(path, owner):
+                    continue
+            except (IOError, OSError, ValueError):
+                continue
+            names.add(env.project_name)
+    return names
+
+
+def lease(pool_dir, fingerprint):
+    """Lease a ready environment with the given fingerprint. Return the
+    Environment, or None if there is no such environment."""
+    for name in list_entries(pool_dir, READY):
+        if not name.startswith(fingerprint + '_'):
+            continue
+        leased = os.path.join(pool_dir, LEASED, name)
+        try:
+            os.rename(os.path.join(pool_dir, READY, name), leased)
+        except OSError:
+            # another test process leased it first
+            continue
+        env, _ = read_entry(leased)
+        data = env.to_dict()
+        data['owner'] = {'pid': os.getpid(), 'leased_at': time.time()}
+        write_entry(leased, data)
+        env.lease_file = leased
+        return env
+    return None
+
+
+def release(pool_dir, env):
+    """Hand the environment back to the pool daemon for teardown"""
+    name = os.path.basename(env.lease_file)
+    os.rename(env.lease_file, os.path.join(pool_dir, RELEASED, name))
+    env.lease_file = None
+
+
+class WarmPool(object):
+    """Keeps a number of designate environments deployed and ready, so that
+    tests don't wait on deployment. Released environments are torn down, and
+    replaced, in the background.
+
+    Environments are deployed with the default designate.conf, so they are
+    only leased by tests which don't customize designate.conf.
+    """
+
+    def __init__(self, carina_dir, pool_dir, size, logger=LOG):
+        self.carina_dir = carina_dir
+        self.pool_dir = pool_dir
+        self.size = size
+        self.log = logger
+
+        self.tempdir = environments.init_tmp_dir(carina_dir)
+        self._lock = threading.Lock()
+        self._deploying = 0
+        self._threads = []
+        self._stopping = False
+
+    def run(self, interval=1):
+        init_pool_dir(self.pool_dir)
+        self.log.info("keeping %s environments ready in %s", self.size,
+                      self.pool_dir)
+        try:
+            while True:
+                self.step()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.log.info("shutting down")
+        finally:
+            self.shutdown()
+
+    def step(self):
+        """Tear down released environments and stale leases, and start
+        deploying enough new environments to fill the pool"""
+        for name in list_entries(self.pool_dir, RELEASED):
+            env = self._take(RELEASED, name)
+            if env:
+                self._spawn(self.destroy, env)
+        self.reap_stale_leases()
+
+        with self._lock:
+            n_ready = len(list_entries(self.pool_dir, READY))
+            missing = self.size - n_ready - self._deploying
+            self._deploying += max(0, missing)
+
+        for _ in range(missing):
+            self._spawn(self.deploy)
+
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    def deploy(self):
+        """Deploy a new environment. Publish it to ready/ once all services
+        are ready."""
+        env = None
+        try:
+            env = self._deploy()
+            if env is None:
+                return
+            if self._stopping:
+                self.destroy(env)
+                return
+            self._publish(env)
+        except Exception:
+            self.log.exception("failed to deploy environment")
+            if env is not None:
+                self.destroy(env)
+        finally:
+            with self._lock:
+                self._deploying -= 1
+
+    def _deploy(self):
+        tag = utils.random_tag()
+        project_name = utils.random_project_name(tag=tag)
+        self.log.info("deploying env %s", project_name)
+
+        designate_conf = environments.init_designate_conf(self.carina_dir,
+                                                          tag)
+        environments.configure_designate_conf_defaults(designate_conf)
+        env = environments.generate_environment(
+            self.log, self.carina_dir, project_name, designate_conf, tag,
+        )
+        env.temp_files.append(designate_conf)
+
+        start = time.time()
+        docker_composer = env.docker_composer(self.log)
+        result = environments.build_images(
+            docker_composer, env.designate_image, self.tempdir, self.log,
+        )
+        if result is not None and result[2] != 0:
+            self.log.error("failed to build images for %s", project_name)
+            env.destroy(self.log)
+            return None
+
+        _, _, ret = docker_composer.up()
+        if ret != 0:
+            self.log.error("failed to start %s", project_name)
+            env.destroy(self.log)
+            return None
+
+        if not self.wait_for_services(docker_composer):
+            env.destroy(self.log)
+            return None
+
+        self.log.info("env %s is ready after %.1fs", project_name,
+                      time.time() - start)
+        return env
+
+    def wait_for_services(self, docker_composer):
+        if not cfg.CONF.ruiner.readiness_probes:
+            time.sleep(cfg.CONF.ruiner.service_startup_wait_time)
+            return True
+
+        services = environments.discover_services(docker_composer, self.log)
+        _, waiting = readiness.wait_until_ready(
+            readiness.service_probes(services),
+            cfg.CONF.ruiner.service_startup_timeout, self.log,
+        )
+        return not waiting
+
+    def destroy(self, env):
+        self.log.info("tearing down env %s", env.project_name)
+        env.destroy(self.log)
+
+    def shutdown(self):
+        """Wait for in-progress work, then tear down all ready environments.
+        Leased environments are left for their tests to finish with."""
+        self._stopping = True
+        for thread in self._threads:
+            thread.join()
+        for name in list_entries(self.pool_dir, READY):
+            env = self._take(READY, name)
+            if env:
+                self.destroy(env)
+
+        leased = list_entries(self.pool_dir, LEASED)
+        if leased:
+            self.log.warning("%s environments are still leased: %s",
+                             len(leased), ", ".join(leased))
+
+    def reap_stale_leases(self):
+        """Tear down leased environments whose test process died without
+        releasing them"""
+        for name in list_entries(self.pool_dir, LEASED):
+            path = os.path.join(self.pool_dir, LEASED, name)
+            try:
+                _, owner = read_entry(path)
+                if not is_stale_lease(path, owner):
+                    continue
+            except (IOError, OSError, ValueError):
+                # released or reaped meanwhile
+                continue
+            env = self._take(LEASED, name)
+            if env:
+                self.log.warning("env %s was leased by pid %s, which is "
+                                 "gone. tearing it down", env.project_name,
+                                 owner and owner['pid'])
+                self._spawn(self.destroy, env)
+
+    def _publish(self, env):
+        name = "%s_%s.json" % (env.fingerprint, env.project_name)
+        write_entry(os.path.join(self.pool_dir, READY, name), env.to_dict())
+        self.log.info("env %s is in the pool", env.project_name)
+
+    def _take(self, state, name):
+        """Remove the environment file. Return the Environment it described,
+        or None if it's already gone"""
+        path = os.path.join(self.pool_dir, state, name)
+        try:
+            env, _ = read_entry(path)
+            os.remove(path)
+        except (IOError, OSError):
+            return None
+        return env
+
+    def _spawn(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.start()
+        self._threads.append(thread)
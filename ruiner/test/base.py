@@ -1,42 +1,30 @@
 import time
 import unittest
-import tempfile
 import os
 import shutil
+from multiprocessing.pool import ThreadPool
 
 import dns.exception
-import jinja2
 
+from ruiner.common import axfr
+from ruiner.common import datasets
 from ruiner.common import designate
+from ruiner.common import dnsprobe
 from ruiner.common import docker
+from ruiner.common import environments
+from ruiner.common import events
+from ruiner.common import faultproxy
+from ruiner.common import images
+from ruiner.common import readiness
+from ruiner.common import reaper
+from ruiner.common import serials
 from ruiner.common import utils
 from ruiner.common import waiters
+from ruiner.common import warmpool
 from ruiner.common.config import cfg
 from ruiner.common.ini import IniFile
 
 
-class DockerComposeYamlTemplate(object):
-    """A tool to generate a designate.yml for docker-compose"""
-
-    def __init__(self, logger, tag=None):
-        self.log = logger
-        self.source_template = './ruiner/templates/designate.yml.jinja2'
-        self.output_file = utils.new_temp_file(self._filetag(tag), ".yml")
-        self.log.debug("using designate.yml generated at %s", self.output_file)
-
-    def render(self, **kwargs):
-        templ = jinja2.Template(open(self.source_template).read())
-        content = templ.render(**kwargs)
-        with open(self.output_file, 'w') as f:
-            f.write(content)
-        self.log.debug("%s has content:\n%s", self.output_file, content)
-
-    def _filetag(self, tag):
-        if tag:
-            return "designate-%s-" % tag
-        return "designate-"
-
-
 class BaseTest(unittest.TestCase):
 
     @classmethod
@@ -62,6 +50,23 @@ class BaseTest(unittest.TestCase):
 class BaseDesignateTest(BaseTest):
     """This class deploys Designate into docker containers on test setup"""
 
+    # with reuse_environments, these tables are emptied between tests
+    reset_tables = (
+        'records',
+        'recordsets',
+        'zone_attributes',
+        'zone_masters',
+        'zone_tasks',
+        'zone_transfer_accepts',
+        'zone_transfer_requests',
+        'zones',
+        'quotas',
+    )
+
+    # the name of a dataset (see ruiner.common.datasets) to load into the
+    # database before each test, or None for an empty database
+    dataset = None
+
     def setUp(self):
         super(BaseDesignateTest, self).setUp()
         self.log.info("======== base designate test setup ========")
@@ -72,37 +77,79 @@ class BaseDesignateTest(BaseTest):
         self.carina_dir = docker.discover_designate_carina_dir()
         self.project_name = utils.random_project_name(tag=self.random_tag)
 
+        # files generated for this test. see track_temp_file()
+        self.temp_files = []
+        self.addCleanup(self.cleanup_temp_files)
+
+        # faulted nameservers. see pause_nameserver, partition_nameserver,
+        # proxy_nameserver
+        self.paused = set()
+        self.partitioned = {}
+        self.proxies = {}
+
         self.init_tmp_dir()
         self.init_designate_conf()
-        self.init_docker_compose_yaml()
 
         # this can be overridden in subclasses to configure designate however
         self.configure_designate_conf()
         self.show_designate_conf()
+        self.poll_schedule = self.init_poll_schedule()
 
-        self.docker_composer = docker.DockerComposer(
-            logger=self.log,
-            compose_files=[
-                "base.yml", self.designate_yaml, "envs/slappy-bind/bind.yml",
-            ],
-            project_name=self.project_name,
-            carina_dir=self.carina_dir,
-        )
+        self.environment = self.lease_environment()
+
+        if self.environment is None:
+            # the image tag depends on the final designate.conf
+            self.init_docker_compose_yaml()
 
-        self.deploy_environment()
-        self.services = self.discover_services()
-        self.prechecks()
+            self.docker_composer = docker.make_composer(
+                logger=self.log,
+                compose_files=self.compose_files,
+                project_name=self.project_name,
+                carina_dir=self.carina_dir,
+            )
+
+        # tearDown doesn't run if setUp fails, so release or tear down the
+        # environment here. otherwise, it is in no pool and is never removed
+        try:
+            if self.environment is not None:
+                self.use_environment(self.environment)
+            else:
+                self.deploy_environment()
+                if cfg.CONF.ruiner.reuse_environments:
+                    self.environment = self.new_environment()
+
+            self.services = self.discover_services()
+            self.wait_for_services()
+            self.prechecks()
+            if self.dataset:
+                self.load_dataset(self.dataset)
+            self.serial_watcher = self.start_serial_watcher()
+            self.container_events = self.start_container_events()
+        except Exception:
+            self.log.exception("======== setup failed ========")
+            try:
+                self.teardown_environment()
+            except Exception:
+                self.log.exception("failed to clean up env (%s) after the "
+                                   "failed setup", self.project_name)
+            raise
 
         self.log.info("======== test start ========")
 
     def tearDown(self):
         self.log.info("======== base designate test teardown ========")
-        self.show_docker_logs()
-        self.store_configs()
-        self.cleanup_environment()
+        self.collect_artifacts()
+        self.teardown_environment()
         self.summarize()
         super(BaseTest, self).tearDown()
 
+    def teardown_environment(self):
+        """Release the environment for another test, or tear it down"""
+        if self.environment is not None:
+            self.release_environment()
+        else:
+            self.cleanup_environment()
+
     def summarize(self):
         self.log.info("======== SUMMARY ========")
         tag = getattr(self, 'random_tag', 'N/A')
@@ -116,112 +163,302 @@ class BaseDesignateTest(BaseTest):
         self.log.info("service log . . . . . . : %s", services_logfile)
         self.log.info("designate_git_url . . . : %s", designate_git_url)
         self.log.info("designate_version . . . : %s", designate_version)
+        self.log.info("image . . . . . . . . . : %s",
+                      getattr(self, 'designate_image', 'N/A'))
+        self.log.info("image cache . . . . . . : %s", images.report())
 
     def configure_designate_conf(self):
         """This method may be overridden by subclasses. You MUST do all
         customization of self.designate_conf in this method, so that the file
-        is prepared before the images are built.
+        is prepared before the images are built (or, with
+        inject_designate_conf, before the containers are started).
         """
         self.log.info("======== configuring designate.conf ========")
-        conf = IniFile(self.designate_conf)
-        conf.set("DEFAULT", "debug", True)
-        conf.set("service:worker", "poll_timeout", 2)
-        conf.set("service:worker", "poll_retry_interval", 2)
-        conf.set("service:worker", "poll_max_retries", 2)
-        conf.set("service:worker", "poll_delay", 2)
-
-        conf.set("producer_task:worker_periodic_recovery", "interval", 30)
+        environments.configure_designate_conf_defaults(self.designate_conf)
+        if self.dataset:
+            conf = IniFile(self.designate_conf)
+            conf.set("DEFAULT", "quota_zones", 1000000)
 
     def init_tmp_dir(self):
         """There are some docker env config files we'll create dynamically.
         This is a temporary directory to hold all files created by the tests.
         """
-        # since COPY in a dockerfile doesn't work with absolute paths, we need
-        # to create temp files in a place docker will find them.
-        tempfile.tempdir = os.path.join(self.carina_dir, 'tmp')
-        try:
-            os.mkdir(tempfile.tempdir)
-        except OSError:
-            pass
-        self.tempdir = tempfile.tempdir
+        self.tempdir = environments.init_tmp_dir(self.carina_dir)
 
     def init_designate_conf(self):
         """Create a designate.conf for use by the current test. This will be a
         randomized filename stored at self.designate_conf.
         """
-        filetag = "designate-%s-" % self.random_tag
-        self.designate_conf = utils.new_temp_file(filetag, ".conf")
-        self.addCleanup(utils.cleanup_file, self.designate_conf)
+        self.designate_conf = environments.init_designate_conf(
+            self.carina_dir, self.random_tag,
+        )
+        self.track_temp_file(self.designate_conf)
         self.log.debug("using designate.conf generated at %s",
                        self.designate_conf)
 
-        # initialize designate.conf to some defaults
-        src_path = os.path.join(
-            self.carina_dir, "envs/slappy-bind/designate.conf",
+    def init_poll_schedule(self):
+        """Return the PollSchedule for the waiters"""
+        strategy = cfg.CONF.ruiner.poll_strategy
+        if strategy == 'fixed':
+            return waiters.FixedSchedule(self.interval)
+
+        schedule = waiters.ExponentialSchedule(
+            cfg.CONF.ruiner.poll_initial_interval, self.interval,
         )
-        shutil.copyfile(src_path, self.designate_conf)
+        if strategy == 'hint':
+            schedule = waiters.HintedSchedule.from_designate_conf(
+                self.designate_conf, schedule,
+            )
+        return schedule
+
+    def track_temp_file(self, filename):
+        """Remove the file after the test, unless the file is handed off to a
+        reusable environment"""
+        self.temp_files.append(filename)
+
+    def cleanup_temp_files(self):
+        for filename in self.temp_files:
+            utils.cleanup_file(filename)
+        self.temp_files = []
 
     def show_designate_conf(self):
         self.log.debug("designate.conf is at %r:\n%s", self.designate_conf,
                        open(self.designate_conf, 'r').read())
 
     def init_docker_compose_yaml(self):
-        # the docker compose yaml does not work with absolute paths
-        designate_conf = os.path.relpath(self.designate_conf, self.carina_dir)
-
-        templ = DockerComposeYamlTemplate(self.log, tag=self.random_tag)
-        templ.render(
-            DESIGNATE_GIT_URL=cfg.CONF.ruiner.designate_git_url,
-            DESIGNATE_VERSION=cfg.CONF.ruiner.designate_version,
-            DESIGNATE_CONF=designate_conf,
-            POOLS_YAML='envs/slappy-bind/pools.yml',
-            RUINER_PROJECT=self.project_name,
+        env = environments.generate_environment(
+            self.log, self.carina_dir, self.project_name, self.designate_conf,
+            self.random_tag,
         )
-        self.designate_yaml = templ.output_file
-        self.addCleanup(utils.cleanup_file, self.designate_yaml)
+        for filename in env.temp_files:
+            self.track_temp_file(filename)
+        self.compose_files = env.compose_files
+        self.designate_yaml = env.designate_yaml
+        self.designate_conf_yaml = env.designate_conf_yaml
+        self.designate_image = env.designate_image
+
+    def environment_fingerprint(self):
+        """Return a fingerprint of this test's designate configuration. Tests
+        with the same fingerprint may share a deployed environment."""
+        return environments.fingerprint(self.designate_conf, self.carina_dir)
+
+    def new_environment(self):
+        """Return a reusable Environment for the stack deployed by this test.
+        The environment takes ownership of this test's generated files."""
+        env = environments.Environment(
+            fingerprint=self.environment_fingerprint(),
+            project_name=self.project_name,
+            compose_files=self.compose_files,
+            carina_dir=self.carina_dir,
+            designate_yaml=self.designate_yaml,
+            designate_image=self.designate_image,
+            designate_conf_yaml=self.designate_conf_yaml,
+            temp_files=self.temp_files,
+        )
+        self.temp_files = []
+        return env
+
+    def lease_environment(self):
+        """Return an already deployed environment for this test, or None"""
+        fingerprint = self.environment_fingerprint()
+        env = None
+        if cfg.CONF.ruiner.warm_pool:
+            env = warmpool.lease(warmpool.get_pool_dir(self.carina_dir),
+                                 fingerprint)
+        if env is None and cfg.CONF.ruiner.reuse_environments:
+            env = environments.POOL.lease(fingerprint)
+        return env
+
+    def use_environment(self, env):
+        """Use an already deployed environment for this test"""
+        self.log.info("======== reusing env (%s) ========", env.project_name)
+        self.project_name = env.project_name
+        self.compose_files = env.compose_files
+        self.designate_yaml = env.designate_yaml
+        self.designate_conf_yaml = env.designate_conf_yaml
+        self.designate_image = env.designate_image
+        self.docker_composer = env.docker_composer(self.log)
+
+    def release_environment(self):
+        """Reset the environment and return it to the pool. If the reset
+        fails, tear the environment down instead."""
+        if self.environment.lease_file:
+            # the `ruiner pool` daemon tears it down in the background
+            self.log.info("releasing env (%s) to the pool", self.project_name)
+            warmpool.release(warmpool.get_pool_dir(self.carina_dir),
+                             self.environment)
+            return
+
+        if self.reset_environment():
+            environments.POOL.release(self.environment)
+            return
+
+        self.log.error("failed to reset env (%s). tearing it down",
+                       self.project_name)
+        env, self.environment = self.environment, None
+        self.temp_files.extend(env.temp_files)
+        self.cleanup_environment()
+
+    def reset_environment(self):
+        """Prepare the environment for another test: restart any stopped
+        containers, remove all zones from the nameservers, and empty the
+        designate tables. Return True on success.
+        """
+        self.log.info("======== resetting env (%s) ========",
+                      self.project_name)
+        try:
+            self.clear_faults()
+            utils.require_success(self.docker_composer.start())
+
+            # restarted containers likely have new ports
+            self.services = self.discover_services()
+            self.wait_for_services()
+
+            zone_names = self.query_designate_db("SELECT name FROM zones")
+            for service_name in ('bind-1', 'bind-2'):
+                self.purge_nameserver(service_name, zone_names)
+
+            tables = self.query_designate_db(
+                "SELECT table_name FROM information_schema.tables "
+                "WHERE table_schema = DATABASE()")
+            tables = [t for t in self.reset_tables if t in tables]
+            self.query_designate_db(
+                "SET FOREIGN_KEY_CHECKS=0; %s SET FOREIGN_KEY_CHECKS=1;"
+                % " ".join("TRUNCATE TABLE %s;" % t for t in tables))
+        except Exception:
+            self.log.exception("failed to reset env (%s)", self.project_name)
+            return False
+        return True
+
+    def query_designate_db(self, sql):
+        """Run the sql against designate's database, in the mysql container.
+        Return the output as a list of values"""
+        cmd, database = datasets.mysql_args(self.designate_conf)
+        cmd.extend(["-N", "-B", database, "-e", sql])
+
+        out, _, ret = self.docker_composer.exec_('mysql', cmd)
+        utils.require_success((out, _, ret))
+        return out.split()
+
+    def load_dataset(self, name):
+        """Load the dataset into designate's database, generating it first
+        if there is no saved dump for this designate version"""
+        self.log.info("======== loading dataset %s ========", name)
+        cache = datasets.DatasetCache(
+            self.log, datasets.snapshot_dir(self.carina_dir))
+        restored = cache.ensure(
+            name, self.docker_composer, self.designate_conf, self.api,
+            cfg.CONF.ruiner.dataset_timeout,
+        )
+        self.log.info("dataset %s was %s", name,
+                      "restored" if restored else "generated")
+
+    def purge_nameserver(self, service_name, zone_names):
+        """Delete the zones from the nameserver"""
+        if not zone_names:
+            return
+        self.log.info("purging %s zones from %s", len(zone_names),
+                      service_name)
+        script = 'for z in "$@"; do rndc delzone "$z" || true; done'
+        names = [name.rstrip('.') for name in zone_names]
+        utils.require_success(self.docker_composer.exec_(
+            service_name, ["sh", "-c", script, "sh"] + names,
+        ))
 
     def discover_services(self):
         """Discover docker service locations (url, host:port) and return a dict
         mapping the docker service name to the location"""
         self.log.info("======== discover service locations ========")
-        services = {
-            'api': self.discover_api(),
-            'bind-1': self.discover_nameserver('bind-1'),
-            'bind-2': self.discover_nameserver('bind-2'),
-        }
-        self.api = designate.API(services['api'])
+        services = environments.discover_services(self.docker_composer,
+                                                  self.log)
+        if getattr(self, 'api', None) is not None:
+            self.api.close()
+        self.api = designate.API(
+            services['api'],
+            pool_size=cfg.CONF.ruiner.api_pool_size,
+            retry_policy=designate.RetryPolicy(
+                deadline=cfg.CONF.ruiner.api_retry_deadline,
+                hedge_after=cfg.CONF.ruiner.api_hedge_after,
+            ),
+        )
         return services
 
     def discover_api(self, service_name='api', port=9001):
-        url = "http://%s" % self.docker_composer.get_host(service_name, port)
+        url = "http://%s" % self.docker_composer.topology().host(
+            service_name, port)
         self.log.info("%s:%s -> %s", service_name, port, url)
         return url
 
     def discover_nameserver(self, service_name, port=53, protocol='udp'):
-        location = self.docker_composer.get_host(service_name, port, protocol)
+        location = self.docker_composer.topology().host(
+            service_name, port, protocol)
         self.log.info("%s:%s/%s -> %s", service_name, port, protocol, location)
         return location
 
+    def readiness_probes(self):
+        """Return a dict mapping service names to readiness probes"""
+        return readiness.service_probes(self.services)
+
+    def wait_for_services(self, service_names=None):
+        """Wait for the services to be ready. Fail the test if a service is
+        not ready within the service_startup_timeout.
+
+        :param service_names: the services to wait for. If None, wait for all
+            services with a readiness probe.
+        """
+        if not cfg.CONF.ruiner.readiness_probes:
+            sleep_time = cfg.CONF.ruiner.service_startup_wait_time
+            self.log.info("waiting %s seconds for services to start up",
+                          sleep_time)
+            time.sleep(sleep_time)
+            return
+
+        probes = self.readiness_probes()
+        if service_names is not None:
+            probes = dict((name, probes[name]) for name in service_names)
+
+        timeout = cfg.CONF.ruiner.service_startup_timeout
+        self.log.info("waiting up to %s seconds for %s to be ready", timeout,
+                      ", ".join(sorted(probes)))
+        _, waiting = readiness.wait_until_ready(probes, timeout, self.log)
+        if waiting:
+            self.fail("services not ready after %ss: %s"
+                      % (timeout, ", ".join(sorted(waiting))))
+
     def deploy_environment(self):
         self.log.info("======== deploying env (%s) ========",
                       self.project_name)
-        out, _, ret = self.docker_composer.build()
-        self.log.debug("stdout:\n%s", out)
-        self.assertEqual(ret, 0)
+        self.build_images()
 
         out, _, ret = self.docker_composer.up()
         self.log.debug("stdout:\n%s", out)
         self.assertEqual(ret, 0)
 
-        sleep_time = cfg.CONF.ruiner.service_startup_wait_time
-        self.log.info("waiting %s seconds for services to start up",
-                      sleep_time)
-        time.sleep(sleep_time)
+    def build_images(self):
+        result = environments.build_images(
+            self.docker_composer, self.designate_image, self.tempdir, self.log,
+        )
+        if result is None:
+            return
+
+        out, _, ret = result
+        self.log.debug("stdout:\n%s", out)
+        self.assertEqual(ret, 0)
 
     def cleanup_environment(self):
         self.log.info("======== cleaning up env (%s) ========",
                       self.project_name)
-        _, _, ret = self.docker_composer.down()
+        if cfg.CONF.ruiner.background_teardown:
+            # the reaper removes the generated files after `down`, since
+            # docker-compose needs the yaml
+            env = self.new_environment()
+            self.temp_files = []
+            self.log.info("handing env (%s) to the reaper", self.project_name)
+            reaper.REAPER.submit(env.project_name, env.destroy, reaper.LOG)
+            return
+
+        _, _, ret = self.docker_composer.down(
+            timeout=cfg.CONF.ruiner.stop_timeout)
         if ret != 0:
             self.log.error("FAILED TO CLEANUP ENV (project=%s)",
                            self.project_name)
@@ -239,31 +476,191 @@ class BaseDesignateTest(BaseTest):
         self.log.debug(utils.resp_to_string(resp))
         assert resp.ok
 
-        # these queries raise exceptions on timeouts
-        for service_name in ('bind-1', 'bind-2'):
-            self.log.info("checking %s by digging it", service_name)
-            resp = utils.dig("poo.com.", self.services[service_name], "ANY")
-            self.log.debug("\n%s", resp)
+        service_names = ('bind-1', 'bind-2')
+        self.log.info("checking %s by digging them", ", ".join(service_names))
+        queries = dnsprobe.dig_many(
+            ["poo.com."], [self.services[s] for s in service_names],
+        )
+        for service_name, query in zip(service_names, queries):
+            self.log.debug("%s: %s\n%s", service_name, query, query.response)
+            if query.error is not None:
+                raise query.error
 
         self.log.info("all prechecks have passed!")
 
+    def start_serial_watcher(self):
+        """Start watching soa serials on the nameservers. Zones are only
+        sampled once they are watched. See watch_zone()"""
+        watcher = serials.SerialWatcher(
+            dict((name, self.services[name]) for name in ('bind-1', 'bind-2')),
+            interval=cfg.CONF.ruiner.serial_watch_interval,
+            logger=self.log,
+        )
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        return watcher
+
+    def start_container_events(self):
+        """Start listening to the docker events of the project's containers.
+        See ruiner.common.events"""
+        listener = events.ContainerEvents(self.docker_composer.events,
+                                          logger=self.log)
+        listener.start()
+        self.addCleanup(listener.stop)
+        return listener
+
+    def wait_for_container_event(self, service_name, actions, cursor):
+        """Wait for the container's event, recorded after the cursor taken
+        before the request (see ContainerEvents.cursor). Return the time the
+        event was seen, by this host's clock. Fail the test if it doesn't
+        happen within container_event_timeout."""
+        timeout = cfg.CONF.ruiner.container_event_timeout
+        event = self.container_events.wait_for(service_name, actions, timeout,
+                                               cursor=cursor)
+        if event is None:
+            self.fail("no %s event for container %s after %ss"
+                      % (actions, service_name, timeout))
+        seen = time.time()
+        self.log.info("container %s: %s at %.6f (docker time)", service_name,
+                      event.action, event.timestamp)
+        return seen
+
     def kill_nameserver(self, service_name='bind-2'):
-        """Stop a nameserver, causing new operations to go to error"""
+        """Stop a nameserver, causing new operations to go to error. Return
+        when the container died."""
+        cursor = self.container_events.cursor()
         self.docker_composer.kill(service_name)
-        if not self.nameserver_is_down(service_name):
-            self.log.debug("failed to kill container %s", service_name)
+        return self.wait_for_container_event(service_name, 'die', cursor)
 
     def restart_nameserver(self, service_name='bind-2'):
+        """Start a killed nameserver, and wait for it to be ready. Return
+        when the container started."""
+        cursor = self.container_events.cursor()
         utils.require_success(self.docker_composer.start(service_name))
+        started = self.wait_for_container_event(service_name, 'start',
+                                                cursor)
 
         # a container (likely) gets a new port when it is restarted
+        self.update_nameserver_location(service_name)
+        self.wait_for_services([service_name])
+        return started
+
+    def update_nameserver_location(self, service_name):
+        """Rediscover the nameserver's ports. Return True if they changed"""
         location = self.discover_nameserver(service_name)
+        tcp_location = self.discover_nameserver(service_name, protocol='tcp')
+        if (self.services[service_name] == location and
+                self.services[service_name + '/tcp'] == tcp_location):
+            return False
         self.services[service_name] = location
+        self.services[service_name + '/tcp'] = tcp_location
+        self.serial_watcher.set_nameserver(service_name, location)
+        if service_name in self.proxies:
+            self.proxies[service_name][0].set_upstream(location, tcp_location)
+        return True
+
+    def pause_nameserver(self, service_name='bind-2'):
+        """Freeze a nameserver, so it stops answering. Unlike a kill, it keeps
+        its ports and state, so unpause_nameserver recovers it immediately.
+        Return when the container was paused."""
+        cursor = self.container_events.cursor()
+        utils.require_success(self.docker_composer.pause(service_name))
+        self.paused.add(service_name)
+        return self.wait_for_container_event(service_name, 'pause', cursor)
+
+    def unpause_nameserver(self, service_name='bind-2'):
+        """Resume a paused nameserver. Return when it was unpaused."""
+        cursor = self.container_events.cursor()
+        utils.require_success(self.docker_composer.unpause(service_name))
+        self.paused.discard(service_name)
+        return self.wait_for_container_event(service_name, 'unpause', cursor)
+
+    def partition_nameserver(self, service_name='bind-2'):
+        """Disconnect a nameserver from its networks, so designate can't
+        reach it. Its processes keep running. Return the time it was cut off.
+        """
+        networks = self.docker_composer.networks(service_name)
+        for network in networks:
+            utils.require_success(
+                self.docker_composer.disconnect(service_name, network))
+        self.partitioned[service_name] = networks
+        return time.time()
+
+    def heal_nameserver(self, service_name='bind-2'):
+        """Reconnect a partitioned nameserver to its networks. Return the time
+        it was reconnected."""
+        for network in self.partitioned.pop(service_name):
+            utils.require_success(
+                self.docker_composer.connect(service_name, network))
+        healed = time.time()
+
+        # the ports are normally kept, but check since it's one lookup
+        if self.update_nameserver_location(service_name):
+            self.log.info("%s has new ports after reconnecting", service_name)
+        return healed
+
+    def proxy_nameserver(self, service_name='bind-2', seed=None):
+        """Route designate's polls of the nameserver through a FaultProxy on
+        this host. Set faults on the returned proxy at any time, e.g.
+        `proxy.set_faults(loss=0.5)`.
+
+        The proxy listens on all interfaces, and designate reaches it at the
+        gateway of the nameserver's network. So this needs the docker daemon
+        to be local.
+
+        Only designate's queries to the nameserver go through the proxy. The
+        nameserver's zone transfers from mdns, and the notifies sent to it,
+        don't, so faults (e.g. `rate`) don't slow down transfers.
+        """
+        proxy = faultproxy.FaultProxy(
+            self.services[service_name], self.services[service_name + '/tcp'],
+            host='0.0.0.0', seed=seed, logger=self.log,
+        )
+        proxy.start()
+        self.addCleanup(proxy.stop)
+
+        container = self.docker_composer.topology().container(service_name)
+        gateway = self.docker_composer.network_gateway(
+            sorted(container.networks)[0])
+        old = [(service_name, 53)] + [
+            (ip, 53) for ip in container.networks.values()]
+        replaced = environments.repoint_pool_nameservers(
+            self.docker_composer, old, gateway, proxy.port)
+        if not replaced:
+            self.fail("nameserver %s not found in designate's pools"
+                      % service_name)
+        self.log.info("designate polls %s through the proxy at %s:%s",
+                      service_name, gateway, proxy.port)
+        self.proxies[service_name] = (proxy, replaced,
+                                      (gateway, proxy.port))
+        self.restart_service('worker')
+        return proxy
+
+    def unproxy_nameserver(self, service_name='bind-2'):
+        """Point designate back at the nameserver, and stop its proxy"""
+        proxy, replaced, address = self.proxies.pop(service_name)
+        environments.restore_pool_nameservers(
+            self.docker_composer, replaced, address)
+        self.restart_service('worker')
+        self.log.info("proxy for %s stats: %s", service_name, proxy.stats())
+        proxy.stop()
+
+    def restart_service(self, service_name):
+        """Kill and start a service without published ports (e.g. to reload
+        its config). Return when the container started."""
+        cursor = self.container_events.cursor()
+        self.docker_composer.kill(service_name)
+        utils.require_success(self.docker_composer.start(service_name))
+        return self.wait_for_container_event(service_name, 'start', cursor)
 
-        sleep_time = cfg.CONF.ruiner.service_startup_wait_time
-        self.log.info("waiting %s seconds for %s to start up", sleep_time,
-                      service_name)
-        time.sleep(sleep_time)
+    def clear_faults(self):
+        """Unpause, reconnect and unproxy any faulted nameservers"""
+        for service_name in sorted(self.paused):
+            self.unpause_nameserver(service_name)
+        for service_name in sorted(self.partitioned):
+            self.heal_nameserver(service_name)
+        for service_name in sorted(self.proxies):
+            self.unproxy_nameserver(service_name)
 
     def nameserver_is_down(self, service_name='bind-2'):
         """Return True if the nameserver does not respond to queries"""
@@ -277,6 +674,18 @@ class BaseDesignateTest(BaseTest):
             return True
         return False
 
+    def collect_artifacts(self):
+        """Capture the docker logs and archive the configs, concurrently"""
+        pool = ThreadPool(2)
+        try:
+            results = [pool.apply_async(func) for func in
+                       (self.show_docker_logs, self.store_configs)]
+            for result in results:
+                result.get()
+        finally:
+            pool.close()
+            pool.join()
+
     def show_docker_logs(self):
         out, err, ret = self.docker_composer.logs()
 
@@ -298,6 +707,9 @@ class BaseDesignateTest(BaseTest):
                         os.path.join(self.log_dir, 'designate.conf'))
         shutil.copyfile(self.designate_yaml,
                         os.path.join(self.log_dir, 'designate.yaml'))
+        if self.designate_conf_yaml:
+            shutil.copyfile(self.designate_conf_yaml,
+                            os.path.join(self.log_dir, 'designate-conf.yaml'))
 
     def get_zone(self, name, zid):
         """Fetch the zone. Return the response. self.fail() on status >= 500"""
@@ -317,6 +729,23 @@ class BaseDesignateTest(BaseTest):
             self.fail("failed to create zone (status=%s)" % resp.status_code)
         return resp.json()["name"], resp.json()["id"]
 
+    def create_zones(self, n, rate=None):
+        """Create n zones concurrently. Return a list of (name, zone_id), or
+        self.fail() if any create fails"""
+        self.log.info("creating %s zones", n)
+        run = self.api.create_zones(n, rate=rate)
+        zones = []
+        for result in run:
+            if result.status != 202:
+                if result.resp is not None:
+                    self.log.debug(utils.resp_to_string(result.resp))
+                self.fail("failed to create zone (status=%s, error=%s)"
+                          % (result.status, result.error))
+            zones.append((result.resp.json()["name"],
+                          result.resp.json()["id"]))
+        self.log.info("created %s zones: %s", n, run.summary.as_dict())
+        return zones
+
     def delete_zone(self, name, zid):
         """Delete a zone. Calls self.fail() if the delete fails"""
         self.log.info("deleting zone %s", name)
@@ -337,68 +766,100 @@ class BaseDesignateTest(BaseTest):
         return resp.json()['name'], resp.json()['id']
 
     def wait_for_zone_to_error(self, name, zid):
-        """Wait for the given zone to go to ERROR. Fail the test if we fail to
-        timeout before seeing an ERROR status.
+        """Wait for the given zone to go to ERROR. Fail the test if the zone
+        goes ACTIVE instead, or if we timeout before seeing an ERROR status.
         """
         self.log.info("waiting for zone %s to go to ERROR...", name)
-        resp = waiters.wait_for_status(
-            lambda: self.api.get_zone(zid), ["ERROR", "ACTIVE"], self.interval,
-            self.timeout,
+        result = waiters.wait_for_status(
+            lambda: self.api.get_zone(zid), ["ERROR"], self.poll_schedule,
+            self.timeout, failure_statuses=["ACTIVE"],
         )
-
-        if resp.ok and resp.json()['status'] == 'ERROR':
-            self.log.info("...done waiting for zone %s (status = ERROR)", name)
-        else:
-            self.log.error("...done waiting for zone %s (status != ERROR)",
-                           name)
-
-        self.log.debug(utils.resp_to_string(resp))
+        self.log_wait_result("zone %s" % name, result)
+        self.log.debug(utils.resp_to_string(result.resp))
         self.assertEqual(
-            resp.json().get("status"), "ERROR",
-            "zone %s failed to go to ERROR (timeout=%s)" % (name, self.timeout)
+            result.state, "ERROR",
+            "zone %s failed to go to ERROR (%s after %.1fs: %s)" % (
+                name, result.outcome, result.elapsed, result.trace()),
         )
 
-    def wait_for_zone_to_active(self, name, zid):
+    def wait_for_zone_to_active(self, name, zid, failure_statuses=("ERROR",),
+                                timeout=None):
         """Wait for the given zone to go to ACTIVE. Fail the test if we timeout
         before seeing an ACTIVE status.
+
+        :param failure_statuses: fail immediately if the zone has one of these
+            statuses. When waiting for a zone to recover from ERROR, pass an
+            empty list.
+        :param timeout: defaults to the configured timeout
+        :return: the WaitResult
         """
         self.log.info("waiting for zone %s to go to ACTIVE...", name)
-        resp = waiters.wait_for_status(
-            lambda: self.api.get_zone(zid), ["ACTIVE"], self.interval,
-            self.timeout
+        result = waiters.wait_for_status(
+            lambda: self.api.get_zone(zid), ["ACTIVE"], self.poll_schedule,
+            timeout or self.timeout, failure_statuses=failure_statuses,
+        )
+        self.log_wait_result("zone %s" % name, result)
+        self.log.debug(utils.resp_to_string(result.resp))
+        self.assertEqual(
+            result.state, "ACTIVE",
+            "zone %s failed to go ACTIVE (%s after %.1fs: %s)" % (
+                name, result.outcome, result.elapsed, result.trace()),
         )
+        return result
 
-        if resp.ok and resp.json()['status'] == 'ACTIVE':
-            self.log.info("...done waiting for zone %s (status = ACTIVE)",
-                          name)
-        else:
-            self.log.error("...done waiting for zone %s (status != ACTIVE)",
-                           name)
+    def wait_for_zones_to_active(self, zones, failure_statuses=("ERROR",)):
+        """Wait for all the zones to go to ACTIVE, polling a single listing of
+        zones. Fail the test if any zone fails to go ACTIVE.
 
-        self.log.debug(utils.resp_to_string(resp))
-        self.assertEqual(
-            resp.json().get("status"), "ACTIVE",
-            "zone %s failed to go ACTIVE (timeout=%s)" % (name, self.timeout)
+        :param zones: a list of (name, zone_id)
+        :return: a dict mapping zone ids to the seconds until ACTIVE
+        """
+        self.log.info("waiting for %s zones to go to ACTIVE...", len(zones))
+        names = dict((zid, name) for name, zid in zones)
+        results = waiters.wait_for_zones_status(
+            self.list_all_zones, names.keys(), ["ACTIVE"], self.poll_schedule,
+            self.timeout, failure_statuses=failure_statuses,
         )
 
-    def wait_for_zone_to_404(self, name, zid):
+        failed = []
+        for zid, result in sorted(results.items(), key=lambda x: names[x[0]]):
+            self.log_wait_result("zone %s" % names[zid], result)
+            if not result.succeeded:
+                failed.append("%s (%s: %s)" % (names[zid], result.outcome,
+                                               result.trace()))
+        self.assertEqual(failed, [], "zones failed to go ACTIVE: %s"
+                         % ", ".join(failed))
+        return dict((zid, r.elapsed) for zid, r in results.items())
+
+    def list_all_zones(self, params=None):
+        """Return a list of every zone, from all pages. Return None if any
+        page fails."""
+        try:
+            return list(self.api.iter_zones(page_size=1000, params=params))
+        except designate.ListFailed as e:
+            self.log.warning("failed to list zones")
+            self.log.debug(utils.resp_to_string(e.resp))
+            return None
+
+    def wait_for_zone_to_404(self, name, zid, failure_statuses=("ERROR",)):
         """Wait for the given zone to return a 404. Fail the test if we timeout
         before seeing a 404 status code.
+
+        :param failure_statuses: fail immediately if the zone has one of these
+            statuses. When waiting for a zone to recover from ERROR, pass an
+            empty list.
         """
         self.log.info("waiting for zone %s to 404...", name)
-        resp = waiters.wait_for_404(
-            lambda: self.api.get_zone(zid), self.interval, self.timeout,
+        result = waiters.wait_for_404(
+            lambda: self.api.get_zone(zid), self.poll_schedule, self.timeout,
+            failure_statuses=failure_statuses,
         )
-
-        if resp.status_code == 404:
-            self.log.info("...done waiting for zone %s (status = 404)", name)
-        else:
-            self.log.error("...done waiting for zone %s (status != 404)", name)
-
-        self.log.debug(utils.resp_to_string(resp))
+        self.log_wait_result("zone %s" % name, result)
+        self.log.debug(utils.resp_to_string(result.resp))
         self.assertEqual(
-            resp.status_code, 404,
-            "zone %s failed to 404 (timeout=%s)" % (name, self.timeout)
+            result.state, 404,
+            "zone %s failed to 404 (%s after %.1fs: %s)" % (
+                name, result.outcome, result.elapsed, result.trace()),
         )
 
     def wait_for_name_on_nameserver(self, name, service_name):
@@ -407,22 +868,15 @@ class BaseDesignateTest(BaseTest):
                       service_name)
 
         host = self.services[service_name]
-        resp = waiters.wait_for_name_on_nameserver(
-            name, host, self.interval, self.timeout,
+        result = waiters.wait_for_name_on_nameserver(
+            name, host, self.poll_schedule, self.timeout,
         )
-
-        if bool(resp.answer):
-            self.log.info("...done waiting for %s on nameserver %s (found)",
-                          name, service_name)
-        else:
-            self.log.error(
-                "...done waiting for %s on nameserver %s (not found)",
-                name, service_name,
-            )
-        self.log.debug("\n%s", resp)
+        self.log_wait_result("%s on nameserver %s" % (name, service_name),
+                             result)
+        self.log.debug("\n%s", result.resp)
 
         self.assertTrue(
-            bool(resp.answer),
+            result.succeeded,
             "zone %s never showed up on nameserver %s (timeout=%s)" % (
                 name, service_name, self.timeout
             ),
@@ -433,25 +887,137 @@ class BaseDesignateTest(BaseTest):
                       service_name)
 
         host = self.services[service_name]
-        resp = waiters.wait_for_name_removed_from_nameserver(
-            name, host, self.interval, self.timeout,
+        result = waiters.wait_for_name_removed_from_nameserver(
+            name, host, self.poll_schedule, self.timeout,
         )
+        self.log_wait_result("%s on nameserver %s" % (name, service_name),
+                             result)
+        self.log.debug("\n%s", result.resp)
 
-        if not bool(resp.answer):
-            self.log.info(
-                "...done waiting for %s to be removed from nameserver %s",
-                name, service_name,
-            )
-        else:
-            self.log.error(
-                "...done waiting for %s to be removed from nameserver %s"
-                " (not removed)", name, service_name,
-            )
-
-        self.log.debug("\n%s", resp)
-        self.assertFalse(
-            bool(resp.answer),
+        self.assertTrue(
+            result.succeeded,
             "zone %s never removed from nameserver %s (timeout=%s)" % (
                 name, service_name, self.timeout,
             ),
         )
+
+    def wait_for_names_on_nameservers(self, names, service_names=None,
+                                      present=True):
+        """Wait for every name to go live on (or, if not present, be removed
+        from) every nameserver. The nameservers are queried concurrently.
+        Fail the test if any name is not live on any nameserver.
+        """
+        service_names = service_names or ['bind-1', 'bind-2']
+        self.log.info("waiting for %s names on nameservers %s (present=%s)",
+                      len(names), ", ".join(service_names), present)
+        locations = dict((self.services[s], s) for s in service_names)
+        results = waiters.wait_for_names_on_nameservers(
+            names, locations.keys(), self.poll_schedule, self.timeout,
+            present=present,
+        )
+
+        failed = []
+        for (name, ns), result in sorted(results.items()):
+            if not result.succeeded:
+                self.log_wait_result("%s on nameserver %s" % (
+                    name, locations[ns]), result)
+                failed.append("%s on %s" % (name, locations[ns]))
+        self.log.info("...done waiting for %s names (%s failed)",
+                      len(names), len(failed))
+        self.assertEqual(failed, [], "names failed to %s: %s" % (
+            "go live" if present else "be removed", ", ".join(failed)))
+
+    def watch_zone(self, name):
+        """Start sampling the zone's soa serial on the nameservers"""
+        self.serial_watcher.watch(name)
+
+    def wait_for_zone_on_nameservers(self, name, since, service_names=None,
+                                     min_serial=None):
+        """Wait for the zone to show up on the nameservers. The zone must be
+        watched (see watch_zone). Fail the test on timeout.
+
+        :param since: the time of the change, e.g. just before the zone was
+            created. Only serials observed after this time count.
+        :return: a dict mapping nameserver names to the propagation latency
+        """
+        return self._wait_for_serials(
+            name, since, service_names, "show up on",
+            lambda ns, timeout: self.serial_watcher.wait_for_present(
+                name, ns, timeout, since=since, min_serial=min_serial),
+        )
+
+    def wait_for_zone_removed_from_nameservers(self, name, since,
+                                               service_names=None):
+        """Wait for the zone to be removed from the nameservers. The zone
+        must be watched (see watch_zone). Fail the test on timeout.
+
+        :return: a dict mapping nameserver names to the propagation latency
+        """
+        return self._wait_for_serials(
+            name, since, service_names, "be removed from",
+            lambda ns, timeout: self.serial_watcher.wait_for_gone(
+                name, ns, timeout, since=since),
+        )
+
+    def _wait_for_serials(self, name, since, service_names, what, wait):
+        service_names = service_names or ['bind-1', 'bind-2']
+        end = since + self.timeout
+        latencies = {}
+        for service_name in service_names:
+            self.log.info("waiting for zone %s to %s nameserver %s", name,
+                          what, service_name)
+            event = wait(service_name, max(0, end - time.time()))
+            if event is None:
+                self.fail("zone %s failed to %s nameserver %s (timeout=%s)"
+                          % (name, what, service_name, self.timeout))
+            latencies[service_name] = event.timestamp - since
+            self.log.info("...zone %s did %s nameserver %s after %.2fs "
+                          "(serial=%s)", name, what, service_name,
+                          latencies[service_name], event.serial)
+        return latencies
+
+    def list_all_recordsets(self, zid):
+        """Return a list of every recordset in the zone, from all pages"""
+        try:
+            return list(self.api.iter_recordsets(zid, page_size=1000))
+        except designate.ListFailed as e:
+            self.log.debug(utils.resp_to_string(e.resp))
+            self.fail("failed to list recordsets (status=%s)"
+                      % e.resp.status_code)
+
+    def verify_zone_contents(self, name, zid, service_names=None,
+                             ignore_types=()):
+        """Transfer the zone from each nameserver (and mdns), and check it
+        matches the recordsets in the api. Fail the test on any difference.
+        """
+        service_names = service_names or environments.NAMESERVERS + ['mdns']
+        nameservers = dict(
+            (s, self.services.get(s + '/tcp', self.services[s]))
+            for s in service_names
+        )
+        zone = self.get_zone(name, zid).json()
+        expected = axfr.rrsets_from_api(self.list_all_recordsets(zid),
+                                        zone['ttl'])
+
+        self.log.info("verifying %s rrsets in zone %s on %s", len(expected),
+                      name, ", ".join(sorted(nameservers)))
+        diffs = axfr.verify_zone(name, expected, nameservers,
+                                 ignore_types=ignore_types)
+        failed = []
+        for service_name, diff in sorted(diffs.items()):
+            self.log.info("zone %s on %s: %s", name, service_name, diff)
+            if not diff.ok:
+                failed.append("%s (%s)" % (service_name, diff))
+        self.assertEqual(failed, [], "zone %s differs on nameservers: %s"
+                         % (name, ", ".join(failed)))
+
+    def log_wait_result(self, what, result):
+        """Log the outcome of a waiter"""
+        msg = "...done waiting for %s (%s: %s after %s polls in %.2fs)"
+        args = (what, result.outcome, result.state, result.polls,
+                result.elapsed)
+        if result.succeeded:
+            self.log.info(msg, *args)
+        else:
+            self.log.error(msg, *args)
+        self.log.debug("state transitions: %s", result.trace())
@@ -0,0 +1,39 @@
+"""py.test hooks that report the environments the reaper failed to tear down
+in the summary at the end of the session.
+
+With py.test-xdist, each worker process has its own reaper. A worker waits
+for its teardowns when its session finishes, and sends the failures to the
+master process, which reports them.
+"""
+import pytest
+
+from ruiner.common import reaper
+
+# (project name, error) of the failed teardowns, in the reporting process
+FAILURES = []
+
+
+def pytest_sessionfinish(session, exitstatus):
+    failures = [(name, str(error) if error is not None else None)
+                for name, error in reaper.REAPER.report()]
+    output = getattr(session.config, 'slaveoutput', None)
+    if output is not None:
+        output['reaper_failures'] = failures
+    else:
+        FAILURES.extend(failures)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    output = getattr(node, 'slaveoutput', None) or {}
+    FAILURES.extend(output.get('reaper_failures', []))
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not FAILURES:
+        return
+    terminalreporter.section("environments not torn down", red=True)
+    for name, error in sorted(FAILURES):
+        terminalreporter.write_line("FAILED TO CLEANUP ENV (project=%s)%s" % (
+            name, ": %s" % error if error is not None else ""))
+    terminalreporter.write_line("try `ruiner cleanup`")
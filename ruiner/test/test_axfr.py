@@ -0,0 +1,66 @@
+import dns.zone
+
+from ruiner.common import axfr
+from ruiner.test import base
+
+ZONE = """
+@ 3600 IN SOA ns1.poo.com. admin.poo.com. 5 3600 600 86400 3600
+@ 3600 IN NS ns1.poo.com.
+www 300 IN A 10.0.0.1
+www 300 IN A 10.0.0.2
+mail 3600 IN MX 10 mx.poo.com.
+stale 300 IN A 10.0.0.9
+"""
+
+
+class TestAxfr(base.BaseTest):
+
+    def setUp(self):
+        super(TestAxfr, self).setUp()
+        self.zone = dns.zone.from_text(ZONE, origin='poo.com.',
+                                       relativize=False)
+        self.recordsets = [
+            {'name': 'poo.com.', 'type': 'SOA', 'ttl': None,
+             'records': ['ns1.poo.com. admin.poo.com. 5 3600 600 86400 3600']},
+            {'name': 'poo.com.', 'type': 'NS', 'ttl': None,
+             'records': ['ns1.poo.com.']},
+            {'name': 'WWW.poo.com.', 'type': 'A', 'ttl': 300,
+             'records': ['10.0.0.2', '10.0.0.1']},
+            {'name': 'mail.poo.com.', 'type': 'MX', 'ttl': None,
+             'records': ['10  mx.poo.com.']},
+        ]
+
+    def test_rrsets_match(self):
+        actual = axfr.rrsets_from_zone(self.zone)
+        expected = axfr.rrsets_from_api(self.recordsets, 3600)
+        self.assertEqual(actual[('www.poo.com.', 'A')],
+                         (300, frozenset(['10.0.0.1', '10.0.0.2'])))
+
+        del actual[('stale.poo.com.', 'A')]
+        diff = axfr.ZoneDiff(expected, actual)
+        self.assertTrue(diff.ok)
+        self.assertEqual(str(diff), "ok")
+
+    def test_diff(self):
+        self.recordsets[2]['records'] = ['10.0.0.1']
+        self.recordsets.append({'name': 'new.poo.com.', 'type': 'A',
+                                'ttl': 300, 'records': ['10.0.0.3']})
+        expected = axfr.rrsets_from_api(self.recordsets, 3600)
+        diff = axfr.ZoneDiff(expected, axfr.rrsets_from_zone(self.zone))
+
+        self.assertFalse(diff.ok)
+        self.assertEqual(diff.missing, [('new.poo.com.', 'A')])
+        self.assertEqual(diff.extra, [('stale.poo.com.', 'A')])
+        self.assertEqual(diff.mismatched, {
+            ('www.poo.com.', 'A'): (
+                (300, frozenset(['10.0.0.1'])),
+                (300, frozenset(['10.0.0.1', '10.0.0.2'])),
+            ),
+        })
+
+    def test_verify_zone_transfer_fails(self):
+        # nothing listens on port 1
+        diffs = axfr.verify_zone('poo.com.', {}, {'bind-1': '127.0.0.1:1'},
+                                 timeout=1)
+        self.assertFalse(diffs['bind-1'].ok)
+        self.assertIsNotNone(diffs['bind-1'].error)
@@ -0,0 +1,268 @@
+import json
+import os
+import time
+import unittest
+
+import mock
+
+from ruiner.common import metrics
+from ruiner.common import waiters
+from ruiner.common.config import cfg
+from ruiner.common.ini import IniFile
+from ruiner.test import base
+
+
+class BaseBenchmark(base.BaseDesignateTest):
+    """Lifts designate's quotas, and sets up metrics collection. See the
+    [ruiner:benchmark] config section. Benchmarks only run when it sets
+    `enabled = True`."""
+
+    nameservers = ('bind-1', 'bind-2')
+
+    def configure_designate_conf(self):
+        super(BaseBenchmark, self).configure_designate_conf()
+        conf = IniFile(self.designate_conf)
+        conf.set("DEFAULT", "quota_zones", 1000000)
+        conf.set("DEFAULT", "quota_zone_recordsets", 1000000)
+        conf.set("DEFAULT", "quota_zone_records", 1000000)
+
+    def setUp(self):
+        # skip before anything is deployed
+        if not cfg.CONF['ruiner:benchmark'].enabled:
+            self.skipTest("benchmarks are disabled. set [ruiner:benchmark] "
+                          "enabled = True to run them")
+        super(BaseBenchmark, self).setUp()
+        self.conf = cfg.CONF['ruiner:benchmark']
+        self.recorder = metrics.Recorder()
+        self.tracker = metrics.StatusTracker(
+            self.list_all_zones, interval=self.conf.status_interval,
+        )
+        self.tracker.start()
+        self.addCleanup(self.tracker.stop)
+
+    def record_latencies(self, prefix, latencies, recorder=None):
+        """Record a latency for each nameserver"""
+        recorder = recorder or self.recorder
+        for service_name, latency in latencies.items():
+            recorder.add("%s.%s" % (prefix, service_name), latency)
+
+
+class TestZonePropagationBenchmark(BaseBenchmark):
+    """Pushes creates and deletes at designate at a steady rate, and measures
+    how long each change takes to reach the api and the nameservers.
+
+    The latency percentiles and throughput are written to benchmark.json in
+    the test's log dir.
+    """
+
+    def test_zone_propagation(self):
+        zones = self.benchmark_zone_creates()
+        self.benchmark_recordset_creates(zones)
+        self.benchmark_zone_deletes(zones)
+
+        filename = os.path.join(self.log_dir, 'benchmark.json')
+        report = self.recorder.write(filename, config={
+            'rate': self.conf.rate,
+            'duration': self.conf.duration,
+            'workers': self.conf.workers,
+            'recordsets_per_zone': self.conf.recordsets_per_zone,
+        })
+        self.log.info("benchmark results written to %s", filename)
+        for name, summary in sorted(report['latencies'].items()):
+            self.log.info("%s: %s", name, summary)
+
+    def as_zone_list(self, zones):
+        """Return a list of (name, zone_id), from a dict mapping zone ids to
+        (name, start)"""
+        return [(name, zid) for zid, (name, _) in zones.items()]
+
+    def benchmark_zone_creates(self):
+        """Create zones at the configured rate. Return a dict mapping zone
+        ids to (name, time of the create request)"""
+        n = int(self.conf.rate * self.conf.duration)
+        self.log.info("creating %s zones at %s/s", n, self.conf.rate)
+        run = self.api.create_zones(n, workers=self.conf.workers,
+                                    rate=self.conf.rate)
+        created = {}
+        for result in run:
+            self.recorder.add('zone_create.api_latency', result.latency)
+            if result.status != 202:
+                continue
+            name, zid = result.resp.json()['name'], result.resp.json()['id']
+            self.watch_zone(name)
+            self.tracker.track(zid)
+            created[zid] = (name, result.start)
+        self.recorder.add_operation('zone_create', run.summary)
+        self.log.info("zone creates: %s", run.summary.as_dict())
+
+        self.wait_for_zones_to_active(self.as_zone_list(created))
+        self.tracker.sample()
+        for zid, (name, start) in created.items():
+            active = self.tracker.first_seen(zid, 'ACTIVE', since=start)
+            if active is not None:
+                self.recorder.add('zone_create.time_to_active',
+                                  active - start)
+            self.record_latencies(
+                'zone_create.visible',
+                self.wait_for_zone_on_nameservers(name, start,
+                                                  self.nameservers),
+            )
+        return created
+
+    def benchmark_recordset_creates(self, zones):
+        """Create recordsets in each zone at the configured rate. Measure the
+        time from the last create in each zone until the nameservers serve
+        the zone's final serial"""
+        per_zone = self.conf.recordsets_per_zone
+        self.log.info("creating %s recordsets in each of %s zones at %s/s",
+                      per_zone, len(zones), self.conf.rate)
+        run = self.api.create_recordsets(
+            self.as_zone_list(zones), per_zone, workers=self.conf.workers,
+            rate=self.conf.rate,
+        )
+        last_create = {}
+        for result in run:
+            self.recorder.add('recordset_create.api_latency', result.latency)
+            if result.status == 202:
+                _, zid = result.key
+                last_create[zid] = max(result.start, last_create.get(zid, 0))
+        self.recorder.add_operation('recordset_create', run.summary)
+        self.log.info("recordset creates: %s", run.summary.as_dict())
+
+        self.wait_for_zones_to_active(self.as_zone_list(
+            dict((zid, zones[zid]) for zid in last_create)))
+        serials = dict((z['id'], z['serial']) for z in self.list_all_zones())
+        self.tracker.sample()
+        for zid, start in last_create.items():
+            name = zones[zid][0]
+            active = self.tracker.first_seen(zid, 'ACTIVE', since=start)
+            if active is not None:
+                self.recorder.add('recordset_create.time_to_active',
+                                  active - start)
+            self.record_latencies(
+                'recordset_create.visible',
+                self.wait_for_zone_on_nameservers(
+                    name, start, self.nameservers, min_serial=serials[zid]),
+            )
+
+    def benchmark_zone_deletes(self, zones):
+        self.log.info("deleting %s zones at %s/s", len(zones), self.conf.rate)
+        run = self.api.delete_zones(list(zones), workers=self.conf.workers,
+                                    rate=self.conf.rate)
+        deleted = {}
+        for result in run:
+            self.recorder.add('zone_delete.api_latency', result.latency)
+            if result.ok:
+                deleted[result.key] = result.start
+        self.recorder.add_operation('zone_delete', run.summary)
+        self.log.info("zone deletes: %s", run.summary.as_dict())
+
+        missing = metrics.StatusTracker.MISSING
+        results = waiters.wait_for_zones_status(
+            self.list_all_zones, list(deleted), [missing], self.poll_schedule,
+            self.timeout, failure_statuses=['ERROR'],
+        )
+        self.tracker.sample()
+        for zid, start in deleted.items():
+            self.assertTrue(results[zid].succeeded,
+                            "zone %s was not deleted: %s" % (
+                                zid, results[zid].trace()))
+            gone = self.tracker.first_seen(zid, missing, since=start)
+            if gone is not None:
+                self.recorder.add('zone_delete.time_to_404', gone - start)
+            self.record_latencies(
+                'zone_delete.gone',
+                self.wait_for_zone_removed_from_nameservers(
+                    zones[zid][0], start, self.nameservers),
+            )
+
+
+class TestLargeZoneBenchmark(BaseBenchmark):
+    """Measures how long a single recordset change takes to propagate, as the
+    zone grows. Each zone is seeded with large_zone_sizes recordsets, and then
+    large_zone_samples changes are timed one at a time.
+
+    The results for each zone size are written to
+    large-zone-<designate_version>.json in the test's log dir, so the curves
+    for different designate versions can be compared.
+
+    With the default sizes, this seeds over 11,000 recordsets, so it only
+    runs when [ruiner:benchmark] enabled is set, like the other benchmarks.
+    """
+
+    def test_large_zone_propagation(self):
+        version = cfg.CONF.ruiner.designate_version
+        sizes = {}
+        for size in sorted(self.conf.large_zone_sizes):
+            recorder = metrics.Recorder()
+            name, zid = self.seed_zone(size, recorder)
+            for _ in range(self.conf.large_zone_samples):
+                self.time_recordset_change(name, zid, recorder)
+            sizes[str(size)] = recorder.report()
+            self.delete_zone(name, zid)
+
+        filename = os.path.join(
+            self.log_dir, 'large-zone-%s.json' % version.replace('/', '_'))
+        with open(filename, 'w') as f:
+            json.dump({'designate_version': version, 'sizes': sizes}, f,
+                      indent=2, sort_keys=True)
+        self.log.info("benchmark results written to %s", filename)
+        for size, report in sorted(sizes.items(), key=lambda x: int(x[0])):
+            self.log.info("%s recordsets: %s", size, report['latencies'])
+
+    def seed_zone(self, size, recorder):
+        """Create a zone with `size` recordsets. Return (name, zone_id)"""
+        name, zid = self.create_zone()
+        self.wait_for_zone_to_active(name, zid)
+        self.watch_zone(name)
+
+        self.log.info("seeding zone %s with %s recordsets at %s/s", name,
+                      size, self.conf.seed_rate)
+        run = self.api.create_recordsets(
+            [(name, zid)], size, workers=self.conf.workers,
+            rate=self.conf.seed_rate,
+        )
+        run.wait()
+        recorder.add_operation('seed', run.summary)
+        self.log.info("seeded zone %s: %s", name, run.summary.as_dict())
+        self.assertEqual(run.summary.count(202), size,
+                         "failed to seed zone %s" % name)
+
+        self.wait_for_zone_to_active(name, zid,
+                                     timeout=self.conf.seed_timeout)
+        return name, zid
+
+    def time_recordset_change(self, name, zid, recorder):
+        start = time.time()
+        resp = self.api.create_recordset(name, zid)
+        recorder.add('recordset_create.api_latency', time.time() - start)
+        self.assertEqual(resp.status_code, 202)
+
+        wait_start = time.time()
+        result = self.wait_for_zone_to_active(name, zid)
+        # result.elapsed is the time of the poll that saw ACTIVE
+        recorder.add('recordset_create.time_to_active',
+                     wait_start - start + result.elapsed)
+        serial = result.resp.json()['serial']
+        self.record_latencies(
+            'recordset_create.visible',
+            self.wait_for_zone_on_nameservers(name, start, self.nameservers,
+                                              min_serial=serial),
+            recorder=recorder,
+        )
+
+
+class TestBenchmarksAreOptIn(base.BaseTest):
+
+    @mock.patch.object(base.BaseDesignateTest, 'setUp')
+    def test_disabled_benchmarks_deploy_nothing(self, setup):
+        cfg.CONF.set_override('enabled', False, 'ruiner:benchmark')
+        self.addCleanup(cfg.CONF.clear_override, 'enabled',
+                        'ruiner:benchmark')
+        for test in (
+                TestZonePropagationBenchmark('test_zone_propagation'),
+                TestLargeZoneBenchmark('test_large_zone_propagation')):
+            result = unittest.TestResult()
+            test.run(result)
+            self.assertEqual(len(result.skipped), 1, result.errors)
+        self.assertFalse(setup.called)
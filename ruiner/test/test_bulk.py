@@ -0,0 +1,58 @@
+import time
+
+from ruiner.common import bulk
+from ruiner.common import designate
+from ruiner.test import base
+from ruiner.test.test_designate import FakeDesignate
+from ruiner.test.test_designate import scripted_handler
+
+
+class TestBulk(base.BaseTest):
+
+    def test_token_bucket(self):
+        bucket = bulk.TokenBucket(rate=50)
+        start = time.time()
+        for _ in range(11):
+            bucket.acquire()
+        # one token up front, then 10 more at 50/s
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(bulk.percentile(values, 50), 50)
+        self.assertEqual(bulk.percentile(values, 99), 99)
+        self.assertEqual(bulk.percentile(values, 100), 100)
+        self.assertEqual(bulk.percentile([3], 90), 3)
+        self.assertIsNone(bulk.percentile([], 50))
+
+    def test_bulk_run(self):
+        script = [(202, 0)] * 6 + [(413, 0)] * 2 + [(500, 0)]
+        fake = FakeDesignate(scripted_handler(script))
+        self.addCleanup(fake.stop)
+        api = designate.API(
+            fake.endpoint, retry_policy=designate.RetryPolicy(attempts=1),
+        )
+        self.addCleanup(api.close)
+
+        def fail():
+            raise designate.RequestFailed("no response")
+
+        tasks = [(i, api.list_zones) for i in range(9)] + [('x', fail)]
+        run = api.bulk(tasks, workers=3, rate=200)
+        results = list(run)
+
+        self.assertEqual(sorted(r.key for r in results),
+                         sorted(range(9) + ['x']))
+        failed = [r for r in results if r.error is not None]
+        self.assertEqual([r.key for r in failed], ['x'])
+        self.assertIsNone(failed[0].status)
+
+        summary = run.summary.as_dict()
+        self.assertEqual(summary['total'], 10)
+        self.assertEqual(summary['statuses'], {202: 6, 413: 2, 500: 1})
+        self.assertEqual(summary['2xx'], 6)
+        self.assertEqual(summary['413'], 2)
+        self.assertEqual(summary['5xx'], 1)
+        self.assertEqual(summary['errors'], 1)
+        self.assertGreater(summary['throughput'], 0)
+        self.assertIsNotNone(summary['latency']['p99'])
@@ -0,0 +1,249 @@
+import BaseHTTPServer
+import json
+import socket
+import SocketServer
+import threading
+import time
+import urlparse
+
+from ruiner.common import designate
+from ruiner.test import base
+
+
+class FakeDesignateHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # HTTP/1.1, so that connections are kept alive
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(200, {'zones': [], 'links': {}})
+
+    def respond(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def scripted_handler(script, requests=None):
+    """Return a handler that responds to each GET or POST with the next
+    (status, delay) in the script, and then with 200s once the script runs
+    out. The method of each request is appended to `requests`."""
+    lock = threading.Lock()
+
+    class ScriptedHandler(FakeDesignateHandler):
+
+        def do_GET(self):
+            with lock:
+                if requests is not None:
+                    requests.append(self.command)
+                status, delay = script.pop(0) if script else (200, 0)
+            time.sleep(delay)
+            self.respond(status, {'zones': [], 'links': {}})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.do_GET()
+
+    return ScriptedHandler
+
+
+class FixedDelayPolicy(designate.RetryPolicy):
+
+    def delay(self, attempt):
+        return 1
+
+
+class PagedZonesHandler(FakeDesignateHandler):
+    """Lists 5 zones (or recordsets), in pages of `limit` items"""
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(url.query)
+        limit = int(query.get('limit', [2])[0])
+        marker = int(query.get('marker', [-1])[0])
+        key = url.path.rsplit('/', 1)[-1]
+
+        ids = range(marker + 1, min(marker + 1 + limit, 5))
+        links = {}
+        if ids and ids[-1] < 4:
+            links['next'] = "http://%s:%s%s?limit=%s&marker=%s" % (
+                self.server.server_address + (url.path, limit, ids[-1]))
+        self.respond(200, {
+            key: [{'id': str(i), 'status': 'ACTIVE'} for i in ids],
+            'links': links,
+        })
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    pass
+
+
+class FakeDesignate(object):
+    """A local http server to point a designate.Client at"""
+
+    def __init__(self, handler=FakeDesignateHandler):
+        self.server = ThreadedHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.endpoint = "http://127.0.0.1:%s" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestClient(base.BaseTest):
+
+    def setUp(self):
+        super(TestClient, self).setUp()
+        self.fake = FakeDesignate()
+        self.addCleanup(self.fake.stop)
+
+    def test_connections_are_reused(self):
+        api = designate.API(self.fake.endpoint)
+        self.addCleanup(api.close)
+        for _ in range(5):
+            self.assertEqual(api.list_zones().status_code, 200)
+
+        self.assertEqual(api.connection_stats(), {
+            'requests': 5, 'connections': 1, 'reused': 4,
+        })
+
+    def test_pool_is_shared_between_threads(self):
+        api = designate.API(self.fake.endpoint, pool_size=2)
+        self.addCleanup(api.close)
+        statuses = []
+
+        def list_zones():
+            for _ in range(5):
+                statuses.append(api.list_zones().status_code)
+
+        threads = [threading.Thread(target=list_zones) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(statuses, [200] * 20)
+        stats = api.connection_stats()
+        self.assertEqual(stats['requests'], 20)
+        self.assertLessEqual(stats['connections'], 2)
+
+    def test_iter_zones(self):
+        fake = FakeDesignate(PagedZonesHandler)
+        self.addCleanup(fake.stop)
+        api = designate.API(fake.endpoint)
+        self.addCleanup(api.close)
+
+        zones = api.iter_zones(page_size=2)
+        self.assertEqual(next(zones)['id'], '0')
+        # pages are fetched as the zones are consumed
+        self.assertEqual(api.connection_stats()['requests'], 1)
+        self.assertEqual([z['id'] for z in zones], ['1', '2', '3', '4'])
+        self.assertEqual(api.connection_stats()['requests'], 3)
+
+        self.assertEqual(
+            [r['id'] for r in api.iter_recordsets('abc', page_size=3)],
+            ['0', '1', '2', '3', '4'],
+        )
+
+    def test_iter_zones_fails(self):
+        fake = FakeDesignate(scripted_handler([(500, 0)]))
+        self.addCleanup(fake.stop)
+        api = designate.API(fake.endpoint)
+        self.addCleanup(api.close)
+
+        with self.assertRaises(designate.ListFailed) as ctx:
+            list(api.iter_zones())
+        self.assertEqual(ctx.exception.resp.status_code, 500)
+
+
+class TestRetries(base.BaseTest):
+
+    def fake_api(self, script, requests=None, **kwargs):
+        fake = FakeDesignate(scripted_handler(script, requests))
+        self.addCleanup(fake.stop)
+        api = designate.API(fake.endpoint, **kwargs)
+        self.addCleanup(api.close)
+        return api
+
+    def closed_port_endpoint(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return "http://127.0.0.1:%s" % port
+
+    def test_retry_503(self):
+        api = self.fake_api([(503, 0), (503, 0)], retry_policy=(
+            designate.RetryPolicy(attempts=3, backoff=0.001)))
+        self.assertEqual(api.list_zones().status_code, 200)
+        self.assertEqual(api.connection_stats()['requests'], 3)
+
+    def test_return_last_503_when_out_of_attempts(self):
+        api = self.fake_api([(503, 0)] * 3, retry_policy=(
+            designate.RetryPolicy(attempts=2, backoff=0.001)))
+        self.assertEqual(api.list_zones().status_code, 503)
+
+    def test_post_is_not_retried_once_sent(self):
+        requests = []
+        api = self.fake_api([(503, 0)], requests, retry_policy=(
+            designate.RetryPolicy(attempts=3, backoff=0.001)))
+        self.assertEqual(api.create_zone().status_code, 503)
+
+        api = self.fake_api([(200, 1)], requests, timeout=0.2,
+                            retry_policy=designate.RetryPolicy(
+                                attempts=3, backoff=0.001))
+        with self.assertRaises(designate.RequestFailed) as ctx:
+            api.create_zone()
+        self.assertIn("after 1 attempts", str(ctx.exception))
+        self.assertEqual(requests, ['POST', 'POST'])
+
+    def test_post_is_retried_if_never_sent(self):
+        api = designate.API(self.closed_port_endpoint(), retry_policy=(
+            designate.RetryPolicy(attempts=3, backoff=0.001)))
+        self.addCleanup(api.close)
+        with self.assertRaises(designate.RequestFailed) as ctx:
+            api.create_zone()
+        self.assertIn("after 3 attempts", str(ctx.exception))
+
+    def test_no_attempts(self):
+        api = self.fake_api([], retry_policy=designate.RetryPolicy(
+            attempts=0))
+        self.assertRaises(designate.RequestFailed, api.list_zones)
+
+    def test_connection_errors_are_retried(self):
+        api = designate.API(self.closed_port_endpoint(), retry_policy=(
+            designate.RetryPolicy(attempts=3, backoff=0.001)))
+        self.addCleanup(api.close)
+        with self.assertRaises(designate.RequestFailed) as ctx:
+            api.list_zones()
+        self.assertIn("after 3 attempts", str(ctx.exception))
+
+    def test_deadline_stops_retries(self):
+        api = designate.API(self.closed_port_endpoint(), retry_policy=(
+            FixedDelayPolicy(attempts=5, deadline=0.5)))
+        self.addCleanup(api.close)
+
+        start = time.time()
+        with self.assertRaises(designate.RequestFailed) as ctx:
+            api.list_zones()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertIn("after 1 attempts", str(ctx.exception))
+
+    def test_hedged_get(self):
+        api = self.fake_api([(200, 2)], retry_policy=(
+            designate.RetryPolicy(hedge_after=0.05)))
+
+        start = time.time()
+        self.assertEqual(api.list_zones().status_code, 200)
+        self.assertLess(time.time() - start, 1)
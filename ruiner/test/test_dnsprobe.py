@@ -0,0 +1,161 @@
+import socket
+import struct
+import threading
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rrset
+
+from ruiner.common import dnsprobe
+from ruiner.common import utils
+from ruiner.common import waiters
+from ruiner.test import base
+
+
+class FakeNameserver(object):
+    """Answers A queries over udp and tcp on the same port.
+
+    :param drop_first: ignore this many attempts of each query
+    :param silent: names never answered over udp
+    :param truncate: names answered with the TC flag over udp
+    """
+
+    def __init__(self, drop_first=0, silent=(), truncate=()):
+        self.drop_first = drop_first
+        self.silent = set(silent)
+        self.truncate = set(truncate)
+        self.seen = {}
+        self.tcp_queries = []
+
+        self.udp, self.tcp = utils.bind_udp_and_tcp('127.0.0.1')
+        self.port = self.udp.getsockname()[1]
+        self.location = "127.0.0.1:%s" % self.port
+
+        for target in (self.serve_udp, self.serve_tcp):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def answer(self, query):
+        resp = dns.message.make_response(query)
+        name = query.question[0].name
+        resp.answer.append(dns.rrset.from_text(name, 300, 'IN', 'A',
+                                               '10.0.0.1'))
+        return resp
+
+    def serve_udp(self):
+        while True:
+            try:
+                wire, addr = self.udp.recvfrom(65535)
+            except socket.error:
+                return
+            if not wire:
+                return
+            query = dns.message.from_wire(wire)
+            name = query.question[0].name.to_text()
+
+            self.seen[name] = self.seen.get(name, 0) + 1
+            if name in self.silent or self.seen[name] <= self.drop_first:
+                continue
+            if name in self.truncate:
+                resp = dns.message.make_response(query)
+                resp.flags |= dns.flags.TC
+            else:
+                resp = self.answer(query)
+            self.udp.sendto(resp.to_wire(), addr)
+
+    def serve_tcp(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except socket.error:
+                return
+            # tcp messages are prefixed with a two byte length
+            length = struct.unpack('!H', conn.recv(2))[0]
+            query = dns.message.from_wire(conn.recv(length))
+            self.tcp_queries.append(query.question[0].name.to_text())
+            wire = self.answer(query).to_wire()
+            conn.sendall(struct.pack('!H', len(wire)) + wire)
+            conn.close()
+
+    def stop(self):
+        for sock in (self.udp, self.tcp):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+
+class TestProber(base.BaseTest):
+
+    def nameserver(self, **kwargs):
+        ns = FakeNameserver(**kwargs)
+        self.addCleanup(ns.stop)
+        return ns
+
+    def test_many_names_many_nameservers(self):
+        nameservers = [self.nameserver().location for _ in range(3)]
+        names = ["name%s.poo.com." % i for i in range(300)]
+
+        queries = dnsprobe.dig_many(names, nameservers, 'A', timeout=2)
+
+        self.assertEqual(len(queries), 900)
+        for query in queries:
+            self.assertIsNone(query.error)
+            self.assertTrue(query.answered)
+            self.assertEqual(query.response.answer[0].name.to_text(),
+                             query.name)
+        self.assertEqual(
+            sorted(set((q.name, q.nameserver) for q in queries)),
+            sorted((n, ns) for n in names for ns in nameservers),
+        )
+
+    def test_retransmit_and_timeout(self):
+        ns = self.nameserver(drop_first=1, silent=['silent.poo.com.'])
+        prober = dnsprobe.Prober(timeout=0.1, retries=2)
+        ok = prober.add('ok.poo.com.', ns.location, 'A')
+        silent = prober.add('silent.poo.com.', ns.location, 'A')
+        prober.run()
+
+        self.assertTrue(ok.answered)
+        self.assertEqual(ok.attempts, 2)
+        self.assertIsNone(silent.response)
+        self.assertIsInstance(silent.error, dns.exception.Timeout)
+        self.assertEqual(silent.attempts, 3)
+        self.assertEqual(ns.seen['silent.poo.com.'], 3)
+
+    def test_truncated_falls_back_to_tcp(self):
+        ns = self.nameserver(truncate=['big.poo.com.'])
+        prober = dnsprobe.Prober(timeout=1)
+        big = prober.add('big.poo.com.', ns.location, 'A')
+        small = prober.add('small.poo.com.', ns.location, 'A')
+        prober.run()
+
+        self.assertTrue(big.truncated)
+        self.assertTrue(big.answered)
+        self.assertFalse(small.truncated)
+        self.assertTrue(small.answered)
+        self.assertEqual(ns.tcp_queries, ['big.poo.com.'])
+
+
+class TestWaitForNames(base.BaseTest):
+
+    def test_wait_for_names_on_nameservers(self):
+        ns = FakeNameserver(silent=['missing.poo.com.'])
+        self.addCleanup(ns.stop)
+
+        results = waiters.wait_for_names_on_nameservers(
+            ['live.poo.com.', 'missing.poo.com.', 'live.poo.com.'],
+            [ns.location],
+            interval=0.05, timeout=0.3, probe_timeout=0.05,
+        )
+        live = results[('live.poo.com.', ns.location)]
+        missing = results[('missing.poo.com.', ns.location)]
+        self.assertTrue(live.succeeded)
+        self.assertEqual(live.polls, 1)
+        # a duplicate name is only queried once
+        self.assertEqual(ns.seen['live.poo.com.'], 1)
+        self.assertEqual(missing.outcome, waiters.WaitResult.TIMEOUT)
+        self.assertEqual(missing.state, 'no response')
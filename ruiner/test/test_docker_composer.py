@@ -1,7 +1,9 @@
+import json
 import mock
 import os
 
 from ruiner.common.docker import DockerComposer
+from ruiner.common.docker import Topology
 from ruiner.test import base
 
 
@@ -53,3 +55,117 @@ class TestDockerComposer(base.BaseTest):
     def test_get_host_respects_docker_host(self):
         self.dc.port = mock.Mock(return_value=('0.0.0.0:5678', '', 0))
         self.assertEqual(self.dc.get_host('api', 0), '1.2.3.4:5678')
+
+    @mock.patch.dict(os.environ, {}, clear=True)
+    def test_topology(self):
+        inspect = [{
+            'Id': 'abc123',
+            'Name': '/wumbo_bind-1_1',
+            'State': {'Status': 'running'},
+            'Config': {'Labels': {'com.docker.compose.service': 'bind-1'}},
+            'NetworkSettings': {
+                'Ports': {
+                    '53/udp': [{'HostIp': '0.0.0.0', 'HostPort': '32768'}],
+                    '53/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '32769'}],
+                    '953/tcp': None,
+                },
+                'Networks': {'wumbo_default': {'IPAddress': '172.18.0.3'}},
+            },
+        }]
+        outputs = [('abc123\n', '', 0), (json.dumps(inspect), '', 0)]
+        with mock.patch('ruiner.common.utils.run_cmd',
+                        side_effect=lambda cmd: outputs.pop(0)) as run_cmd:
+            topology = self.dc.topology()
+            self.assertIs(self.dc.topology(), topology)
+
+        self.assertEqual(run_cmd.call_count, 2)
+        self.assertEqual(
+            run_cmd.call_args_list[0][0][0][-1],
+            'label=com.docker.compose.project=wumbo',
+        )
+        bind = topology.container('bind-1')
+        self.assertEqual(bind.name, 'wumbo_bind-1_1')
+        self.assertEqual(bind.ip, '172.18.0.3')
+        self.assertEqual(bind.ports, {(53, 'udp'): 32768, (53, 'tcp'): 32769})
+        self.assertEqual(topology.host('bind-1', 53, 'udp'),
+                         '127.0.0.1:32768')
+        self.assertRaises(Exception, topology.host, 'bind-1', 953)
+
+        self.dc._run_cmd = mock.Mock(return_value=('', '', 0))
+        self.dc.kill('bind-1')
+        self.assertIsNone(self.dc._topology)
+
+    def test_topology_prefers_running_containers(self):
+        def info(cid, state, oneoff=False):
+            labels = {'com.docker.compose.service': 'bind-1'}
+            if oneoff:
+                labels['com.docker.compose.oneoff'] = 'True'
+            return {
+                'Id': cid,
+                'Name': '/wumbo_bind-1_%s' % cid,
+                'State': {'Status': state},
+                'Config': {'Labels': labels},
+                'NetworkSettings': {'Ports': {}, 'Networks': {}},
+            }
+
+        topology = Topology.from_inspect([
+            info('old', 'exited'), info('new', 'running'),
+            info('older', 'exited'), info('run', 'running', oneoff=True),
+        ])
+        self.assertEqual(topology.container('bind-1').id, 'new')
+
+    def test_empty_topology(self):
+        topology = Topology([])
+        self.assertIsNone(topology.container('api'))
+        self.assertRaises(Exception, topology.host, 'api', 9001)
+
+    def test_events(self):
+        with mock.patch('subprocess.Popen') as popen:
+            popen.return_value.stdout.readline.side_effect = [
+                '{"Action": "die", "id": "abc123"}\n', '\n', '']
+            stream = self.dc.events(since=1500000000.5)
+            self.assertEqual(list(stream), [{'Action': 'die', 'id': 'abc123'}])
+
+        self.assertEqual(popen.call_args[0][0], [
+            'docker', 'events', '--format', '{{json .}}',
+            '--filter', 'type=container',
+            '--filter', 'label=com.docker.compose.project=wumbo',
+            '--since', '1500000000.500000',
+        ])
+
+    def test_pause(self):
+        self.dc._run_cmd = mock.Mock(return_value=('', '', 0))
+        self.dc.pause('bind-2')
+        self.dc._run_cmd.assert_called_with('docker-compose', 'pause',
+                                            'bind-2')
+        self.dc.unpause('bind-2')
+        self.dc._run_cmd.assert_called_with('docker-compose', 'unpause',
+                                            'bind-2')
+
+    def test_network_partition(self):
+        self.dc.container_id = mock.Mock(return_value='abc123')
+        with mock.patch('ruiner.common.utils.run_cmd',
+                        return_value=('', '', 0)) as run_cmd:
+            self.dc.disconnect('bind-2', 'wumbo_default')
+            run_cmd.assert_called_with(['docker', 'network', 'disconnect',
+                                        'wumbo_default', 'abc123'])
+            self.dc.connect('bind-2', 'wumbo_default')
+            run_cmd.assert_called_with(['docker', 'network', 'connect',
+                                        '--alias', 'bind-2', 'wumbo_default',
+                                        'abc123'])
+
+    def test_copy_without_container(self):
+        self.dc._run_cmd = mock.Mock(return_value=('', '', 0))
+        with mock.patch('ruiner.common.utils.run_cmd') as run_cmd:
+            self.assertRaisesRegexp(Exception, 'no container for api',
+                                    self.dc.copy_to, 'api', 'a.sql', '/tmp')
+            self.assertRaisesRegexp(Exception, 'no container for api',
+                                    self.dc.copy_from, 'api', '/tmp/a', '.')
+            self.assertFalse(run_cmd.called)
+
+    def test_down(self):
+        self.dc._run_cmd = mock.Mock(return_value=('', '', 0))
+        self.dc.down()
+        self.dc._run_cmd.assert_called_with('docker-compose', 'down')
+        self.dc.down(timeout=2)
+        self.dc._run_cmd.assert_called_with('docker-compose', 'down', '-t', 2)
@@ -0,0 +1,446 @@
+import BaseHTTPServer
+import io
+import json
+import os
+import Queue
+import re
+import shutil
+import SocketServer
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import urlparse
+
+from ruiner.common import docker
+from ruiner.common import dockerapi
+from ruiner.common import events
+from ruiner.test import base
+
+
+def mux(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class FakeEngineHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    ROUTES = [
+        ('GET', r'/containers/json$', 'list_containers'),
+        ('GET', r'/containers/(\w+)/json$', 'inspect'),
+        ('POST', r'/containers/(\w+)/start$', 'start'),
+        ('POST', r'/containers/(\w+)/kill$', 'kill'),
+        ('GET', r'/containers/(\w+)/logs$', 'logs'),
+        ('POST', r'/containers/(\w+)/exec$', 'create_exec'),
+        ('POST', r'/exec/(\w+)/start$', 'start_exec'),
+        ('GET', r'/exec/(\w+)/json$', 'inspect_exec'),
+        ('GET', r'/containers/(\w+)/archive$', 'get_archive'),
+        ('PUT', r'/containers/(\w+)/archive$', 'put_archive'),
+        ('GET', r'/events$', 'events'),
+        ('POST', r'/containers/(\w+)/pause$', 'pause'),
+        ('POST', r'/containers/(\w+)/unpause$', 'unpause'),
+        ('POST', r'/networks/(\w+)/disconnect$', 'disconnect'),
+        ('POST', r'/networks/(\w+)/connect$', 'connect'),
+    ]
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def route(self, method):
+        engine = self.server.engine
+        url = urlparse.urlsplit(self.path)
+        path = url.path[len('/' + dockerapi.API_VERSION):]
+        self.query = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else ''
+        engine.requests.append((method, path))
+
+        for route_method, pattern, name in self.ROUTES:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                args = match.groups()
+                if args and name not in ('start_exec', 'inspect_exec',
+                                         'disconnect', 'connect'):
+                    if args[0] not in engine.containers:
+                        return self.respond(404, {'message': 'no such id'})
+                    args = (engine.containers[args[0]],)
+                return getattr(self, name)(engine, *args)
+        self.respond(404, {'message': 'unknown route'})
+
+    def respond(self, status, data=None, raw=None):
+        body = raw if raw is not None else (
+            json.dumps(data) if data is not None else '')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def list_containers(self, engine):
+        labels = json.loads(self.query.get('filters', '{}')).get('label', [])
+        wanted = dict(label.split('=', 1) for label in labels)
+        self.respond(200, [
+            c.summary() for c in engine.containers.values()
+            if all(c.labels.get(k) == v for k, v in wanted.items())
+        ])
+
+    def inspect(self, engine, c):
+        self.respond(200, c.inspect())
+
+    def start(self, engine, c):
+        if c.state == 'running':
+            return self.respond(304)
+        c.state = 'running'
+        engine.emit(c, 'start')
+        self.respond(204)
+
+    def kill(self, engine, c):
+        c.state = 'exited'
+        engine.emit(c, 'kill')
+        engine.emit(c, 'die', exitCode='137')
+        self.respond(204)
+
+    def pause(self, engine, c):
+        c.state = 'paused'
+        engine.emit(c, 'pause')
+        self.respond(204)
+
+    def unpause(self, engine, c):
+        c.state = 'running'
+        engine.emit(c, 'unpause')
+        self.respond(204)
+
+    def disconnect(self, engine, network):
+        c = engine.containers[json.loads(self.body)['Container']]
+        if c.networks.pop(network, None) is None:
+            return self.respond(404, {'message': 'not connected'})
+        self.respond(200)
+
+    def connect(self, engine, network):
+        body = json.loads(self.body)
+        c = engine.containers[body['Container']]
+        c.networks[network] = {'IPAddress': c.ip,
+                               'Aliases': body['EndpointConfig']['Aliases']}
+        self.respond(200)
+
+    def events(self, engine):
+        filters = json.loads(self.query.get('filters', '{}'))
+        labels = dict(label.split('=', 1) for label in filters['label'])
+        queue = engine.subscribe(labels)
+
+        # stream each event in a chunk, like docker
+        self.protocol_version = 'HTTP/1.1'
+        self.close_connection = 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        while True:
+            data = queue.get()
+            chunk = json.dumps(data) + '\n' if data is not None else ''
+            try:
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            except EnvironmentError:
+                return
+            if data is None:
+                return
+
+    def logs(self, engine, c):
+        self.respond(200, raw=mux(1, c.stdout) + mux(2, c.stderr))
+
+    def create_exec(self, engine, c):
+        exec_id = 'exec%s' % len(engine.execs)
+        engine.execs[exec_id] = (c, json.loads(self.body)['Cmd'])
+        self.respond(201, {'Id': exec_id})
+
+    def start_exec(self, engine, exec_id):
+        c, cmd = engine.execs[exec_id]
+        out, err, code = engine.run(c, cmd)
+        engine.exit_codes[exec_id] = code
+        self.respond(200, raw=mux(1, out) + mux(2, err))
+
+    def inspect_exec(self, engine, exec_id):
+        self.respond(200, {'ExitCode': engine.exit_codes[exec_id]})
+
+    def get_archive(self, engine, c):
+        path = self.query['path']
+        if path not in c.files:
+            return self.respond(404, {'message': 'no such file'})
+        buf = io.BytesIO()
+        tar = tarfile.open(fileobj=buf, mode='w')
+        info = tarfile.TarInfo(os.path.basename(path))
+        info.size = len(c.files[path])
+        tar.addfile(info, io.BytesIO(c.files[path]))
+        tar.close()
+        self.respond(200, raw=buf.getvalue())
+
+    def put_archive(self, engine, c):
+        tar = tarfile.open(fileobj=io.BytesIO(self.body))
+        for member in tar.getmembers():
+            path = os.path.join(self.query['path'], member.name)
+            c.files[path] = tar.extractfile(member).read()
+        self.respond(200)
+
+    def address_string(self):
+        return 'fake-engine'
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeContainer(object):
+
+    def __init__(self, cid, project, service, ports=None):
+        self.id = cid
+        self.name = '/%s_%s_1' % (project, service)
+        self.labels = {
+            dockerapi.PROJECT_LABEL: project,
+            dockerapi.SERVICE_LABEL: service,
+        }
+        self.state = 'running'
+        self.ip = '172.18.0.%s' % (len(service) + 1)
+        self.networks = {'default': {'IPAddress': self.ip}}
+        # e.g. {'53/udp': 32768}
+        self.ports = ports or {}
+        self.files = {}
+        self.stdout = '%s started\n' % service
+        self.stderr = ''
+
+    def summary(self):
+        return {
+            'Id': self.id,
+            'Names': [self.name],
+            'Labels': self.labels,
+            'State': self.state,
+            'Ports': [
+                {'IP': '0.0.0.0', 'PrivatePort': int(key.split('/')[0]),
+                 'PublicPort': port, 'Type': key.split('/')[1]}
+                for key, port in self.ports.items()
+            ],
+            'NetworkSettings': {'Networks': self.networks},
+        }
+
+    def inspect(self):
+        return {
+            'Id': self.id,
+            'Name': self.name,
+            'State': {'Status': self.state,
+                      'Running': self.state == 'running'},
+            'Config': {'Labels': self.labels},
+            'NetworkSettings': {
+                'Ports': dict(
+                    (key, [{'HostIp': '0.0.0.0', 'HostPort': str(port)}])
+                    for key, port in self.ports.items()
+                ),
+                'Networks': self.networks,
+            },
+        }
+
+
+class ThreadedUnixHTTPServer(SocketServer.ThreadingMixIn,
+                             SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeEngine(object):
+    """A fake Docker Engine API, serving on a unix socket in a temp dir"""
+
+    def __init__(self):
+        self.containers = {}
+        self.execs = {}
+        self.exit_codes = {}
+        self.requests = []
+        self.subscribers = []
+
+        self.dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.dir, 'docker.sock')
+        self.server = ThreadedUnixHTTPServer(self.socket_path,
+                                             FakeEngineHandler)
+        self.server.engine = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, project, service, ports=None):
+        cid = 'c%s' % len(self.containers)
+        self.containers[cid] = FakeContainer(cid, project, service, ports)
+        return self.containers[cid]
+
+    def subscribe(self, labels):
+        """Return a queue of the events of containers with the labels"""
+        queue = Queue.Queue()
+        self.subscribers.append((labels, queue))
+        return queue
+
+    def emit(self, container, action, **attributes):
+        attributes.update(container.labels)
+        data = {'Type': 'container', 'Action': action, 'id': container.id,
+                'Actor': {'ID': container.id, 'Attributes': attributes},
+                'time': int(time.time()), 'timeNano': int(time.time() * 1e9)}
+        for labels, queue in self.subscribers:
+            if all(container.labels.get(k) == v for k, v in labels.items()):
+                queue.put(data)
+
+    def run(self, container, cmd):
+        """Run an exec'd command. Returns (out, err, exit code)"""
+        if cmd[0] == 'false':
+            return '', 'failed\n', 1
+        return ' '.join(cmd) + '\n', '', 0
+
+    def stop(self):
+        for _, queue in self.subscribers:
+            queue.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+
+class TestEngineComposer(base.BaseTest):
+
+    def setUp(self):
+        super(TestEngineComposer, self).setUp()
+        self.engine = FakeEngine()
+        self.addCleanup(self.engine.stop)
+        project = docker.normalize_project_name('ruin_designate_abc')
+        self.bind = self.engine.add(project, 'bind-1', {'53/udp': 32768})
+        self.api = self.engine.add(project, 'api', {'9001/tcp': 32769})
+        self.engine.add('otherproject', 'bind-1', {'53/udp': 40000})
+
+        self.dc = docker.EngineComposer(
+            logger=self.log,
+            project_name='ruin_designate_abc',
+            client=dockerapi.EngineClient(self.engine.socket_path),
+        )
+
+    def test_normalize_project_name(self):
+        self.assertEqual(docker.normalize_project_name('ruin_Designate-ab'),
+                         'ruindesignateab')
+
+    def test_port(self):
+        self.assertEqual(self.dc.port('bind-1', 53, 'udp'),
+                         ('0.0.0.0:32768\n', '', 0))
+        self.assertEqual(self.dc.get_host('api', 9001), '127.0.0.1:32769')
+        _, err, ret = self.dc.port('bind-1', 53, 'tcp')
+        self.assertEqual(ret, 1)
+        self.assertIn('53/tcp is not published', err)
+
+    def test_kill_and_start(self):
+        self.assertEqual(self.dc.kill('bind-1'), ('', '', 0))
+        self.assertEqual(self.bind.state, 'exited')
+        self.assertEqual(self.dc.start('bind-1'), ('', '', 0))
+        self.assertEqual(self.bind.state, 'running')
+
+        self.dc.kill('bind-1')
+        self.dc.kill('api')
+        self.assertEqual(self.dc.start(), ('', '', 0))
+        self.assertEqual([self.bind.state, self.api.state],
+                         ['running', 'running'])
+
+    def test_missing_container(self):
+        _, err, ret = self.dc.kill('bind-2')
+        self.assertEqual(ret, 1)
+        self.assertIn('no container for bind-2', err)
+
+    def test_exec(self):
+        self.assertEqual(self.dc.exec_('api', 'echo hello'),
+                         (u'echo hello\n', u'', 0))
+        self.assertEqual(self.dc.exec_('api', ['false']),
+                         (u'', u'failed\n', 1))
+
+    def test_logs(self):
+        out, _, ret = self.dc.logs()
+        self.assertEqual(ret, 0)
+        self.assertEqual(out.splitlines(), [
+            'ruindesignateabc_api_1 | api started',
+            'ruindesignateabc_bind-1_1 | bind-1 started',
+        ])
+
+    def test_copy(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, 'dump.sql.gz')
+        with open(src, 'w') as f:
+            f.write('data')
+
+        self.assertEqual(self.dc.copy_to('api', src, '/tmp/x.gz')[2], 0)
+        self.assertEqual(self.api.files, {'/tmp/x.gz': 'data'})
+
+        dest = os.path.join(tmpdir, 'copy')
+        self.assertEqual(self.dc.copy_from('api', '/tmp/x.gz', dest)[2], 0)
+        self.assertEqual(open(dest).read(), 'data')
+
+    def test_topology(self):
+        topology = self.dc.topology()
+        self.assertEqual(sorted(topology.containers), ['api', 'bind-1'])
+        bind = topology.container('bind-1')
+        self.assertEqual(bind.ports, {(53, 'udp'): 32768})
+        self.assertEqual(bind.ip, self.bind.ip)
+        self.assertTrue(bind.running)
+        self.assertEqual(topology.host('bind-1', 53, 'udp'),
+                         '127.0.0.1:32768')
+
+        # cached until a container is started or stopped
+        self.assertIs(self.dc.topology(), topology)
+        n_requests = len(self.engine.requests)
+        self.dc.kill('bind-1')
+        self.assertFalse(self.dc.topology().container('bind-1').running)
+        self.assertEqual(
+            self.engine.requests[n_requests:],
+            [('GET', '/containers/json'),
+             ('POST', '/containers/%s/kill' % self.bind.id),
+             ('GET', '/containers/json')],
+        )
+
+    def test_events(self):
+        stream = self.dc.events()
+        self.addCleanup(stream.close)
+        self.dc.kill('bind-1')
+        self.engine.add('otherproject', 'api').state = 'exited'
+        self.dc.start('bind-1')
+
+        received = []
+        for data in stream:
+            attributes = data['Actor']['Attributes']
+            received.append((attributes[dockerapi.SERVICE_LABEL],
+                             data['Action']))
+            if len(received) == 3:
+                break
+        self.assertEqual(received, [('bind-1', 'kill'), ('bind-1', 'die'),
+                                    ('bind-1', 'start')])
+
+        # closing the stream ends the iteration
+        stream.close()
+        self.assertEqual(list(stream), [])
+
+    def test_container_events(self):
+        listener = events.ContainerEvents(self.dc.events, logger=self.log)
+        listener.start()
+        self.addCleanup(listener.stop)
+
+        cursor = listener.cursor()
+        self.dc.kill('bind-1')
+        event = listener.wait_for('bind-1', 'die', timeout=2, cursor=cursor)
+        self.assertEqual(event.container, self.bind.id)
+        self.assertEqual(listener.state('bind-1').exit_code, '137')
+
+    def test_pause(self):
+        self.assertEqual(self.dc.pause('bind-1'), ('', '', 0))
+        self.assertEqual(self.bind.state, 'paused')
+        self.assertEqual(self.dc.unpause('bind-1'), ('', '', 0))
+        self.assertEqual(self.bind.state, 'running')
+
+    def test_network_partition(self):
+        self.assertEqual(self.dc.networks('bind-1'), ['default'])
+        self.assertEqual(self.dc.disconnect('bind-1', 'default'), ('', '', 0))
+        self.assertEqual(self.dc.networks('bind-1'), [])
+        self.assertEqual(self.dc.disconnect('bind-1', 'default')[2], 1)
+
+        self.assertEqual(self.dc.connect('bind-1', 'default'), ('', '', 0))
+        self.assertEqual(self.bind.networks['default']['Aliases'],
+                         ['bind-1'])
+        self.assertEqual(self.dc.networks('bind-1'), ['default'])
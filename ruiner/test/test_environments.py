@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from ruiner.common import environments
+from ruiner.common import utils
+from ruiner.common.config import cfg
+from ruiner.common.environments import Environment
+from ruiner.common.environments import EnvironmentPool
+from ruiner.test import base
+
+
+class TestEnvironmentPool(base.BaseTest):
+
+    def setUp(self):
+        super(TestEnvironmentPool, self).setUp()
+        self.pool = EnvironmentPool()
+
+    def make_env(self, fingerprint, project_name):
+        return Environment(
+            fingerprint=fingerprint,
+            project_name=project_name,
+            compose_files=['base.yml'],
+            carina_dir='./fake-designate-carina',
+            designate_yaml='designate.yml',
+            designate_image='designate-base:abc',
+        )
+
+    def test_lease_empty_pool(self):
+        self.assertIsNone(self.pool.lease('abc'))
+
+    def test_lease_by_fingerprint(self):
+        env1 = self.make_env('abc', 'ruin_designate_1')
+        env2 = self.make_env('def', 'ruin_designate_2')
+        self.pool.release(env1)
+        self.pool.release(env2)
+
+        self.assertIs(self.pool.lease('def'), env2)
+        self.assertIsNone(self.pool.lease('def'))
+        self.assertIs(self.pool.lease('abc'), env1)
+        self.assertIsNone(self.pool.lease('abc'))
+
+    def test_drain(self):
+        env1 = self.make_env('abc', 'ruin_designate_1')
+        env2 = self.make_env('abc', 'ruin_designate_2')
+        self.pool.release(env1)
+        self.pool.release(env2)
+
+        self.assertEqual(set(self.pool.drain()), set([env1, env2]))
+        self.assertIsNone(self.pool.lease('abc'))
+
+
+class TestInjectDesignateConf(base.BaseTest):
+
+    def setUp(self):
+        super(TestInjectDesignateConf, self).setUp()
+        self.carina_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.carina_dir)
+        self.designate_conf = os.path.join(self.carina_dir, 'tmp',
+                                           'designate-abc.conf')
+        utils.mkdirs(os.path.dirname(self.designate_conf))
+        open(self.designate_conf, 'w').close()
+
+        cfg.CONF.set_override('inject_designate_conf', True, 'ruiner')
+        self.addCleanup(cfg.CONF.clear_override, 'inject_designate_conf',
+                        'ruiner')
+        patcher = mock.patch.object(environments, 'choose_designate_image',
+                                    return_value='designate-base:abc')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mounts_designate_conf_into_every_service(self):
+        env = environments.generate_environment(
+            self.log, self.carina_dir, 'ruin_designate_abc',
+            self.designate_conf, 'abc')
+        for filename in env.temp_files:
+            self.addCleanup(utils.cleanup_file, filename)
+
+        self.assertEqual(env.compose_files[-1], env.designate_conf_yaml)
+        with open(env.designate_conf_yaml) as f:
+            content = f.read()
+
+        # service name -> its volumes
+        volumes = {}
+        for line in content.splitlines():
+            if line.startswith('  ') and not line.startswith('   '):
+                service = line.strip().rstrip(':')
+                volumes[service] = []
+            elif line.strip().startswith('- '):
+                volumes[service].append(line.strip()[2:].strip("'"))
+
+        mount = "%s:%s:ro" % (os.path.realpath(self.designate_conf),
+                              cfg.CONF.ruiner.designate_conf_path)
+        self.assertEqual(sorted(volumes), sorted(
+            environments.DESIGNATE_SERVICES))
+        for service, mounts in volumes.items():
+            self.assertIn(mount, mounts, service)
+
+
+class TestRepointPoolNameservers(base.BaseTest):
+
+    def test_repoint(self):
+        docker_composer = mock.Mock()
+        docker_composer.exec_.side_effect = [
+            ('', '', 0), ('[["default", 1, "bind-2", 53]]\n', '', 0),
+            ('', '', 0)]
+
+        replaced = environments.repoint_pool_nameservers(
+            docker_composer, [('bind-2', 53), ('172.18.0.4', 53)],
+            '172.18.0.1', 40053)
+
+        self.assertEqual(replaced, [('default', 1, 'bind-2', 53)])
+        cmds = [c[0][1] for c in docker_composer.exec_.call_args_list]
+        self.assertEqual(cmds[0][:3], ['designate-manage', 'pool',
+                                       'generate_file'])
+        self.assertEqual(cmds[1][3], environments.POOLS_FILE_PATH)
+        self.assertEqual(json.loads(cmds[1][4]), [{
+            'old': [['bind-2', 53], ['172.18.0.4', 53]],
+            'host': '172.18.0.1', 'port': 40053,
+        }])
+        self.assertEqual(cmds[2], ['designate-manage', 'pool', 'update',
+                                   '--file', environments.POOLS_FILE_PATH])
+
+    def test_restore_each_replaced_nameserver(self):
+        docker_composer = mock.Mock()
+        docker_composer.exec_.return_value = ('[]\n', '', 0)
+
+        environments.restore_pool_nameservers(
+            docker_composer,
+            [('default', 1, 'bind-2', 53), ('other', 0, '172.18.0.4', 53)],
+            ('172.18.0.1', 40053))
+
+        cmd = docker_composer.exec_.call_args_list[1][0][1]
+        self.assertEqual(json.loads(cmd[4]), [
+            {'old': [['172.18.0.1', 40053]], 'pool': 'default', 'index': 1,
+             'host': 'bind-2', 'port': 53},
+            {'old': [['172.18.0.1', 40053]], 'pool': 'other', 'index': 0,
+             'host': '172.18.0.4', 'port': 53},
+        ])
+
+
+class TestSetupFailure(base.BaseTest):
+
+    def setUp(self):
+        super(TestSetupFailure, self).setUp()
+        patchers = [
+            mock.patch.object(base.docker, 'discover_designate_carina_dir'),
+            mock.patch.object(base.docker, 'make_composer'),
+            mock.patch.multiple(
+                base.BaseDesignateTest,
+                init_tmp_dir=mock.DEFAULT,
+                init_designate_conf=mock.DEFAULT,
+                configure_designate_conf=mock.DEFAULT,
+                show_designate_conf=mock.DEFAULT,
+                init_poll_schedule=mock.DEFAULT,
+                init_docker_compose_yaml=mock.DEFAULT,
+                deploy_environment=mock.DEFAULT,
+                lease_environment=mock.DEFAULT,
+                use_environment=mock.DEFAULT,
+                release_environment=mock.DEFAULT,
+                cleanup_environment=mock.DEFAULT,
+                discover_services=mock.Mock(side_effect=Exception("boom")),
+            ),
+        ]
+        self.mocks = {}
+        for patcher in patchers:
+            result = patcher.start()
+            if isinstance(result, dict):
+                self.mocks.update(result)
+            self.addCleanup(patcher.stop)
+
+    def run_setup(self):
+        # defined here, so py.test doesn't collect it
+        class SetupFailureTest(base.BaseDesignateTest):
+            compose_files = None
+
+            def runTest(self):
+                pass
+
+        SetupFailureTest.setUpClass()
+        test = SetupFailureTest()
+        self.addCleanup(test.doCleanups)
+        with self.assertRaises(Exception) as ctx:
+            test.setUp()
+        self.assertEqual(str(ctx.exception), "boom")
+
+    def test_leased_environment_is_released(self):
+        self.mocks['lease_environment'].return_value = mock.Mock()
+        self.run_setup()
+        self.assertEqual(self.mocks['release_environment'].call_count, 1)
+        self.assertFalse(self.mocks['cleanup_environment'].called)
+
+    def test_deployed_environment_is_torn_down(self):
+        self.mocks['lease_environment'].return_value = None
+        self.run_setup()
+        self.assertTrue(self.mocks['deploy_environment'].called)
+        self.assertEqual(self.mocks['cleanup_environment'].call_count, 1)
+        self.assertFalse(self.mocks['release_environment'].called)
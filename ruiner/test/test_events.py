@@ -0,0 +1,168 @@
+import Queue
+import threading
+import time
+
+from ruiner.common import dockerapi
+from ruiner.common import events
+from ruiner.test import base
+
+
+def docker_event(service, action, timestamp, **attributes):
+    attributes[dockerapi.SERVICE_LABEL] = service
+    attributes['name'] = 'proj_%s_1' % service
+    return {
+        'Type': 'container',
+        'Action': action,
+        'status': action,
+        'id': 'c-%s' % service,
+        'Actor': {'ID': 'c-%s' % service, 'Attributes': attributes},
+        'time': int(timestamp),
+        'timeNano': int(timestamp * 1e9),
+    }
+
+
+class FakeEventStream(object):
+    """Yields the docker event dicts put on it, until closed"""
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.closed = False
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def __iter__(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            yield data
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None)
+
+
+class TestContainerEvents(base.BaseTest):
+
+    def setUp(self):
+        super(TestContainerEvents, self).setUp()
+        self.streams = []
+        self.listener = events.ContainerEvents(
+            self.open_stream, logger=self.log, reconnect_interval=0.01)
+
+    def open_stream(self, since):
+        self.streams.append((since, FakeEventStream()))
+        return self.streams[-1][1]
+
+    def test_state_table(self):
+        now = time.time()
+        self.listener.record(docker_event('bind-2', 'start', now))
+        self.listener.record(docker_event('bind-2', 'health_status: healthy',
+                                          now + 1))
+        state = self.listener.state('bind-2')
+        self.assertEqual((state.status, state.health), ('running', 'healthy'))
+        self.assertEqual(state.container, 'c-bind-2')
+
+        self.listener.record(docker_event('bind-2', 'oom', now + 2))
+        self.listener.record(docker_event('bind-2', 'kill', now + 2))
+        self.listener.record(docker_event('bind-2', 'die', now + 3,
+                                          exitCode='137'))
+        state = self.listener.state('bind-2')
+        self.assertEqual(state.status, 'exited')
+        self.assertEqual(state.exit_code, '137')
+        self.assertAlmostEqual(state.since, now + 3, places=5)
+        self.assertTrue(state.oom_killed)
+
+        self.assertIsNone(self.listener.state('bind-1'))
+        self.assertEqual(
+            [e.action for e in self.listener.history('bind-2')],
+            ['start', 'health_status: healthy', 'oom', 'kill', 'die'],
+        )
+
+    def test_ignores_other_containers(self):
+        data = docker_event('bind-1', 'die', time.time())
+        del data['Actor']['Attributes'][dockerapi.SERVICE_LABEL]
+        self.assertIsNone(self.listener.record(data))
+        self.assertEqual(self.listener.history(), [])
+
+    def test_wait_for(self):
+        self.listener.start()
+        self.addCleanup(self.listener.stop)
+        since, stream = self.streams[0]
+
+        stream.put(docker_event('bind-2', 'die', since))
+        self.assertIsNotNone(self.listener.wait_for('bind-2', 'die', 1))
+        cursor = self.listener.cursor()
+        self.assertEqual(cursor, 1)
+
+        # the docker daemon's clock is behind, so the event we wait for has
+        # an earlier timestamp than the one before the cursor
+        def kill():
+            time.sleep(0.05)
+            stream.put(docker_event('bind-1', 'die', since - 10))
+            stream.put(docker_event('bind-2', 'die', since - 10))
+        threading.Thread(target=kill).start()
+
+        event = self.listener.wait_for('bind-2', 'die', timeout=2,
+                                       cursor=cursor)
+        self.assertEqual(event.service, 'bind-2')
+        self.assertAlmostEqual(event.timestamp, since - 10, places=5)
+        self.assertEqual(self.listener.state('bind-2').status, 'exited')
+
+        self.assertIsNone(self.listener.wait_for(
+            'bind-2', ['start', 'restart'], timeout=0.05, cursor=cursor))
+
+    def test_reconnects(self):
+        self.listener.start()
+        since, stream = self.streams[0]
+        now = time.time()
+        stream.put(docker_event('bind-2', 'die', now))
+        self.assertIsNotNone(self.listener.wait_for('bind-2', 'die', 1))
+
+        # end the stream, as if the docker daemon hung up
+        stream.put(None)
+        event = self.listener.wait_for('bind-2', 'start', 0.2)
+        self.assertIsNone(event)
+        self.assertEqual(len(self.streams), 2)
+        since, stream = self.streams[1]
+        self.assertAlmostEqual(since, now, places=5)
+
+        # a replayed event is not recorded twice
+        stream.put(docker_event('bind-2', 'die', now))
+        stream.put(docker_event('bind-2', 'start', now + 1))
+        self.assertIsNotNone(self.listener.wait_for('bind-2', 'start', 1))
+        self.assertEqual(
+            [e.action for e in self.listener.history('bind-2')],
+            ['die', 'start'],
+        )
+
+        self.listener.stop()
+        self.assertTrue(stream.closed)
+
+    def test_stop_while_reconnecting(self):
+        opened = threading.Event()
+        resume = threading.Event()
+
+        def open_stream(since):
+            if self.streams:
+                # reconnecting. let stop() run before the stream is opened
+                opened.set()
+                resume.wait()
+            return self.open_stream(since)
+
+        self.listener.open_stream = open_stream
+        self.listener.start()
+        first = self.streams[0][1]
+        first.put(None)
+        self.assertTrue(opened.wait(2))
+
+        stopper = threading.Thread(target=self.listener.stop)
+        stopper.start()
+        time.sleep(0.05)
+        resume.set()
+        stopper.join(2)
+        self.assertFalse(stopper.is_alive())
+
+        self.assertEqual(len(self.streams), 2)
+        self.assertTrue(all(stream.closed for _, stream in self.streams))
@@ -0,0 +1,142 @@
+import errno
+import itertools
+import socket
+import time
+
+import dns.exception
+import mock
+
+from ruiner.common import dnsprobe
+from ruiner.common import faultproxy
+from ruiner.common import utils
+from ruiner.test import base
+from ruiner.test.test_dnsprobe import FakeNameserver
+
+
+class TestFaultProxy(base.BaseTest):
+
+    def setUp(self):
+        super(TestFaultProxy, self).setUp()
+        self.ns = FakeNameserver()
+        self.addCleanup(self.ns.stop)
+        self.proxy = faultproxy.FaultProxy(self.ns.location, seed=1,
+                                           logger=self.log)
+        self.proxy.start()
+        self.addCleanup(self.proxy.stop)
+
+    def test_forwards_udp_and_tcp(self):
+        resp = utils.dig('poo.com.', self.proxy.location, 'A')
+        self.assertEqual(resp.answer[0].name.to_text(), 'poo.com.')
+        resp = utils.dig('tcp.poo.com.', self.proxy.location, 'A',
+                         protocol='tcp')
+        self.assertEqual(resp.answer[0].name.to_text(), 'tcp.poo.com.')
+        self.assertEqual(self.ns.tcp_queries, ['tcp.poo.com.'])
+
+        stats = self.proxy.stats()
+        # the query and the response
+        self.assertEqual(stats['udp_forwarded'], 2)
+        self.assertEqual(stats['tcp_connections'], 1)
+        self.assertGreater(stats['tcp_bytes'], 0)
+
+    def test_loss(self):
+        self.proxy.set_faults(loss=0.5)
+        names = ["name%s.poo.com." % i for i in range(200)]
+        queries = dnsprobe.dig_many(names, [self.proxy.location], 'A',
+                                    timeout=0.2, retries=0)
+
+        # a query is answered if neither it nor its response are dropped
+        answered = sum(1 for q in queries if q.answered)
+        self.assertTrue(20 < answered < 80, answered)
+        stats = self.proxy.stats()
+        self.assertGreater(stats['udp_dropped'], 0)
+        self.assertGreaterEqual(stats['udp_forwarded'], 2 * answered)
+
+        self.proxy.clear_faults()
+        self.assertTrue(utils.dig('poo.com.', self.proxy.location, 'A'))
+
+    def test_delay(self):
+        self.proxy.set_faults(delay=lambda: 0.1)
+        start = time.time()
+        utils.dig('poo.com.', self.proxy.location, 'A')
+        # the query and the response are each delayed
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        self.proxy.set_faults(delay=0.05, rate=1000)
+        start = time.time()
+        utils.dig('poo.com.', self.proxy.location, 'A', protocol='tcp')
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_blackhole(self):
+        self.proxy.set_faults(blackhole=True)
+        self.assertRaises(dns.exception.Timeout, utils.dig, 'poo.com.',
+                          self.proxy.location, 'A', timeout=0.2)
+        self.assertRaises(dns.exception.Timeout, utils.dig, 'poo.com.',
+                          self.proxy.location, 'A', protocol='tcp',
+                          timeout=0.2)
+        self.assertEqual(self.ns.seen, {})
+        self.assertEqual(self.proxy.stats()['udp_dropped'], 1)
+
+        self.proxy.set_faults(blackhole=False)
+        self.assertTrue(utils.dig('poo.com.', self.proxy.location, 'A'))
+
+    def test_set_upstream(self):
+        other = FakeNameserver()
+        self.addCleanup(other.stop)
+        self.proxy.set_upstream(other.location)
+        utils.dig('poo.com.', self.proxy.location, 'A')
+        self.assertEqual(other.seen, {'poo.com.': 1})
+        self.assertEqual(self.ns.seen, {})
+
+
+class FakeSocket(object):
+    """Binds udp sockets to sequential ports. The first tcp bind fails as if
+    the port were taken."""
+
+    ports = None
+    tcp_binds = None
+
+    def __init__(self, family, type):
+        self.type = type
+        self.address = None
+        self.closed = False
+
+    def bind(self, address):
+        host, port = address
+        if self.type == socket.SOCK_STREAM:
+            FakeSocket.tcp_binds.append(port)
+            if len(FakeSocket.tcp_binds) == 1:
+                raise socket.error(errno.EADDRINUSE, "Address in use")
+        elif port == 0:
+            port = next(FakeSocket.ports)
+        self.address = (host, port)
+
+    def getsockname(self):
+        return self.address
+
+    def setsockopt(self, *args):
+        pass
+
+    def listen(self, backlog):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class TestBindUdpAndTcp(base.BaseTest):
+
+    def test_retries_a_taken_tcp_port(self):
+        FakeSocket.ports = itertools.count(40000)
+        FakeSocket.tcp_binds = []
+        with mock.patch.object(utils.socket, 'socket', FakeSocket):
+            udp, tcp = utils.bind_udp_and_tcp('127.0.0.1')
+        self.assertEqual(FakeSocket.tcp_binds, [40000, 40001])
+        self.assertEqual(udp.getsockname(), ('127.0.0.1', 40001))
+        self.assertEqual(tcp.getsockname(), ('127.0.0.1', 40001))
+
+    def test_explicit_port_is_not_retried(self):
+        FakeSocket.ports = itertools.count(40000)
+        FakeSocket.tcp_binds = []
+        with mock.patch.object(utils.socket, 'socket', FakeSocket):
+            self.assertRaises(socket.error, utils.bind_udp_and_tcp,
+                              '127.0.0.1', 5354)
@@ -0,0 +1,47 @@
+import mock
+import tempfile
+
+from ruiner.common import images
+from ruiner.test import base
+
+
+class TestImageCache(base.BaseTest):
+
+    def setUp(self):
+        super(TestImageCache, self).setUp()
+        self.conf = tempfile.NamedTemporaryFile()
+        self.conf.write("[DEFAULT]\ndebug = True\n")
+        self.conf.flush()
+        self.lock_dir = tempfile.mkdtemp()
+        self.cache = images.ImageCache(self.log, self.lock_dir)
+
+    def test_cache_key_is_stable(self):
+        key1 = images.cache_key('url', 'master', [self.conf.name])
+        key2 = images.cache_key('url', 'master', [self.conf.name])
+        self.assertEqual(key1, key2)
+        self.assertEqual(images.image_tag(key1), 'designate-base:%s' % key1)
+
+    def test_cache_key_changes_with_inputs(self):
+        key = images.cache_key('url', 'master', [self.conf.name])
+        self.assertNotEqual(
+            key, images.cache_key('url', 'stable/newton', [self.conf.name]))
+        self.assertNotEqual(
+            key, images.cache_key('other-url', 'master', [self.conf.name]))
+
+        self.conf.write("quota_zones = 3\n")
+        self.conf.flush()
+        self.assertNotEqual(
+            key, images.cache_key('url', 'master', [self.conf.name]))
+
+    @mock.patch('ruiner.common.docker.image_exists', return_value=True)
+    def test_ensure_skips_build_on_hit(self, _):
+        build = mock.Mock()
+        self.assertIsNone(self.cache.ensure('designate-base:abc', build))
+        self.assertFalse(build.called)
+
+    @mock.patch('ruiner.common.docker.image_exists', return_value=False)
+    def test_ensure_builds_on_miss(self, _):
+        build = mock.Mock(return_value=('built', '', 0))
+        self.assertEqual(self.cache.ensure('designate-base:abc', build),
+                         ('built', '', 0))
+        build.assert_called_once_with()
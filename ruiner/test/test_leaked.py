@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from ruiner.common import leaked
+from ruiner.test import base
+
+
+class FakeDocker(object):
+    """Answers the docker commands run by leaked, and records them"""
+
+    # when each container and image was created
+    CREATED = {
+        'c1': '2016-08-10T18:00:00.123456789Z',
+        'c2': '2016-08-10T18:30:00.123456789Z',
+        'c3': '2016-08-10T17:00:00Z',
+        'designate-base:ruin_designate_ghi': '2016-08-10T16:00:00Z',
+    }
+
+    def __init__(self, fail=()):
+        self.cmds = []
+        self.fail = fail
+
+    def __call__(self, cmd):
+        self.cmds.append(cmd)
+        if cmd[:2] == ['docker', 'ps']:
+            return (u'c1\truindesignateabc\tUp 2 minutes\n'
+                    u'c2\truindesignateabc\tUp 2 minutes (Paused)\n'
+                    u'c3\truindesignatedef\tExited (137) 1 hour ago\n'
+                    u'c4\tsomeotherproject\tUp 3 days\n', u'', 0)
+        if cmd[:3] == ['docker', 'network', 'ls']:
+            return (u'n1\truindesignateabc\nn2\tsomeotherproject\n', u'', 0)
+        if cmd[:2] == ['docker', 'images']:
+            return (u'ruin_designate_ghi\nabcdef0123456789\n', u'', 0)
+        if cmd[:2] == ['docker', 'inspect']:
+            return u''.join(self.CREATED[ref] + u'\n'
+                            for ref in cmd[4:]), u'', 0
+        if any(arg in self.fail for arg in cmd):
+            return u'', u'no such thing', 1
+        return u'', u'', 0
+
+
+class TestLeaked(base.BaseTest):
+
+    def test_find_projects(self):
+        with mock.patch('ruiner.common.utils.run_cmd', FakeDocker()):
+            projects = leaked.find_projects()
+
+        self.assertEqual(sorted(projects), ['ruindesignateabc',
+                                            'ruindesignatedef',
+                                            'ruindesignateghi'])
+        abc = projects['ruindesignateabc']
+        self.assertEqual((abc.containers, abc.paused, abc.networks),
+                         (['c1', 'c2'], ['c2'], ['n1']))
+        self.assertEqual(projects['ruindesignatedef'].containers, ['c3'])
+        self.assertEqual(projects['ruindesignateghi'].images,
+                         ['designate-base:ruin_designate_ghi'])
+        # the newest container
+        self.assertEqual(abc.created,
+                         leaked.parse_created('2016-08-10T18:30:00Z'))
+
+    def test_stale_projects(self):
+        with mock.patch('ruiner.common.utils.run_cmd', FakeDocker()):
+            projects = leaked.find_projects()
+        projects['ruindesignatejkl'] = leaked.Project('ruindesignatejkl')
+        projects['ruindesignatejkl'].networks.append('n3')
+
+        # at 18:45, keep projects created in the last 30 minutes
+        now = leaked.parse_created('2016-08-10T18:45:00Z')
+        with mock.patch('time.time', return_value=now):
+            stale = leaked.stale_projects(projects.values(), 30 * 60,
+                                          in_use=['ruin_designate_ghi'])
+        self.assertEqual(sorted(p.name for p in stale),
+                         ['ruindesignatedef', 'ruindesignatejkl'])
+
+    def test_remove_projects(self):
+        fake = FakeDocker(fail=['c3'])
+        with mock.patch('ruiner.common.utils.run_cmd', fake):
+            projects = leaked.find_projects()
+            del fake.cmds[:]
+            failed = leaked.remove_projects(projects.values(), workers=2,
+                                            logger=self.log)
+
+        self.assertEqual(failed, ['ruindesignatedef'])
+        self.assertEqual(
+            [c for c in fake.cmds if 'c1' in c or 'n1' in c], [
+                ['docker', 'rm', '-f', '-v', 'c1', 'c2'],
+                ['docker', 'network', 'rm', 'n1'],
+            ])
+        # paused containers are unpaused before they are removed
+        unpause = fake.cmds.index(['docker', 'unpause', 'c2'])
+        self.assertLess(unpause, fake.cmds.index(
+            ['docker', 'rm', '-f', '-v', 'c1', 'c2']))
+        self.assertIn(['docker', 'rmi', 'designate-base:ruin_designate_ghi'],
+                      fake.cmds)
+
+    def test_stale_temp_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        old = os.path.join(tmp_dir, 'designate-abc.conf')
+        new = os.path.join(tmp_dir, 'designate-def.conf')
+        for filename in (old, new):
+            open(filename, 'w').close()
+        os.mkdir(os.path.join(tmp_dir, 'datasets'))
+        an_hour_ago = time.time() - 3600
+        os.utime(old, (an_hour_ago, an_hour_ago))
+
+        self.assertEqual(leaked.stale_temp_files(tmp_dir, 600), [old])
+        self.assertEqual(leaked.stale_temp_files('/no/such/dir', 600), [])
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+
+from ruiner.common import bulk
+from ruiner.common import metrics
+from ruiner.test import base
+
+
+class TestRecorder(base.BaseTest):
+
+    def test_write_report(self):
+        recorder = metrics.Recorder()
+        for i in range(1, 101):
+            recorder.add('zone_create.api_latency', i / 100.0)
+        summary = bulk.Summary()
+        summary.add(bulk.Result(0, None, Exception(), 0, 1))
+        recorder.add_operation('zone_create', summary)
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'benchmark.json')
+        recorder.write(filename, config={'rate': 2})
+
+        with open(filename) as f:
+            report = json.load(f)
+        self.assertEqual(report['config'], {'rate': 2})
+        self.assertEqual(report['operations']['zone_create']['errors'], 1)
+        self.assertEqual(report['latencies']['zone_create.api_latency'], {
+            'count': 100, 'p50': 0.5, 'p90': 0.9, 'p99': 0.99, 'max': 1.0,
+        })
+
+
+class TestStatusTracker(base.BaseTest):
+
+    def test_first_seen(self):
+        listings = [
+            [],
+            [{'id': 'a', 'status': 'PENDING'}],
+            [{'id': 'a', 'status': 'ACTIVE'}],
+            None,
+            [],
+        ]
+        tracker = metrics.StatusTracker(lambda: listings.pop(0))
+        tracker.track('a')
+        for _ in range(len(listings)):
+            tracker.sample()
+
+        self.assertEqual([s for _, s in tracker.history['a']],
+                         ['PENDING', 'ACTIVE', 'missing'])
+        pending = tracker.first_seen('a', 'PENDING')
+        active = tracker.first_seen('a', 'ACTIVE')
+        self.assertLessEqual(pending, active)
+        self.assertIsNone(tracker.first_seen('a', 'ACTIVE', since=active + 1))
+        self.assertIsNone(tracker.first_seen('b', 'ACTIVE'))
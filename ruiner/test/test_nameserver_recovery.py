@@ -1,3 +1,4 @@
+import time
 import unittest
 
 from ruiner.common.ini import IniFile
@@ -14,7 +15,7 @@ class TestNameserverRecovery(base.BaseDesignateTest):
         name, zid = self.create_zone()
         self.wait_for_zone_to_error(name, zid)
         self.restart_nameserver()
-        self.wait_for_zone_to_active(name, zid)
+        self.wait_for_zone_to_active(name, zid, failure_statuses=[])
 
     def test_delete_zone_while_nameserver_is_down(self):
         """Delete a zone while a nameserver is down. Check the zone goes to
@@ -26,7 +27,7 @@ class TestNameserverRecovery(base.BaseDesignateTest):
         self.delete_zone(name, zid)
         self.wait_for_zone_to_error(name, zid)
         self.restart_nameserver()
-        self.wait_for_zone_to_404(name, zid)
+        self.wait_for_zone_to_404(name, zid, failure_statuses=[])
 
     def test_create_recordset_while_nameserver_is_down(self):
         """Create a recordset while a nameserver is down. Check the zone goes
@@ -38,7 +39,40 @@ class TestNameserverRecovery(base.BaseDesignateTest):
         rrname, rrid = self.create_recordset(zname, zid)
         self.wait_for_zone_to_error(zname, zid)
         self.restart_nameserver()
-        self.wait_for_zone_to_active(zname, zid)
+        self.wait_for_zone_to_active(zname, zid, failure_statuses=[])
+        self.verify_zone_contents(zname, zid)
+
+    def test_create_zone_while_nameserver_is_paused(self):
+        """Create a zone while a nameserver is frozen. Check the zone goes to
+        ERROR. Unpause the nameserver. Check the zone goes to ACTIVE.
+        """
+        self.pause_nameserver()
+        name, zid = self.create_zone()
+        self.wait_for_zone_to_error(name, zid)
+        self.unpause_nameserver()
+        self.wait_for_zone_to_active(name, zid, failure_statuses=[])
+
+    def test_create_zone_while_nameserver_is_partitioned(self):
+        """Create a zone while a nameserver is cut off from the network. Check
+        the zone goes to ERROR. Reconnect the nameserver. Check the zone goes
+        to ACTIVE.
+        """
+        self.partition_nameserver()
+        name, zid = self.create_zone()
+        self.wait_for_zone_to_error(name, zid)
+        self.heal_nameserver()
+        self.wait_for_zone_to_active(name, zid, failure_statuses=[])
+
+    def test_create_zone_with_lossy_nameserver(self):
+        """Create a zone while many polls of a nameserver are lost. Check the
+        zone goes to ACTIVE, since designate retries its polls.
+        """
+        proxy = self.proxy_nameserver(seed=1)
+        proxy.set_faults(loss=0.3)
+        name, zid = self.create_zone()
+        self.wait_for_zone_to_active(name, zid)
+        self.log.info("proxy stats: %s", proxy.stats())
+        self.assertGreater(proxy.stats().get('udp_forwarded', 0), 0)
 
 
 @unittest.skip("https://bugs.launchpad.net/designate/+bug/1617454")
@@ -106,19 +140,21 @@ class TestThresholdPercentage(base.BaseDesignateTest):
 
         # kill a nameserver. check that a delete leads to 404.
         self.kill_nameserver('bind-2')
+        since = time.time()
         self.delete_zone(name, zid)
         self.wait_for_zone_to_404(name, zid)
-        self.wait_for_name_removed_from_nameserver(name, 'bind-1')
+        self.wait_for_zone_removed_from_nameservers(name, since, ['bind-1'])
 
         # restart the nameserver. the zone must be removed from all nameservers
-        # (within our timeout)
-        self.restart_nameserver('bind-2')
-        self.wait_for_name_removed_from_nameserver(name, 'bind-2')
+        # (within our timeout), timed from when the container started
+        started = self.restart_nameserver('bind-2')
+        self.wait_for_zone_removed_from_nameservers(name, started, ['bind-2'])
 
     def _create_zone(self):
         # create a zone
+        since = time.time()
         name, zid = self.create_zone()
+        self.watch_zone(name)
         self.wait_for_zone_to_active(name, zid)
-        self.wait_for_name_on_nameserver(name, 'bind-1')
-        self.wait_for_name_on_nameserver(name, 'bind-2')
+        self.wait_for_zone_on_nameservers(name, since)
         return name, zid
@@ -17,11 +17,8 @@ class TestZonePerTenantQuota(base.BaseDesignateTest):
 
     def test_quota_zones(self):
         # create enough zones to reach, but not exceed, the quota
-        zones = []
-        for _ in range(self.quota_zones):
-            zones.append(self.create_zone())
-        for zone in zones:
-            self.wait_for_zone_to_active(*zone)
+        zones = self.create_zones(self.quota_zones)
+        self.wait_for_zones_to_active(zones)
 
         # create an additional zone. check that it 413s.
         resp = self.api.create_zone()
@@ -0,0 +1,66 @@
+import socket
+import threading
+
+from ruiner.common import readiness
+from ruiner.test import base
+
+
+class TestReadiness(base.BaseTest):
+
+    def probe_ready_after(self, n):
+        """Return a probe that becomes ready on the nth call"""
+        calls = []
+
+        def probe():
+            calls.append(1)
+            if len(calls) < n:
+                raise socket.error("connection refused")
+            return True
+        return probe
+
+    def test_wait_until_ready(self):
+        probes = {
+            'api': self.probe_ready_after(1),
+            'mysql': self.probe_ready_after(3),
+        }
+        ready, waiting = readiness.wait_until_ready(
+            probes, timeout=5, logger=self.log, initial_interval=0.01,
+        )
+        self.assertEqual(sorted(ready), ['api', 'mysql'])
+        self.assertEqual(waiting, {})
+        self.assertLess(ready['api'], ready['mysql'])
+
+    def test_wait_until_ready_times_out(self):
+        probes = {
+            'api': self.probe_ready_after(1),
+            'rabbit': lambda: False,
+        }
+        ready, waiting = readiness.wait_until_ready(
+            probes, timeout=0.2, logger=self.log, initial_interval=0.01,
+        )
+        self.assertEqual(list(ready), ['api'])
+        self.assertEqual(waiting, {'rabbit': 'probe returned False'})
+
+    def _serve_once(self, greeting_reply):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+
+        def serve():
+            conn, _ = server.accept()
+            conn.sendall(greeting_reply)
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return "127.0.0.1:%s" % server.getsockname()[1]
+
+    def test_tcp_probe_wants_data(self):
+        location = self._serve_once('hello')
+        self.assertTrue(readiness.tcp_probe(location)())
+
+    def test_tcp_probe_not_ready_when_connection_closes(self):
+        location = self._serve_once('')
+        self.assertFalse(readiness.tcp_probe(location)())
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import mock
+
+from ruiner.common import reaper
+from ruiner.test import base
+from ruiner.test import conftest
+
+
+class TestReaper(base.BaseTest):
+
+    def setUp(self):
+        super(TestReaper, self).setUp()
+        self.reaper = reaper.Reaper(workers=2, logger=self.log)
+
+    def test_report_failures(self):
+        def fail():
+            raise Exception("boom")
+
+        self.reaper.submit('ok', lambda: True)
+        self.reaper.submit('failed', lambda: False)
+        self.reaper.submit('raised', fail)
+
+        failures = self.reaper.report()
+        self.assertEqual(sorted(name for name, _ in failures),
+                         ['failed', 'raised'])
+        self.assertEqual(dict(failures)['failed'], None)
+        self.assertEqual(str(dict(failures)['raised']), 'boom')
+        # failures are reported once
+        self.assertEqual(self.reaper.report(), [])
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def teardown(seconds):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(seconds)
+            with lock:
+                running.pop()
+            return True
+
+        start = time.time()
+        for i in range(6):
+            self.reaper.submit('project%s' % i, teardown, 0.05)
+        # submit doesn't block on the teardowns
+        self.assertLess(time.time() - start, 0.05)
+
+        self.assertEqual(self.reaper.report(), [])
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(self.reaper._threads), 2)
+
+
+class TestSessionReport(base.BaseTest):
+
+    def setUp(self):
+        super(TestSessionReport, self).setUp()
+        self.reaper = reaper.Reaper(logger=self.log)
+        self.reaper.submit('ruindesignateabc', lambda: False)
+        for patcher in (mock.patch.object(reaper, 'REAPER', self.reaper),
+                        mock.patch.object(conftest, 'FAILURES', [])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_worker_sends_failures_to_master(self):
+        session = mock.Mock()
+        session.config.slaveoutput = {}
+        conftest.pytest_sessionfinish(session, 0)
+        self.assertEqual(session.config.slaveoutput['reaper_failures'],
+                         [('ruindesignateabc', None)])
+        self.assertEqual(conftest.FAILURES, [])
+
+        node = mock.Mock(slaveoutput=session.config.slaveoutput)
+        conftest.pytest_testnodedown(node, None)
+        self.assertEqual(conftest.FAILURES, [('ruindesignateabc', None)])
+
+    def test_summary(self):
+        session = mock.Mock(spec=['config'])
+        session.config = mock.Mock(spec=[])
+        conftest.pytest_sessionfinish(session, 0)
+
+        reporter = mock.Mock()
+        conftest.pytest_terminal_summary(reporter)
+        self.assertEqual(reporter.write_line.call_args_list[0][0][0],
+                         "FAILED TO CLEANUP ENV (project=ruindesignateabc)")
+
+        conftest.FAILURES[:] = []
+        reporter = mock.Mock()
+        conftest.pytest_terminal_summary(reporter)
+        self.assertFalse(reporter.section.called)
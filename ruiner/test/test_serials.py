@@ -0,0 +1,97 @@
+import time
+
+import dns.message
+import dns.rcode
+import dns.rrset
+
+from ruiner.common import serials
+from ruiner.test import base
+from ruiner.test.test_dnsprobe import FakeNameserver
+
+
+class FakeAuthoritativeNameserver(FakeNameserver):
+    """Answers SOA queries for the zones in `self.zones`, a dict mapping zone
+    names to serials. Refuses queries for other zones, like bind."""
+
+    def __init__(self):
+        self.zones = {}
+        super(FakeAuthoritativeNameserver, self).__init__()
+
+    def answer(self, query):
+        resp = dns.message.make_response(query)
+        name = query.question[0].name
+        serial = self.zones.get(name.to_text())
+        if serial is None:
+            resp.set_rcode(dns.rcode.REFUSED)
+        else:
+            resp.answer.append(dns.rrset.from_text(
+                name, 300, 'IN', 'SOA',
+                'ns1.poo.com. admin.poo.com. %s 3600 600 86400 300' % serial,
+            ))
+        return resp
+
+
+class TestSerialWatcher(base.BaseTest):
+
+    def setUp(self):
+        super(TestSerialWatcher, self).setUp()
+        self.ns1 = FakeAuthoritativeNameserver()
+        self.ns2 = FakeAuthoritativeNameserver()
+        self.addCleanup(self.ns1.stop)
+        self.addCleanup(self.ns2.stop)
+        self.watcher = serials.SerialWatcher(
+            {'bind-1': self.ns1.location, 'bind-2': self.ns2.location},
+            interval=0.02, probe_timeout=0.1, logger=self.log,
+        )
+
+    def test_sample_records_changes(self):
+        self.watcher.watch('poo.com.')
+        self.watcher.sample()
+        self.ns1.zones['poo.com.'] = 1
+        self.watcher.sample()
+        self.watcher.sample()
+        self.ns1.zones['poo.com.'] = 2
+        self.ns2.zones['poo.com.'] = 2
+        self.watcher.sample()
+
+        self.assertEqual(
+            [e.serial for e in self.watcher.history('poo.com.', 'bind-1')],
+            [serials.GONE, 1, 2],
+        )
+        self.assertEqual(
+            [e.serial for e in self.watcher.history('poo.com.', 'bind-2')],
+            [serials.GONE, 2],
+        )
+        self.assertEqual(self.watcher.serial('poo.com.', 'bind-1'), 2)
+        self.assertIsNone(self.watcher.serial('other.com.', 'bind-1'))
+
+    def test_unresponsive_nameserver_is_skipped(self):
+        self.ns1.zones['poo.com.'] = 1
+        self.ns2.stop()
+        self.watcher.watch('poo.com.')
+        self.watcher.sample()
+
+        self.assertEqual(
+            [(e.nameserver, e.serial) for e in self.watcher.events],
+            [('bind-1', 1)],
+        )
+
+    def test_wait_for_present_and_gone(self):
+        self.watcher.start()
+        self.addCleanup(self.watcher.stop)
+        since = self.watcher.watch('poo.com.')
+        self.assertIsNone(
+            self.watcher.wait_for_present('poo.com.', 'bind-1', 0.1))
+
+        self.ns1.zones['poo.com.'] = 5
+        event = self.watcher.wait_for_present('poo.com.', 'bind-1', 2,
+                                              since=since)
+        self.assertEqual(event.serial, 5)
+        self.assertGreaterEqual(event.timestamp, since)
+
+        removed = time.time()
+        del self.ns1.zones['poo.com.']
+        event = self.watcher.wait_for_gone('poo.com.', 'bind-1', 2,
+                                           since=removed)
+        self.assertIs(event.serial, serials.GONE)
+        self.assertGreaterEqual(event.timestamp, removed)
@@ -0,0 +1,175 @@
+import mock
+import tempfile
+import time
+
+from ruiner.common import waiters
+from ruiner.common.ini import IniFile
+from ruiner.test import base
+
+
+def fake_resp(status_code=200, status=None):
+    resp = mock.Mock(status_code=status_code, ok=status_code < 400)
+    resp.json.return_value = {'status': status}
+    return resp
+
+
+def api_call(*resps):
+    """Return a function which returns each resp in turn, repeating the last
+    resp forever"""
+    resps = list(resps)
+    return lambda: resps.pop(0) if len(resps) > 1 else resps[0]
+
+
+class TestWaiters(base.BaseTest):
+
+    def test_wait_for_status(self):
+        result = waiters.wait_for_status(
+            api_call(fake_resp(status='PENDING'), fake_resp(status='PENDING'),
+                     fake_resp(status='ACTIVE')),
+            ['ACTIVE'], interval=0, timeout=5,
+        )
+        self.assertTrue(result.succeeded)
+        self.assertEqual(result.state, 'ACTIVE')
+        self.assertEqual(result.polls, 3)
+        self.assertEqual([s for _, s in result.transitions],
+                         ['PENDING', 'ACTIVE'])
+
+    def test_wait_for_status_stops_on_failure_status(self):
+        result = waiters.wait_for_status(
+            api_call(fake_resp(status='PENDING'), fake_resp(status='ERROR')),
+            ['ACTIVE'], interval=0, timeout=5, failure_statuses=['ERROR'],
+        )
+        self.assertEqual(result.outcome, waiters.WaitResult.FAILURE)
+        self.assertEqual(result.state, 'ERROR')
+        self.assertEqual(result.polls, 2)
+
+    def test_wait_for_status_stops_on_failed_request(self):
+        result = waiters.wait_for_status(
+            api_call(fake_resp(status_code=404)), ['ACTIVE'], interval=0,
+            timeout=5,
+        )
+        self.assertEqual(result.outcome, waiters.WaitResult.FAILURE)
+        self.assertEqual(result.state, 404)
+
+    def test_wait_for_status_timeout(self):
+        result = waiters.wait_for_status(
+            api_call(fake_resp(status='ERROR')), ['ACTIVE'], interval=0.01,
+            timeout=0.05,
+        )
+        self.assertEqual(result.outcome, waiters.WaitResult.TIMEOUT)
+        self.assertEqual(result.state, 'ERROR')
+        self.assertGreater(result.polls, 1)
+        self.assertEqual(len(result.transitions), 1)
+
+    def test_wait_for_404(self):
+        result = waiters.wait_for_404(
+            api_call(fake_resp(status='PENDING'), fake_resp(status_code=404)),
+            interval=0, timeout=5,
+        )
+        self.assertTrue(result.succeeded)
+        self.assertEqual(result.trace().count('->'), 1)
+
+    def test_wait_for_404_stops_on_failure_status(self):
+        result = waiters.wait_for_404(
+            api_call(fake_resp(status='ERROR')), interval=0, timeout=5,
+            failure_statuses=['ERROR'],
+        )
+        self.assertEqual(result.outcome, waiters.WaitResult.FAILURE)
+        self.assertEqual(result.polls, 1)
+
+
+class TestPollSchedules(base.BaseTest):
+
+    def test_fixed_schedule(self):
+        schedule = waiters.FixedSchedule(3)
+        self.assertEqual(schedule.sleep_time(1, 0), 3)
+        self.assertEqual(schedule.sleep_time(10, 30), 3)
+
+    def test_exponential_schedule(self):
+        schedule = waiters.ExponentialSchedule(initial=0.25, cap=3)
+        self.assertEqual(
+            [schedule.sleep_time(polls, 0) for polls in range(1, 8)],
+            [0.25, 0.5, 1, 2, 3, 3, 3],
+        )
+
+    def test_hinted_schedule(self):
+        schedule = waiters.HintedSchedule(
+            [2, 10], waiters.FixedSchedule(3), slack=0.25,
+        )
+        # sleep until just after the hint, unless the fallback is sooner
+        self.assertEqual(schedule.sleep_time(1, 0), 2.25)
+        self.assertEqual(schedule.sleep_time(2, 2.25), 3)
+        self.assertEqual(schedule.sleep_time(3, 8), 2.25)
+        # no more hints
+        self.assertEqual(schedule.sleep_time(4, 10.25), 3)
+
+    def test_hinted_schedule_from_designate_conf(self):
+        conf = tempfile.NamedTemporaryFile()
+        ini = IniFile(conf.name)
+        ini.set("service:worker", "poll_delay", 2)
+        ini.set("service:worker", "poll_timeout", 2)
+        ini.set("service:worker", "poll_retry_interval", 2)
+        ini.set("service:worker", "poll_max_retries", 1)
+        ini.set("producer_task:worker_periodic_recovery", "interval", 30)
+
+        schedule = waiters.HintedSchedule.from_designate_conf(
+            conf.name, waiters.FixedSchedule(3))
+        self.assertEqual(schedule.hints, [2, 4, 6, 8, 38, 68, 98])
+
+    def test_wait_for_never_sleeps_past_timeout(self):
+        start = time.time()
+        result = waiters.wait_for_status(
+            api_call(fake_resp(status='PENDING')), ['ACTIVE'],
+            interval=waiters.FixedSchedule(10), timeout=0.1,
+        )
+        self.assertEqual(result.outcome, waiters.WaitResult.TIMEOUT)
+        self.assertEqual(result.polls, 2)
+        self.assertLess(time.time() - start, 1)
+
+
+class TestWaitForZonesStatus(base.BaseTest):
+
+    def listing(self, *ticks):
+        """Return a list_zones function, which returns a listing of
+        zones for each tick. Each tick is a dict mapping zone ids to
+        statuses."""
+        ticks = list(ticks)
+
+        def list_zones():
+            tick = ticks.pop(0) if len(ticks) > 1 else ticks[0]
+            if tick is None:
+                return None
+            return [{'id': zid, 'status': status}
+                    for zid, status in tick.items()]
+        return list_zones
+
+    def test_wait_for_zones_status(self):
+        list_zones = self.listing(
+            {'a': 'PENDING', 'b': 'PENDING', 'c': 'ACTIVE'},
+            None,
+            {'a': 'ACTIVE', 'b': 'PENDING', 'c': 'ACTIVE'},
+            {'a': 'ACTIVE', 'b': 'ACTIVE', 'c': 'ACTIVE'},
+        )
+        results = waiters.wait_for_zones_status(
+            list_zones, ['a', 'b', 'c'], ['ACTIVE'], interval=0, timeout=5,
+        )
+        self.assertTrue(all(r.succeeded for r in results.values()))
+        self.assertEqual(results['c'].polls, 1)
+        self.assertEqual(results['a'].polls, 2)
+        self.assertEqual(results['b'].polls, 3)
+        self.assertEqual([s for _, s in results['b'].transitions],
+                         ['PENDING', 'ACTIVE'])
+
+    def test_wait_for_zones_status_failures(self):
+        list_zones = self.listing(
+            {'a': 'ERROR', 'b': 'PENDING'},
+        )
+        results = waiters.wait_for_zones_status(
+            list_zones, ['a', 'b', 'c'], ['ACTIVE'], interval=0.01,
+            timeout=0.05, failure_statuses=['ERROR'],
+        )
+        self.assertEqual(results['a'].outcome, waiters.WaitResult.FAILURE)
+        self.assertEqual(results['a'].polls, 1)
+        self.assertEqual(results['b'].outcome, waiters.WaitResult.TIMEOUT)
+        self.assertEqual(results['c'].outcome, waiters.WaitResult.TIMEOUT)
+        self.assertEqual(results['c'].state, 'missing')
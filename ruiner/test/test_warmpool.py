@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import mock
+
+from ruiner.common import warmpool
+from ruiner.common.environments import Environment
+from ruiner.test import base
+
+
+class TestWarmPool(base.BaseTest):
+
+    def setUp(self):
+        super(TestWarmPool, self).setUp()
+        self.pool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pool_dir)
+        warmpool.init_pool_dir(self.pool_dir)
+
+    def publish(self, fingerprint, project_name):
+        env = Environment(
+            fingerprint=fingerprint,
+            project_name=project_name,
+            compose_files=['base.yml'],
+            carina_dir='./fake-designate-carina',
+            designate_yaml='designate.yml',
+            designate_image='designate-base:abc',
+        )
+        name = "%s_%s.json" % (fingerprint, project_name)
+        with open(os.path.join(self.pool_dir, 'ready', name), 'w') as f:
+            json.dump(env.to_dict(), f)
+
+    def test_lease_empty_pool(self):
+        self.assertIsNone(warmpool.lease(self.pool_dir, 'abc'))
+
+    def test_lease_and_release(self):
+        self.publish('abc', 'ruin_designate_1')
+        self.publish('def', 'ruin_designate_2')
+
+        env = warmpool.lease(self.pool_dir, 'abc')
+        self.assertEqual(env.project_name, 'ruin_designate_1')
+        self.assertEqual(env.compose_files, ['base.yml'])
+        self.assertEqual(warmpool.list_entries(self.pool_dir, 'leased'),
+                         ['abc_ruin_designate_1.json'])
+        self.assertIsNone(warmpool.lease(self.pool_dir, 'abc'))
+
+        warmpool.release(self.pool_dir, env)
+        self.assertIsNone(env.lease_file)
+        self.assertEqual(warmpool.list_entries(self.pool_dir, 'leased'), [])
+        self.assertEqual(warmpool.list_entries(self.pool_dir, 'released'),
+                         ['abc_ruin_designate_1.json'])
+        self.assertEqual(warmpool.list_entries(self.pool_dir, 'ready'),
+                         ['def_ruin_designate_2.json'])
+
+    def test_lease_records_owner(self):
+        self.publish('abc', 'ruin_designate_1')
+        env = warmpool.lease(self.pool_dir, 'abc')
+        _, owner = warmpool.read_entry(env.lease_file)
+        self.assertEqual(owner['pid'], os.getpid())
+
+        warmpool.release(self.pool_dir, env)
+        env, _ = warmpool.read_entry(os.path.join(
+            self.pool_dir, 'released', 'abc_ruin_designate_1.json'))
+        self.assertEqual(env.project_name, 'ruin_designate_1')
+
+    @mock.patch.object(warmpool.WarmPool, 'destroy')
+    @mock.patch('ruiner.common.environments.init_tmp_dir')
+    def test_reap_stale_leases(self, _, destroy):
+        for i in range(3):
+            self.publish('abc', 'ruin_designate_%s' % i)
+        live = warmpool.lease(self.pool_dir, 'abc')
+        dead = warmpool.lease(self.pool_dir, 'abc')
+        ownerless = warmpool.lease(self.pool_dir, 'abc')
+
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        data = dead.to_dict()
+        data['owner'] = {'pid': proc.pid, 'leased_at': time.time()}
+        warmpool.write_entry(dead.lease_file, data)
+        warmpool.write_entry(ownerless.lease_file, ownerless.to_dict())
+
+        pool = warmpool.WarmPool('./fake-designate-carina', self.pool_dir, 1,
+                                 logger=self.log)
+        with mock.patch.object(warmpool, 'OWNERLESS_LEASE_TIMEOUT', -1):
+            pool.reap_stale_leases()
+        for thread in pool._threads:
+            thread.join()
+
+        self.assertEqual(
+            sorted(c[0][0].project_name for c in destroy.call_args_list),
+            [dead.project_name, ownerless.project_name])
+        self.assertEqual(warmpool.list_entries(self.pool_dir, 'leased'),
+                         [os.path.basename(live.lease_file)])
+
+    def test_in_use_projects(self):
+        for i in range(4):
+            self.publish('abc', 'ruin_designate_%s' % i)
+        warmpool.lease(self.pool_dir, 'abc')
+        dead = warmpool.lease(self.pool_dir, 'abc')
+        warmpool.release(self.pool_dir, warmpool.lease(self.pool_dir, 'abc'))
+
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        data = dead.to_dict()
+        data['owner'] = {'pid': proc.pid, 'leased_at': time.time()}
+        warmpool.write_entry(dead.lease_file, data)
+
+        self.assertEqual(warmpool.in_use_projects(self.pool_dir),
+                         set(['ruin_designate_0', 'ruin_designate_3']))